@@ -0,0 +1,183 @@
+# Synthetic GADM / IR / hierarchy / LandScan inputs for benchmarking the pipeline offline
+#
+# Countries are laid out on a grid. Each country is a block of ADM1 rows by ADM2 columns of square
+# cells, each ADM2 is split into two GADM rows (as GADM's deeper levels are), and IRs are built
+# from the ADM2 cells with the same relation patterns as the real data:
+#   one IR = one ADM2, one IR covering two ADM2s, one ADM2 split into two IRs,
+#   two IRs sharing two ADM2s (many-to-many), and one IR per country crossing ADM1s.
+# The generated tree mirrors the repository layout (data/..., outputs/), so the stage scripts run
+# unchanged with the fixture root as working directory.
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+NODATA = -2147483647
+CRS = "EPSG:4326"
+FIRST_ISOS = ["USA", "IND", "MEX", "CHN", "COL"]  # The --test countries of the stage scripts
+
+SCALES = {
+    # ADM2 count = countries × adm1 × adm2; pixels = resolution over the country grid
+    "country": dict(countries=1, adm1=8, adm2=25, cell=0.5, resolution=1 / 120, vertices=32, years=[2015]),
+    "region": dict(countries=20, adm1=10, adm2=25, cell=0.25, resolution=1 / 120, vertices=32, years=[2015]),
+    "world": dict(countries=250, adm1=12, adm2=15, cell=0.25, resolution=1 / 120, vertices=64, years=[2015]),
+}
+
+COUNTRIES_PER_ROW = 16
+
+
+def iso_codes(n):
+    letters = [chr(65 + i) for i in range(26)]
+    extra = (f"Q{a}{b}" for a in letters for b in letters)
+    return (FIRST_ISOS + [next(extra) for _ in range(max(0, n - len(FIRST_ISOS)))])[:n]
+
+
+def fingerprint(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def generate(root, countries, adm1, adm2, cell, resolution, vertices, years, seed=0):
+    """Write a synthetic input tree under `root` and return its size metadata."""
+    # Imported here so the benchmark driver stays small: a child process inherits the peak RSS
+    # of its parent, which would otherwise inflate every stage's measurement
+    import geopandas as gpd
+    import numpy as np
+    import pandas as pd
+    import rasterio
+    import shapely
+    from rasterio.transform import from_origin
+
+    def _cell(x, y):
+        # A square ADM2 cell with about `vertices` vertices, so geometry work scales like real borders
+        return shapely.segmentize(shapely.box(x, y, x + cell, y + cell), max_segment_length=4 * cell / vertices)
+
+    rng = np.random.default_rng(seed)
+    for folder in ("data/gadm36_shp", "data/world-combo-new", "outputs"):
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+
+    gadm_rows, gadm2_rows, ir_rows, hierarchy = [], [], [], []
+    object_id = agglomid = id_1 = id_2 = 0
+    block_width, block_height = adm2 * cell + cell, adm1 * cell + cell
+    for c, iso in enumerate(iso_codes(countries)):
+        x0 = (c % COUNTRIES_PER_ROW) * block_width
+        y0 = (c // COUNTRIES_PER_ROW) * block_height
+        cells = {}  # (row, col) -> OBJECTID, cell geometry
+        for row in range(adm1):
+            id_1 += 1
+            for col in range(adm2):
+                id_2 += 1
+                object_id += 1
+                x, y = x0 + col * cell, y0 + row * cell
+                geom = _cell(x, y)
+                cells[row, col] = (object_id, geom)
+                gadm2_rows.append(dict(OBJECTID=object_id, ISO=iso, ID_1=id_1, NAME_1=f"{iso} p{row}",
+                                       ID_2=id_2, NAME_2=f"{iso} d{id_2}"))
+                for half in range(2):
+                    part = shapely.clip_by_rect(geom, x, y + half * cell / 2, x + cell, y + (half + 1) * cell / 2)
+                    gadm_rows.append(dict(GID_0=iso, NAME_0=iso, ID_1=id_1, NAME_1=f"{iso} p{row}",
+                                          ID_2=id_2, NAME_2=f"{iso} d{id_2}", geometry=part))
+
+        def add_ir(keys, geom):
+            nonlocal agglomid
+            agglomid += 1
+            hierarchy.append({
+                "region-key": f"{iso}.{agglomid}", "parent-key": iso, "name": f"ir{agglomid}", "alternatives": "",
+                "is_terminal": True, "gadmid": " ".join(str(cells[key][0]) for key in keys),
+                "agglomid": agglomid, "notes": "",
+            })
+            ir_rows.append(dict(hierid=f"{iso}.{agglomid}", color=agglomid, ISO=iso, geometry=geom))
+
+        def halves(key):
+            x, y, _, _ = shapely.bounds(cells[key][1])
+            left = shapely.clip_by_rect(cells[key][1], x, y, x + cell / 2, y + cell)
+            right = shapely.clip_by_rect(cells[key][1], x + cell / 2, y, x + cell, y + cell)
+            return left, right
+
+        # One IR crossing the first two ADM1s in the last column
+        used = set()
+        if adm1 > 1:
+            keys = [(0, adm2 - 1), (1, adm2 - 1)]
+            add_ir(keys, shapely.union_all([cells[key][1] for key in keys]))
+            used.update(keys)
+
+        # Cycle through the relation patterns along each ADM1 row
+        for row in range(adm1):
+            cols = [col for col in range(adm2) if (row, col) not in used]
+            pattern = 0
+            while cols:
+                if pattern % 4 == 1 and len(cols) >= 2:  # One IR covering two ADM2s
+                    keys = [(row, cols.pop(0)), (row, cols.pop(0))]
+                    add_ir(keys, shapely.union_all([cells[key][1] for key in keys]))
+                elif pattern % 4 == 2:  # One ADM2 split into two IRs
+                    key = (row, cols.pop(0))
+                    for half in halves(key):
+                        add_ir([key], half)
+                elif pattern % 4 == 3 and len(cols) >= 2:  # Two IRs sharing two ADM2s
+                    keys = [(row, cols.pop(0)), (row, cols.pop(0))]
+                    left, right = halves(keys[0])[0], shapely.union_all([halves(keys[0])[1], cells[keys[1]][1]])
+                    add_ir(keys, left)
+                    add_ir(keys, right)
+                else:  # One IR = one ADM2
+                    key = (row, cols.pop(0))
+                    add_ir([key], cells[key][1])
+                pattern += 1
+
+    gpd.GeoDataFrame(gadm_rows, crs=CRS).to_file(os.path.join(root, "data/gadm36_shp/gadm36.shp"))
+    pd.DataFrame(gadm2_rows).to_csv(os.path.join(root, "data/gadm2.csv"), index=False)
+    gpd.GeoDataFrame(ir_rows, crs=CRS).to_file(os.path.join(root, "data/world-combo-new/agglomerated-world-new.shp"))
+    with open(os.path.join(root, "data/hierarchy.csv"), "w") as f:
+        for i in range(31):  # 01_link_ir_to_adm.py skips a 31-line metadata header
+            f.write(f"# metadata line {i}\n")
+        pd.DataFrame(hierarchy).to_csv(f, index=False)
+
+    # Population rasters over the whole country grid (plus a margin), with some nodata pixels
+    n_rows = -(-countries // COUNTRIES_PER_ROW)
+    width = int(round((min(countries, COUNTRIES_PER_ROW) * block_width + 2) / resolution))
+    height = int(round((n_rows * block_height + 2) / resolution))
+    transform = from_origin(-1.0, n_rows * block_height + 1.0, resolution, resolution)
+    for year in years:
+        folder = os.path.join(root, f"data/landscan/landscan-global-{year}-assets")
+        os.makedirs(folder, exist_ok=True)
+        profile = dict(driver="GTiff", height=height, width=width, count=1, dtype="int32", crs=CRS,
+                       transform=transform, nodata=NODATA, tiled=True, blockxsize=256, blockysize=256,
+                       compress="deflate")
+        with rasterio.open(os.path.join(folder, f"landscan-global-{year}.tif"), "w", **profile) as dst:
+            for _, window in dst.block_windows(1):
+                block = rng.integers(0, 100, size=(window.height, window.width), dtype=np.int32)
+                block[rng.random(block.shape) < 0.05] = NODATA
+                dst.write(block, 1, window=window)
+
+    return {
+        "countries": countries,
+        "adm2": len(gadm2_rows),
+        "gadm_polygons": len(gadm_rows),
+        "irs": len(ir_rows),
+        "links": int(sum(len(row["gadmid"].split()) for row in hierarchy)),
+        "pixels": width * height,
+        "years": list(years),
+    }
+
+
+def ensure(scale, workdir, overrides=None):
+    """Generate (or reuse) the fixture of a named scale; returns (root, metadata)."""
+    params = dict(SCALES[scale], **(overrides or {}))
+    root = os.path.join(workdir, f"{scale}-{fingerprint(params)}")
+    meta_path = os.path.join(root, "fixture.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            return root, json.load(f)
+    print(f"Generating '{scale}' fixture in {root}...")
+    subprocess.run([sys.executable, os.path.abspath(__file__), root, json.dumps(params)], check=True)
+    with open(meta_path) as f:
+        return root, json.load(f)
+
+
+if __name__ == "__main__":
+    # Generate one fixture in its own process: python benchmarks/fixtures.py ROOT PARAMS_JSON
+    root, params = sys.argv[1], json.loads(sys.argv[2])
+    meta = generate(root, **params)
+    meta["params"] = params
+    with open(os.path.join(root, "fixture.json"), "w") as f:
+        json.dump(meta, f, indent=2)
@@ -0,0 +1,223 @@
+# Benchmark the pipeline stages on synthetic inputs and keep a JSON history across commits
+#
+# Each stage script runs as a subprocess in a generated fixture tree (see fixtures.py), so no real
+# GADM/LandScan data or network access is needed. Wall time, CPU time, peak RSS and throughput
+# (polygons/s, pixels/s, rows/s) are appended to a history file that can be compared by commit.
+#
+# Usage:
+#     python benchmarks/run.py --scale country                       # all default stages
+#     python benchmarks/run.py --scale region --stages 03 04 06 --repeat 3
+#     python benchmarks/run.py --scale world --workers 8 --compare   # against the previous commit
+#     python benchmarks/run.py --scale region --no-run --compare a1b2c3d
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+import fixtures
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_DIR = os.path.join(REPO_DIR, "scripts")
+HISTORY_PATH = os.path.join(REPO_DIR, "benchmarks", "history.json")
+WORKDIR = os.path.join(tempfile.gettempdir(), "ir-adm-benchmarks")
+
+
+@dataclass
+class BenchStage:
+    name: str
+    script: str
+    args: list = field(default_factory=list)
+    sharded: bool = False  # Takes the --workers option of shards.py
+    items: dict = field(default_factory=dict)  # Unit -> key of the fixture metadata (or a callable)
+
+
+def stages_for(meta):
+    years = [str(year) for year in meta["years"]]
+    n_years = len(years)
+    return [
+        BenchStage("cache", "geocache.py", items={"polygons/s": lambda m: m["gadm_polygons"] + m["irs"]}),
+        BenchStage("01", "01_link_ir_to_adm.py", items={"rows/s": "links"}),
+        BenchStage("02", "02_summarize_ir_adm_relations.py", items={"rows/s": "links"}),
+        BenchStage("03", "03_extract_population.py", ["--years"] + years, sharded=True,
+                   items={"polygons/s": "gadm_polygons", "pixels/s": lambda m: m["pixels"] * n_years}),
+        BenchStage("03-center", "03_extract_population.py", ["--years"] + years + ["--coverage", "center"],
+                   sharded=True, items={"polygons/s": "gadm_polygons", "pixels/s": lambda m: m["pixels"] * n_years}),
+        BenchStage("03-stream", "03_extract_population.py", ["--years"] + years + ["--method", "stream"],
+                   items={"polygons/s": "gadm_polygons", "pixels/s": lambda m: m["pixels"] * n_years}),
+        BenchStage("04", "04_create_netcdf.py", items={"rows/s": lambda m: m["adm2"] * n_years}),
+        BenchStage("05", "05_country_ir_geojson.py", sharded=True, items={"polygons/s": "irs"}),
+        BenchStage("06", "06_generate_adm2_geojson_by_country.py", sharded=True, items={"polygons/s": "adm2"}),
+        BenchStage("07", "07_rasterize_adm2_labels.py", items={"pixels/s": "pixels"}),
+        BenchStage("03-labels", "03_extract_population.py", ["--years"] + years + ["--method", "labels"],
+                   items={"pixels/s": lambda m: m["pixels"] * n_years}),
+        BenchStage("10", "10_ir_adm2_population.py", ["--years"] + years,
+                   items={"pixels/s": lambda m: m["pixels"] * n_years}),
+    ]
+
+
+DEFAULT_STAGES = ["cache", "01", "02", "03", "04", "05", "06"]
+
+
+def run_stage(root, stage, workers, log_path):
+    """Run one stage script in `root`; returns wall seconds, CPU seconds, peak RSS (MB) and exit code."""
+    args = stage.args + (["--workers", str(workers)] if stage.sharded and workers else [])
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(SCRIPTS_DIR, stage.script)] + args,
+            cwd=root, stdout=log, stderr=subprocess.STDOUT,
+        )
+        # wait4 gives the resource usage of this child and the worker processes it waited for
+        _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return wall, usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024, process.returncode
+
+
+def throughput(stage, meta, wall):
+    rates = {}
+    for unit, key in stage.items.items():
+        count = key(meta) if callable(key) else meta[key]
+        rates[unit] = count / wall if wall > 0 else None
+    return rates
+
+
+def git_commit():
+    def git(*args):
+        result = subprocess.run(["git", *args], cwd=REPO_DIR, capture_output=True, text=True)
+        return result.stdout.strip() if result.returncode == 0 else ""
+    return git("rev-parse", "--short", "HEAD") or None, bool(git("status", "--porcelain", "--untracked-files=no"))
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_history(path, history):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(history, f, indent=2)
+
+
+def find_reference(history, record, ref):
+    # The latest earlier record of the same scale from `ref` (a commit prefix), or from another commit
+    candidates = [
+        other for other in history
+        if other is not record and other["scale"] == record["scale"] and other["params"] == record["params"]
+    ]
+    if ref:
+        candidates = [other for other in candidates if (other["commit"] or "").startswith(ref)]
+    else:
+        candidates = [other for other in candidates if other["commit"] != record["commit"]] or candidates
+    return candidates[-1] if candidates else None
+
+
+def print_table(record, reference=None):
+    header = f"{'stage':<10} {'wall s':>9} {'cpu s':>9} {'peak MB':>9}  throughput"
+    if reference:
+        header += f"  | vs {reference['commit']}: wall, peak"
+    print(header)
+    for name, result in record["stages"].items():
+        rates = ", ".join(f"{rate:,.0f} {unit}" for unit, rate in result["throughput"].items() if rate)
+        line = f"{name:<10} {result['wall_s']:>9.2f} {result['cpu_s']:>9.2f} {result['peak_rss_mb']:>9.0f}  {rates}"
+        before = reference["stages"].get(name) if reference else None
+        if before:
+            line += f"  | {result['wall_s'] / before['wall_s']:.2f}x, {result['peak_rss_mb'] / before['peak_rss_mb']:.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data.")
+    parser.add_argument("--scale", choices=sorted(fixtures.SCALES), default="country")
+    parser.add_argument("--countries", type=int, help="Override the number of countries of the scale")
+    parser.add_argument("--years", nargs="+", type=int, help="Override the raster years of the scale")
+    parser.add_argument("--stages", nargs="+", default=DEFAULT_STAGES,
+                        help="Stages to time, in order (also available: 03-center 03-stream 07 03-labels 10)")
+    parser.add_argument("--workers", type=int, help="--workers passed to the sharded stages (03, 05, 06)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per stage; the fastest is recorded")
+    parser.add_argument("--workdir", default=WORKDIR, help="Where fixtures are generated and reused")
+    parser.add_argument("--history", default=HISTORY_PATH, help="JSON history file")
+    parser.add_argument("--compare", nargs="?", const="", metavar="COMMIT",
+                        help="Compare with the latest record of COMMIT (default: of another commit)")
+    parser.add_argument("--no-run", action="store_true", help="Only compare the latest recorded run")
+    options = parser.parse_args()
+
+    overrides = {}
+    if options.countries:
+        overrides["countries"] = options.countries
+    if options.years:
+        overrides["years"] = options.years
+    history = load_history(options.history)
+
+    if options.no_run:
+        params = dict(fixtures.SCALES[options.scale], **overrides)
+        records = [record for record in history if record["scale"] == options.scale and record["params"] == params]
+        if not records:
+            raise SystemExit(f"No recorded '{options.scale}' runs in {options.history}")
+        record = records[-1]
+    else:
+        root, meta = fixtures.ensure(options.scale, options.workdir, overrides)
+        print(f"Fixture: {meta['countries']} countries, {meta['adm2']} ADM2s, {meta['irs']} IRs, "
+              f"{meta['pixels']:,} pixels x {len(meta['years'])} years")
+        log_dir = os.path.join(root, "logs")
+        os.makedirs(log_dir, exist_ok=True)
+
+        by_name = {stage.name: stage for stage in stages_for(meta)}
+        unknown = [name for name in options.stages if name not in by_name]
+        if unknown:
+            raise SystemExit(f"Unknown stages: {', '.join(unknown)}")
+
+        commit, dirty = git_commit()
+        record = {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "scale": options.scale,
+            "params": meta["params"],
+            "fixture": {key: value for key, value in meta.items() if key != "params"},
+            "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+            "workers": options.workers,
+            "stages": {},
+        }
+        for name in options.stages:
+            stage = by_name[name]
+            runs = []
+            for _ in range(max(1, options.repeat)):
+                log_path = os.path.join(log_dir, f"{name}.log")
+                wall, cpu, peak, returncode = run_stage(root, stage, options.workers, log_path)
+                if returncode != 0:
+                    raise SystemExit(f"Stage {name} failed (exit {returncode}), see {log_path}")
+                runs.append((wall, cpu, peak))
+            wall, cpu, _ = min(runs)
+            peak = max(run[2] for run in runs)
+            record["stages"][name] = {
+                "wall_s": round(wall, 4),
+                "cpu_s": round(cpu, 4),
+                "peak_rss_mb": round(peak, 1),
+                "throughput": throughput(stage, meta, wall),
+                "runs": len(runs),
+            }
+            print(f"[{name}] {wall:.2f}s, peak {peak:.0f} MB")
+
+        history.append(record)
+        save_history(options.history, history)
+        print(f"Recorded run of {commit}{' (dirty)' if dirty else ''} in {options.history}")
+
+    reference = find_reference(history, record, options.compare) if options.compare is not None else None
+    if options.compare is not None and reference is None:
+        print("No earlier run to compare with.")
+    print_table(record, reference)
+
+
+if __name__ == "__main__":
+    main()
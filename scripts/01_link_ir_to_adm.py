@@ -1,34 +1,83 @@
 # Link each Impact Region (IR) with ADM2/ADM1 regions using the hierarchy and GADM tables
 
-import pandas as pd
+import os
 
-# Load hierarchy file (skip metadata header)
-hierarchy_df = pd.read_csv("./data/hierarchy.csv", skiprows=31)
-gadm_df = pd.read_csv("./data/gadm2.csv")  # Contains OBJECTID, ID_1, ID_2, NAME_1, NAME_2, ISO
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv
 
-# Filter terminal IRs that contain GADM regions
-irs = hierarchy_df[
-    (hierarchy_df["is_terminal"] == True) &
-    (hierarchy_df["gadmid"].notnull()) &
-    (hierarchy_df["gadmid"].str.strip() != "")
-].copy()
+from instrument import Instrument
+from link_diff import CHANGES_PATH, describe_changes, write_changes
+from link_table import LINKS_CSV, LINKS_PARQUET, PANDAS_TYPES, add_codes, split_ids, to_csv, write_links
+
+output_parquet = LINKS_PARQUET  # Read by 02, 04 and 06
+output_csv = LINKS_CSV  # Same table as text, for use outside the pipeline
+
+run = Instrument("01")
 
-# Expand gadmid strings to rows
-irs["gadmid_list"] = irs["gadmid"].str.split()
-irs_expanded = irs.explode("gadmid_list").rename(columns={"gadmid_list": "OBJECTID"})
+# Load hierarchy file (skip metadata header), parsed straight to typed Arrow columns
+run.begin("load")
+hierarchy = csv.read_csv(
+    "./data/hierarchy.csv",
+    read_options=csv.ReadOptions(skip_rows=31),
+    convert_options=csv.ConvertOptions(
+        include_columns=["region-key", "is_terminal", "gadmid", "agglomid"],
+        column_types={"region-key": pa.string(), "is_terminal": pa.bool_(), "gadmid": pa.string(),
+                      "agglomid": pa.int64()},
+    ),
+)
+gadm_columns = ["OBJECTID", "ISO", "ID_1", "NAME_1", "ID_2", "NAME_2"]
+gadm = csv.read_csv(
+    "./data/gadm2.csv",  # Contains OBJECTID, ID_1, ID_2, NAME_1, NAME_2, ISO
+    convert_options=csv.ConvertOptions(
+        include_columns=gadm_columns,
+        column_types={"OBJECTID": pa.int64(), "ISO": pa.string(), "ID_1": pa.int32(), "NAME_1": pa.string(),
+                      "ID_2": pa.int32(), "NAME_2": pa.string()},
+    ),
+)
+run.count(hierarchy.num_rows + gadm.num_rows)
+
+# Filter terminal IRs that contain GADM regions
+run.begin("filter", items=hierarchy.num_rows)
+gadmid = pc.utf8_trim_whitespace(hierarchy["gadmid"])
+irs = hierarchy.filter(pc.and_kleene(
+    pc.fill_null(hierarchy["is_terminal"], False), pc.fill_null(pc.not_equal(gadmid, ""), False),
+)).select(["agglomid", "region-key", "gadmid"]).to_pandas(types_mapper=PANDAS_TYPES.get)
 
-# Match OBJECTIDs with GADM table
-irs_expanded["OBJECTID"] = irs_expanded["OBJECTID"].astype(str)
-gadm_df["OBJECTID"] = gadm_df["OBJECTID"].astype(str)
+# Expand gadmid lists to one row per integer OBJECTID
+run.begin("join", hot=True)
+rows, objectids = split_ids(irs["gadmid"])
+irs_expanded = irs.iloc[rows].drop(columns="gadmid").reset_index(drop=True)
+irs_expanded["OBJECTID"] = objectids
 
-# Merge to attach ADM info
-merged = pd.merge(irs_expanded, gadm_df, on="OBJECTID", how="left")
+# Merge to attach ADM info, on integer OBJECTIDs
+gadm_df = gadm.to_pandas(types_mapper=PANDAS_TYPES.get)
+merged = irs_expanded.merge(gadm_df, on="OBJECTID", how="left")
+run.count(len(merged))
 
-# Select relevant columns
-final = merged[[
+# Select relevant columns, with the integer ADM2/ADM1 codes used by the later stages
+final = add_codes(merged[[
     "agglomid", "region-key", "OBJECTID", "ISO", "ID_1", "NAME_1", "ID_2", "NAME_2"
-]]
+]])
 
-# Save result
-final.to_csv("./outputs/ir_to_adm2_adm1.csv", index=False)
-print("Output saved: ir_to_adm2_adm1.csv")
+# Save result, and record which rows changed since the previous run for the incremental stages
+run.begin("write", items=len(final))
+new_parquet = output_parquet.replace(".parquet", ".new.parquet")
+write_links(final, new_parquet)
+changes = describe_changes(output_parquet, new_parquet)
+if changes["base"] == changes["target"] and os.path.exists(output_csv):
+    # Unchanged: keep the previous files, so nothing downstream is considered stale
+    os.remove(new_parquet)
+    print("Output unchanged: ir_to_adm2_adm1.parquet")
+else:
+    os.replace(new_parquet, output_parquet)
+    to_csv(final, output_csv)
+    print("Output saved: ir_to_adm2_adm1.parquet and ir_to_adm2_adm1.csv")
+if changes["full"]:
+    print("No comparable previous mapping: all countries changed")
+else:
+    print(f"{changes['rows_removed']} rows removed, {changes['rows_added']} added: "
+          f"{len(changes['agglomid'])} IRs, {len(changes['adm2'])} ADM2s in {len(changes['countries'])} countries")
+write_changes(changes)
+print(f"Changes saved: {CHANGES_PATH}")
+run.finish()
@@ -2,34 +2,59 @@
 
 import pandas as pd
 
-df = pd.read_csv("./outputs/ir_to_adm2_adm1.csv")
+from instrument import Instrument
+from link_table import read_links
+from relations import (
+    CASE_ADM2_MULTI_IR, CASE_IR_MULTI_ADM2, CASE_MANY_TO_MANY, CASE_ONE_TO_ONE, classify_links, component_table,
+)
 
-# Total counts
-total_irs = df["agglomid"].nunique()
-total_adm2 = df[["ISO", "ID_1", "ID_2"]].drop_duplicates().shape[0]
+run = Instrument("02")
+
+run.begin("load")
+df = read_links(columns=["agglomid", "ISO", "adm2_code", "adm1_code"])
+run.count(len(df))
 
-# ADM2s that contain multiple IRs
-adm2_grouped = df.groupby(["ISO", "ID_1", "ID_2"])["agglomid"].nunique().reset_index()
-adm2_multi_ir = adm2_grouped[adm2_grouped["agglomid"] > 1].shape[0]
+# Integer-coded IR–ADM2 graph with per-IR/per-ADM2 degrees and cases, built once on the ADM codes of 01
+run.begin("classify", items=len(df), hot=True)
+links = classify_links(df, adm2_columns=["adm2_code"], adm1_columns=["adm1_code"])
+irs = links.drop_duplicates("ir_code")
+adm2s = links[links["adm2_code"] >= 0].drop_duplicates("adm2_code")  # Links without a GADM match have no ADM2
+components = component_table(links)
+
+# Total counts
+total_irs = len(irs)
+total_adm2 = len(adm2s)
 
-# IRs that contain multiple ADM2s
-ir_grouped = df.groupby("agglomid")[["ID_2"]].nunique().reset_index()
-ir_multi_adm2 = ir_grouped[ir_grouped["ID_2"] > 1].shape[0]
+# ADM2s that contain multiple IRs, and IRs that contain multiple ADM2s
+adm2_multi_ir = int((adm2s["adm2_n_irs"] > 1).sum())
+ir_multi_adm2 = int((irs["ir_n_adm2"] > 1).sum())
 
 # Save summary
+run.begin("write")
 summary_df = pd.DataFrame({
     "metric": [
         "Total IRs",
         "Total ADM2s",
         "ADM2s with multiple IRs",
-        "IRs covering multiple ADM2s"
+        "IRs covering multiple ADM2s",
+        "IRs crossing multiple ADM1s",
+        "Case 1 components (IR = ADM2)",
+        "Case 2 components (IR covers multiple ADM2s)",
+        "Case 3 components (ADM2 = multiple IRs)",
+        "Case 5 components (many-to-many)",
     ],
     "count": [
         total_irs,
         total_adm2,
         adm2_multi_ir,
-        ir_multi_adm2
+        ir_multi_adm2,
+        int(irs["crosses_adm1"].sum()),
+        int((components["case"] == CASE_ONE_TO_ONE).sum()),
+        int((components["case"] == CASE_IR_MULTI_ADM2).sum()),
+        int((components["case"] == CASE_ADM2_MULTI_IR).sum()),
+        int((components["case"] == CASE_MANY_TO_MANY).sum()),
     ]
 })
 summary_df.to_csv("./outputs/ir_adm_stats.csv", index=False)
 print("Summary saved: ir_adm_stats.csv")
+run.finish()
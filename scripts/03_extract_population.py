@@ -1,43 +1,236 @@
-# Extract population from LandScan raster and assign it to ADM2 units for a given year
+# Extract population from LandScan rasters and assign it to ADM2 units for one or more years
+#
+# Usage: python scripts/03_extract_population.py --years 2015 2018-2020 [--countries IND MEX] [--resume]
+#        [--coverage center] [--method stream --memory-limit 0.5]
 
-import geopandas as gpd
-from rasterstats import zonal_stats
+import argparse
+import numpy as np
 import pandas as pd
 import os
 
+from block_stream import stream_sums
+from geocache import read_gadm
+from instrument import Instrument
+from label_grid import ADM2_KEYS, label_sums
+from shards import add_arguments, report_failures, run_from_options, select_countries
+from zonal import COVERAGES, zonal_sums
+
 # Parameters
-year = 2015
-shapefile_path = "./data/gadm36_shp/gadm36.shp"
-raster_path = f"./data/landscan/landscan-global-{year}-assets/landscan-global-{year}.tif"
-output_csv = f"./outputs/population_by_adm2_{year}.csv"
-
-# Read GADM shapefile
-gdf = gpd.read_file(shapefile_path)
-
-# Optional test mode: process only a subset of countries
-test_mode = True
-if test_mode:
-    target_countries = ["USA", "IND", "MEX", "CHN", "COL"]
-    print(f"Using test mode. Only processing: {', '.join(target_countries)}")
-    gdf = gdf[gdf["GID_0"].isin(target_countries)]
-
-# Run zonal statistics to extract population sum per geometry
-print("Calculating population per geometry...")
-stats = zonal_stats(gdf, raster_path, stats="sum")
-
-# Attach population to attribute data
-df_ids = gdf[["GID_0", "ID_1", "NAME_1", "ID_2", "NAME_2"]].copy()
-df_ids["population"] = [s["sum"] for s in stats]
-
-# Group by ADM2 units and sum population across geometries
-print("Aggregating population by ADM2...")
-pop_by_adm2 = df_ids.groupby(["GID_0", "ID_1", "NAME_1", "ID_2", "NAME_2"]).agg(
-    population=("population", "sum")
-).reset_index()
-
-# Add year column
-pop_by_adm2["year"] = year
-
-# Save result
-pop_by_adm2.to_csv(output_csv, index=False)
-print(f"Output saved: {output_csv}")
\ No newline at end of file
+years = [2015]  # Default when --years is not given
+raster_path_template = "./data/landscan/landscan-global-{year}-assets/landscan-global-{year}.tif"
+output_csv_template = "./outputs/population_by_adm2_{year}.csv"
+
+# Pixel coverage of the zonal method: "exact" weights each pixel by the fraction of its area inside
+# the ADM2, "center" counts the pixels whose center is inside (rasterstats' rule, faster). The exact
+# mode also writes, per ADM2, the population the center rule misses.
+coverage = "exact"
+coverage_report_template = "./outputs/population_coverage_{year}.csv"
+
+# Extraction method: "zonal" runs polygon zonal statistics; "labels" sums the raster with a
+# single bincount over the ADM2 label grid written by 07_rasterize_adm2_labels.py; "stream" walks
+# the rasters block by block under a memory cap (--memory-limit) and checkpoints its sums
+method = "zonal"
+label_raster_path = "./outputs/adm2_label_grid/adm2_labels.tif"
+label_table_path = "./outputs/adm2_label_grid/adm2_labels.csv"
+
+# Zonal engine: tile size (degrees) used to batch polygons, and worker processes for the tiles
+# when countries are processed one at a time (--workers 1)
+tile_size = 10.0
+n_workers = os.cpu_count()
+
+# Stream method: pixel memory budget in GB when --memory-limit is not given, and the checkpoint
+# it resumes from after an interruption (removed once the run completes)
+stream_memory_gb = 1.0
+stream_checkpoint_path = "./outputs/population_stream_checkpoint.npz"
+
+# Per-country results of the zonal method, merged into the yearly CSVs (reused with --resume)
+shard_path_templates = {
+    "center": "./outputs/population_shards/{year}/{iso}.csv",
+    "exact": "./outputs/population_shards/exact/{year}/{iso}.csv",
+}
+
+
+def parse_years(values):
+    # Accept single years and inclusive ranges such as "2000-2005"
+    parsed = []
+    for value in values:
+        if "-" in value:
+            start, end = (int(part) for part in value.split("-", 1))
+            parsed.extend(range(start, end + 1))
+        else:
+            parsed.append(int(value))
+    return sorted(set(parsed))
+
+
+def sum_by_adm2(gdf, population, n_years):
+    # Per-geometry sums (or the (exact, center) pair) to one row per ADM2, one column per year
+    columns = list(range(n_years))
+    if isinstance(population, tuple):
+        population, center = population
+        columns += [f"center_{j}" for j in range(n_years)]
+        population = np.hstack([population, center])
+
+    # Attach population to attribute data and sum it across the geometries of each ADM2
+    df_ids = gdf[ADM2_KEYS].reset_index(drop=True)
+    df_ids = pd.concat([df_ids, pd.DataFrame(population, columns=columns)], axis=1)
+    return df_ids.groupby(ADM2_KEYS)[columns].sum().reset_index()
+
+
+def extract_country(iso, run_years, zonal_workers=1, coverage="center"):
+    # Read this country's GADM geometries once for all years, only the needed columns
+    gdf = read_gadm(
+        columns=["ISO", "ID_1", "NAME_1", "ID_2", "NAME_2"], countries=[iso],
+    ).rename(columns={"ISO": "GID_0"})
+    raster_paths = [raster_path_template.format(year=year) for year in run_years]
+
+    # Run zonal statistics per geometry: one raster window per tile and year, one mask per polygon
+    population = zonal_sums(gdf, raster_paths, n_workers=zonal_workers, tile_size=tile_size, coverage=coverage)
+
+    # Group by ADM2 units and sum population across geometries, and save one shard per year
+    pop_by_adm2 = sum_by_adm2(gdf, population, len(raster_paths))
+    for j, year in enumerate(run_years):
+        shard_path = shard_path_templates[coverage].format(year=year, iso=iso)
+        os.makedirs(os.path.dirname(shard_path), exist_ok=True)
+        shard = pop_by_adm2[ADM2_KEYS].copy()
+        shard["population"] = pop_by_adm2[j]
+        if coverage == "exact":
+            shard["population_center"] = pop_by_adm2[f"center_{j}"]
+        shard.to_csv(shard_path, index=False)
+    return len(pop_by_adm2)
+
+
+def extract_with_zonal_stats(run_years, options, run):
+    # One shard per country, largest first; a single worker uses the pool for the tiles instead
+    countries, _ = select_countries(options)
+    shard_path_template = shard_path_templates[options.coverage]
+    pending = countries
+    if options.resume:
+        pending = [
+            iso for iso in countries
+            if not all(os.path.exists(shard_path_template.format(year=year, iso=iso)) for year in run_years)
+        ]
+        print(f"Resuming: reusing the shards of {len(countries) - len(pending)} countries")
+    zonal_workers = n_workers if options.workers == 1 else 1
+    print("Calculating population per geometry by country...")
+    with run.step("compute", hot=True) as step:
+        results, errors = run_from_options(
+            extract_country, options, args=(run_years, zonal_workers, options.coverage), countries=pending,
+        )
+        step.items = sum(results.values())
+    report_failures(errors)
+
+    # Merge the country shards, one column per year
+    print("Aggregating population by ADM2...")
+    run.begin("merge")
+    merged = None
+    for j, year in enumerate(run_years):
+        shards = [
+            pd.read_csv(shard_path_template.format(year=year, iso=iso), keep_default_na=False, na_values=[""])
+            for iso in countries
+        ]
+        pop_year = pd.concat(shards, ignore_index=True).rename(
+            columns={"population": j, "population_center": f"center_{j}"},
+        )
+        merged = pop_year if merged is None else merged.merge(pop_year, on=ADM2_KEYS, how="outer")
+    run.count(len(merged))
+    return merged.sort_values(ADM2_KEYS).reset_index(drop=True)
+
+
+def extract_with_label_grid(run_years, options, run):
+    raster_paths = [raster_path_template.format(year=year) for year in run_years]
+    label_table = pd.read_csv(label_table_path)
+
+    # One bincount pass per year over the label grid gives the population of every ADM2 at once
+    print("Summing population over the ADM2 label grid...")
+    with run.step("compute", items=len(label_table), hot=True):
+        sums = label_sums(label_raster_path, raster_paths, n_labels=len(label_table))
+    population = pd.DataFrame(sums[label_table["label"].to_numpy()], columns=range(len(raster_paths)))
+    label_table = pd.concat([label_table[ADM2_KEYS], population], axis=1)
+
+    # The label grid covers the world in one pass; keep only the selected countries
+    if options.countries or options.test:
+        countries, _ = select_countries(options)
+        print(f"Only keeping: {', '.join(sorted(countries))}")
+        label_table = label_table[label_table["GID_0"].isin(countries)]
+
+    return label_table.reset_index(drop=True)
+
+
+def extract_with_block_stream(run_years, options, run):
+    raster_paths = [raster_path_template.format(year=year) for year in run_years]
+    countries, _ = select_countries(options)
+    gdf = read_gadm(
+        columns=["ISO", "ID_1", "NAME_1", "ID_2", "NAME_2"], countries=countries,
+    ).rename(columns={"ISO": "GID_0"})
+
+    # One pass over the rasters in block order, whatever the size of the polygons
+    memory_limit = (options.memory_limit or stream_memory_gb) * 1024 ** 3
+    print(f"Streaming population sums for {len(gdf)} geometries in {len(countries)} countries...")
+    with run.step("compute", items=len(gdf), hot=True):
+        population = stream_sums(gdf, raster_paths, memory_limit, coverage=options.coverage,
+                                 checkpoint_path=stream_checkpoint_path, resume=options.resume)
+
+    run.begin("merge")
+    pop_by_adm2 = sum_by_adm2(gdf, population, len(raster_paths))
+    run.count(len(pop_by_adm2))
+    return pop_by_adm2.sort_values(ADM2_KEYS).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract LandScan population by ADM2.")
+    parser.add_argument("--years", nargs="+", default=[str(y) for y in years],
+                        help="Years or inclusive ranges (e.g. 2015 2018-2020)")
+    parser.add_argument("--method", choices=["zonal", "labels", "stream"], default=method,
+                        help="Extraction method (default: %(default)s)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Reuse the country shards of a previous run with the same years (zonal method), "
+                             "or continue from the last checkpoint (stream method)")
+    parser.add_argument("--coverage", choices=COVERAGES, default=coverage,
+                        help="Pixel coverage of the zonal method: exact area fractions, or 'center' for the "
+                             "faster center-point rule (default: %(default)s)")
+    add_arguments(parser)
+    options = parser.parse_args()
+    run_years = parse_years(options.years)
+    run = Instrument("03")
+
+    raster_paths = [raster_path_template.format(year=year) for year in run_years]
+    missing = [path for path in raster_paths if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"Missing LandScan rasters: {missing}")
+    print(f"Processing years: {', '.join(str(year) for year in run_years)}")
+
+    if options.method == "labels":
+        pop_by_adm2 = extract_with_label_grid(run_years, options, run)
+    elif options.method == "stream":
+        pop_by_adm2 = extract_with_block_stream(run_years, options, run)
+    else:
+        pop_by_adm2 = extract_with_zonal_stats(run_years, options, run)
+
+    # Save one file per year, in the format expected by 04_create_netcdf.py
+    run.begin("write", items=len(pop_by_adm2) * len(run_years))
+    for j, year in enumerate(run_years):
+        output_csv = output_csv_template.format(year=year)
+        pop_year = pop_by_adm2[ADM2_KEYS].copy()
+        pop_year["population"] = pop_by_adm2[j]
+        pop_year["year"] = year
+        pop_year.to_csv(output_csv, index=False)
+        print(f"Output saved: {output_csv}")
+
+        # Population the center-point rule misses (negative: counts too much) relative to exact coverage
+        if f"center_{j}" in pop_by_adm2.columns:
+            report = pop_by_adm2[ADM2_KEYS].copy()
+            report["population_exact"] = pop_by_adm2[j]
+            report["population_center"] = pop_by_adm2[f"center_{j}"]
+            report["missed"] = report["population_exact"] - report["population_center"]
+            report["missed_share"] = report["missed"] / report["population_exact"].where(report["population_exact"] > 0)
+            report["year"] = year
+            report_csv = coverage_report_template.format(year=year)
+            report.to_csv(report_csv, index=False)
+            empty = int(((report["population_center"].fillna(0) == 0) & (report["population_exact"] > 0)).sum())
+            print(f"Center-point rule: {report['missed'].abs().sum():,.0f} people misassigned, "
+                  f"{empty} ADM2s with no population; report saved: {report_csv}")
+    run.finish()
+
+
+if __name__ == "__main__":
+    main()
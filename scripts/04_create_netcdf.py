@@ -2,12 +2,19 @@
 
 import pandas as pd
 import numpy as np
+import xarray as xr
 from netCDF4 import Dataset
 import glob
 import re
 import os
 
+from instrument import Instrument
+from link_table import read_links
+
+run = Instrument("04")
+
 # Detect population files by year
+run.begin("load")
 population_files = sorted(glob.glob("./outputs/population_by_adm2_*.csv"))
 year_pattern = re.compile(r"(\d{4})")
 
@@ -36,6 +43,7 @@ if not pop_list:
     raise ValueError("No valid population files found to process.")
 
 population_df = pd.concat(pop_list, ignore_index=True)
+run.count(len(population_df))
 
 # Normalize column names
 if "ISO" not in population_df.columns and "GID_0" in population_df.columns:
@@ -45,51 +53,123 @@ if "ADM1_NAME" not in population_df.columns:
 if "ADM2_NAME" not in population_df.columns:
     population_df["ADM2_NAME"] = population_df["NAME_2"]
 
-# Load IR to ADM2 mapping
-mapping_df = pd.read_csv("./outputs/ir_to_adm2_adm1.csv")
+# Population per IR × ADM2 pair and year, written by 10_ir_adm2_population.py (optional)
+pair_population_path = "./outputs/ir_adm2_population.parquet"
 
-# Build ADM2 index
-adm2_keys = population_df[["ISO", "ID_1", "ID_2", "ADM1_NAME", "ADM2_NAME"]].drop_duplicates().reset_index(drop=True)
-adm2_keys["adm2_index"] = np.arange(len(adm2_keys))
+# Load IR to ADM2 mapping (typed Parquet written by 01: integer agglomid and ADM ids)
+mapping_df = read_links(columns=["agglomid", "region-key", "ISO", "ID_1", "ID_2"])
 
-# ADM1 index
-adm1_keys = adm2_keys[["ISO", "ID_1", "ADM1_NAME"]].drop_duplicates().reset_index(drop=True)
-adm1_keys["adm1_index"] = np.arange(len(adm1_keys))
+run.begin("index", items=len(population_df) + len(mapping_df), hot=True)
 
-# Add ADM1 index to ADM2
-adm2_keys = adm2_keys.merge(adm1_keys, on=["ISO", "ID_1", "ADM1_NAME"], how="left")
+# Build ADM2 index from integer group codes, sorted so that each country is a contiguous block
+adm2_columns = ["ISO", "ID_1", "ID_2", "ADM1_NAME", "ADM2_NAME"]
+population_df["adm2_index"] = population_df.groupby(adm2_columns, sort=True, dropna=False).ngroup()
+adm2_keys = (
+    population_df.drop_duplicates("adm2_index")
+    .sort_values("adm2_index")[adm2_columns + ["adm2_index"]]
+    .reset_index(drop=True)
+)
 
-# Merge population with indices
-pop = population_df.merge(adm2_keys, on=["ISO", "ID_1", "ID_2", "ADM1_NAME", "ADM2_NAME"], how="left")
+# ADM1 index
+adm2_keys["adm1_index"] = adm2_keys.groupby(["ISO", "ID_1", "ADM1_NAME"], sort=False, dropna=False).ngroup()
+adm1_keys = adm2_keys.drop_duplicates("adm1_index")[["ISO", "ID_1", "ADM1_NAME", "adm1_index"]].reset_index(drop=True)
 
-# Create population matrix
-years = sorted(pop["year"].unique())
-year_index = {year: i for i, year in enumerate(years)}
+# Create population matrix with a single bulk assignment
+years = np.sort(population_df["year"].unique())
 population_array = np.full((len(adm2_keys), len(years)), np.nan)
-
-for _, row in pop.iterrows():
-    i = row["adm2_index"]
-    j = year_index[row["year"]]
-    population_array[i, j] = row["population"]
+population_array[
+    population_df["adm2_index"].values,
+    np.searchsorted(years, population_df["year"].values)
+] = population_df["population"].values
 
 # Build IR→ADM2 matrix
 ir_keys = mapping_df[["agglomid"]].drop_duplicates().dropna().reset_index(drop=True)
 ir_keys["agglomid_index"] = np.arange(len(ir_keys))
 
-mapping_df = mapping_df.merge(adm2_keys, on=["ISO", "ID_1", "ID_2"], how="left")
-mapping_df = mapping_df.merge(ir_keys, on="agglomid", how="left")
-mapping_df = mapping_df.dropna(subset=["adm2_index", "agglomid_index"])
-mapping_df["adm2_index"] = mapping_df["adm2_index"].astype(int)
-mapping_df["agglomid_index"] = mapping_df["agglomid_index"].astype(int)
+mapping_df = mapping_df.merge(adm2_keys[["ISO", "ID_1", "ID_2", "adm2_index"]], on=["ISO", "ID_1", "ID_2"], how="inner")
+mapping_df["agglomid_index"] = pd.Index(ir_keys["agglomid"]).get_indexer(mapping_df["agglomid"])
+mapping_df = mapping_df[mapping_df["agglomid_index"] >= 0]
 
-ir_to_adm2_matrix = np.zeros((len(ir_keys), len(adm2_keys)), dtype=np.uint8)
-for _, row in mapping_df.iterrows():
-    ir_to_adm2_matrix[row["agglomid_index"], row["adm2_index"]] = 1
+# Store IR→ADM2 links in CSR form: row pointers per IR, ADM2 column indices and link weights
+links = (
+    mapping_df[["agglomid_index", "adm2_index"]]
+    .drop_duplicates()
+    .sort_values(["agglomid_index", "adm2_index"])
+)
+ir_to_adm2_indices = links["adm2_index"].values.astype(np.int32)
+ir_to_adm2_indptr = np.concatenate([
+    [0], np.cumsum(np.bincount(links["agglomid_index"].values, minlength=len(ir_keys)))
+]).astype(np.int64)
+ir_to_adm2_weight = np.ones(len(links), dtype=np.float32)
+
+# Population of each link by year, from the IR × ADM2 label histograms of 10_ir_adm2_population.py when
+# available: the weights that split an ADM2 across its IRs. Links without a shared pixel get 0, years
+# without a histogram NaN
+link_population = np.full((len(links), len(years)), np.nan)
+if os.path.exists(pair_population_path):
+    pairs = pd.read_parquet(pair_population_path)
+    pairs = pairs[pairs["year"].isin(years)]
+    pairs = pairs.merge(adm2_keys[["ISO", "ID_1", "ID_2", "adm2_index"]], on=["ISO", "ID_1", "ID_2"], how="inner")
+    pairs["agglomid_index"] = pd.Index(ir_keys["agglomid"]).get_indexer(pairs["agglomid"])
+    pairs = pairs[pairs["agglomid_index"] >= 0]
+    link_keys = links["agglomid_index"].to_numpy(np.int64) * len(adm2_keys) + links["adm2_index"].to_numpy(np.int64)
+    pair_keys = pairs["agglomid_index"].to_numpy(np.int64) * len(adm2_keys) + pairs["adm2_index"].to_numpy(np.int64)
+    position = np.minimum(np.searchsorted(link_keys, pair_keys), max(len(link_keys) - 1, 0))
+    on_link = (link_keys[position] == pair_keys) if len(link_keys) else np.zeros(len(pair_keys), dtype=bool)
+    link_population[:, np.isin(years, pairs["year"].unique())] = 0.0
+    np.add.at(link_population, (position[on_link], np.searchsorted(years, pairs["year"].to_numpy()[on_link])),
+              pairs["population"].to_numpy()[on_link])
+    linked_share = pairs.loc[on_link, "population"].sum() / max(pairs["population"].sum(), 1)
+    print(f"IR × ADM2 population weights: {linked_share:.1%} of the rasterized population is on IR→ADM2 links")
+else:
+    print(f"No {pair_population_path}: ir_to_adm2_population is left empty (NaN)")
 
 # Create adm2_to_adm1
 adm2_to_adm1 = adm2_keys["adm1_index"].values.astype(np.int32)
 
+# Metadata values shared by the NetCDF and Zarr outputs
+iso_values = adm2_keys["ISO"].fillna("").astype(str).values
+adm2_name_values = adm2_keys["ADM2_NAME"].fillna("").astype(str).values
+adm1_name_values = adm1_keys["ADM1_NAME"].fillna("").astype(str).values
+
+# Align region-key correctly using merge
+region_key_map = ir_keys.merge(
+    mapping_df[["agglomid", "region-key"]].drop_duplicates("agglomid"),
+    on="agglomid", how="left"
+)
+region_key_values = region_key_map["region-key"].fillna("").astype(str).values
+
+# Country blocks: ADM2s are sorted by ISO, so each country is the contiguous range
+# adm2[country_adm2_start : country_adm2_start + country_adm2_count]
+country_iso, country_adm2_start, country_adm2_count = np.unique(iso_values, return_index=True, return_counts=True)
+
+description = (
+    "This dataset provides total population by ADM2 region across years, a binary mapping from IRs to ADM2s "
+    "stored as a sparse CSR matrix (ir_to_adm2_indptr, ir_to_adm2_indices, ir_to_adm2_weight), "
+    "the population of each IR→ADM2 link by year (ir_to_adm2_population), IR identifiers, and metadata for "
+    "ADM2/ADM1. Useful for aggregation, disaggregation, and impact estimation."
+)
+
+zarr_path = "./outputs/impact_regions.zarr"
+
+# Chunking and compression: population is chunked by blocks of ADM2 (countries are contiguous) and
+# single years; the sparse link arrays in fixed-size blocks
+adm2_chunk = 1024
+link_chunk = 65536
+compression = {"zlib": True, "complevel": 4, "shuffle": True}
+
+
+def storage(*sizes):
+    # Chunked and compressed storage; chunks cannot exceed their dimension, so a variable with an
+    # empty dimension (e.g. no links) keeps the library's default layout, uncompressed (NetCDF
+    # rejects contiguous storage for it)
+    if min(sizes) == 0:
+        return {}
+    return {"chunksizes": list(sizes), **compression}
+
+
 # Create NetCDF
+run.begin("netcdf", items=len(adm2_keys) * len(years))
 os.makedirs("./outputs", exist_ok=True)
 ncfile = Dataset("./outputs/impact_regions.nc", mode="w", format="NETCDF4")
 
@@ -98,49 +178,121 @@ ncfile.createDimension("adm2", len(adm2_keys))
 ncfile.createDimension("adm1", len(adm1_keys))
 ncfile.createDimension("year", len(years))
 ncfile.createDimension("agglomid", len(ir_keys))
+ncfile.createDimension("agglomid_ptr", len(ir_keys) + 1)
+ncfile.createDimension("link", len(ir_to_adm2_indices))
+ncfile.createDimension("country", len(country_iso))
 
 # Variables
 years_var = ncfile.createVariable("year", np.int32, ("year",))
 years_var[:] = years
 
-population_var = ncfile.createVariable("population", np.float32, ("adm2", "year"))
+population_var = ncfile.createVariable(
+    "population", np.float32, ("adm2", "year"),
+    **storage(min(adm2_chunk, len(adm2_keys)), min(1, len(years)))
+)
 population_var[:, :] = population_array
 
-adm2_to_adm1_var = ncfile.createVariable("adm2_to_adm1", np.int32, ("adm2",))
+adm2_to_adm1_var = ncfile.createVariable(
+    "adm2_to_adm1", np.int32, ("adm2",), **storage(min(adm2_chunk, len(adm2_keys)))
+)
 adm2_to_adm1_var[:] = adm2_to_adm1
 
-ir_to_adm2_var = ncfile.createVariable("ir_to_adm2", np.uint8, ("agglomid", "adm2"))
-ir_to_adm2_var[:, :] = ir_to_adm2_matrix
+# Sparse IR→ADM2 mapping (CSR over agglomid × adm2); rebuild with crosswalk.read_ir_to_adm2
+ir_to_adm2_indptr_var = ncfile.createVariable(
+    "ir_to_adm2_indptr", np.int64, ("agglomid_ptr",),
+    **storage(min(link_chunk, len(ir_keys) + 1))
+)
+ir_to_adm2_indptr_var[:] = ir_to_adm2_indptr
+ir_to_adm2_indptr_var.description = "CSR row pointers: links of IR i are ir_to_adm2_indptr[i]:ir_to_adm2_indptr[i + 1]"
+
+ir_to_adm2_indices_var = ncfile.createVariable(
+    "ir_to_adm2_indices", np.int32, ("link",), **storage(min(link_chunk, len(ir_to_adm2_indices)))
+)
+ir_to_adm2_indices_var[:] = ir_to_adm2_indices
+ir_to_adm2_indices_var.description = "ADM2 index of each IR→ADM2 link"
+
+ir_to_adm2_weight_var = ncfile.createVariable(
+    "ir_to_adm2_weight", np.float32, ("link",), **storage(min(link_chunk, len(ir_to_adm2_indices)))
+)
+ir_to_adm2_weight_var[:] = ir_to_adm2_weight
+ir_to_adm2_weight_var.description = "Weight of each IR→ADM2 link (1 for every link in the binary mapping)"
+
+ir_to_adm2_population_var = ncfile.createVariable(
+    "ir_to_adm2_population", np.float32, ("link", "year"),
+    **storage(min(link_chunk, len(ir_to_adm2_indices)), min(1, len(years)))
+)
+ir_to_adm2_population_var[:, :] = link_population
+ir_to_adm2_population_var.description = (
+    "Population in the intersection of the IR and ADM2 of each link, by year (LandScan pixels labelled with "
+    "both, centre-point rule); NaN for years without IR × ADM2 histograms"
+)
 
 # Metadata variables
 iso_var = ncfile.createVariable("iso", str, ("adm2",))
-adm2_id1_var = ncfile.createVariable("adm2_id1", np.int32, ("adm2",))
-adm2_id2_var = ncfile.createVariable("adm2_id2", np.int32, ("adm2",))
+adm2_id1_var = ncfile.createVariable("adm2_id1", np.int32, ("adm2",), **compression)
+adm2_id2_var = ncfile.createVariable("adm2_id2", np.int32, ("adm2",), **compression)
 adm2_name_var = ncfile.createVariable("adm2_name", str, ("adm2",))
 adm1_name_var = ncfile.createVariable("adm1_name", str, ("adm1",))
-agglomid_var = ncfile.createVariable("agglomid_id", np.float32, ("agglomid",))
+agglomid_var = ncfile.createVariable("agglomid_id", np.float32, ("agglomid",), **compression)
 region_key_var = ncfile.createVariable("region_key", str, ("agglomid",))
 
 # Fill metadata variables
-iso_var[:] = adm2_keys["ISO"].fillna("").astype(str).values
+iso_var[:] = iso_values
 adm2_id1_var[:] = adm2_keys["ID_1"].values
 adm2_id2_var[:] = adm2_keys["ID_2"].values
-adm2_name_var[:] = adm2_keys["ADM2_NAME"].fillna("").astype(str).values
-adm1_name_var[:] = adm1_keys["ADM1_NAME"].fillna("").astype(str).values
-agglomid_var[:] = ir_keys["agglomid"].values
+adm2_name_var[:] = adm2_name_values
+adm1_name_var[:] = adm1_name_values
+agglomid_var[:] = ir_keys["agglomid"].to_numpy(dtype=np.float32)
+region_key_var[:] = region_key_values
 
-# Align region-key correctly using merge
-region_key_map = ir_keys.merge(
-    mapping_df[["agglomid", "region-key"]].drop_duplicates("agglomid"),
-    on="agglomid", how="left"
-)
-region_key_var[:] = region_key_map["region-key"].fillna("").astype(str).values
+# Country blocks along adm2
+country_iso_var = ncfile.createVariable("country_iso", str, ("country",))
+country_iso_var[:] = country_iso
+country_start_var = ncfile.createVariable("country_adm2_start", np.int32, ("country",))
+country_start_var[:] = country_adm2_start
+country_count_var = ncfile.createVariable("country_adm2_count", np.int32, ("country",))
+country_count_var[:] = country_adm2_count
 
 # Description
-ncfile.description = (
-    "This dataset provides total population by ADM2 region across years, a binary mapping from IRs to ADM2s, "
-    "IR identifiers, and metadata for ADM2/ADM1. Useful for aggregation, disaggregation, and impact estimation."
-)
+ncfile.description = description
 
 ncfile.close()
 print("NetCDF file created with metadata: ./outputs/impact_regions.nc")
+
+# Chunked Zarr store with the same content, for lazy reads of country/year slices with xarray + dask
+print("Writing Zarr store...")
+run.begin("zarr", items=len(adm2_keys) * len(years))
+zarr_ds = xr.Dataset(
+    data_vars={
+        "population": (("adm2", "year"), population_array.astype(np.float32)),
+        "adm2_to_adm1": ("adm2", adm2_to_adm1),
+        "iso": ("adm2", iso_values.astype(str)),
+        "adm2_id1": ("adm2", adm2_keys["ID_1"].values.astype(np.int32)),
+        "adm2_id2": ("adm2", adm2_keys["ID_2"].values.astype(np.int32)),
+        "adm2_name": ("adm2", adm2_name_values.astype(str)),
+        "adm1_name": ("adm1", adm1_name_values.astype(str)),
+        "agglomid_id": ("agglomid", ir_keys["agglomid"].to_numpy(dtype=np.float32)),
+        "region_key": ("agglomid", region_key_values.astype(str)),
+        "ir_to_adm2_indptr": ("agglomid_ptr", ir_to_adm2_indptr),
+        "ir_to_adm2_indices": ("link", ir_to_adm2_indices),
+        "ir_to_adm2_weight": ("link", ir_to_adm2_weight),
+        "ir_to_adm2_population": (("link", "year"), link_population.astype(np.float32)),
+        "country_adm2_start": ("country", country_adm2_start.astype(np.int32)),
+        "country_adm2_count": ("country", country_adm2_count.astype(np.int32)),
+    },
+    coords={"year": np.asarray(years, dtype=np.int32), "country": country_iso.astype(str)},
+    attrs={"description": description},
+)
+zarr_chunks = {
+    "adm2": min(adm2_chunk, len(adm2_keys)),
+    "year": 1,
+    "link": min(link_chunk, len(ir_to_adm2_indices)),
+    "agglomid_ptr": min(link_chunk, len(ir_keys) + 1),
+}
+zarr_encoding = {
+    name: {"chunks": tuple(max(1, zarr_chunks.get(dim, size)) for dim, size in var.sizes.items())}
+    for name, var in zarr_ds.data_vars.items()
+}
+zarr_ds.to_zarr(zarr_path, mode="w", encoding=zarr_encoding, consolidated=True)
+print(f"Zarr store created: {zarr_path}")
+run.finish()
@@ -1,35 +1,53 @@
-import geopandas as gpd
+import argparse
 import os
 
+from fgb_export import FORMATS, write_flatgeobuf
+from geocache import read_ir
+from instrument import Instrument
+from shards import add_arguments, report_failures, run_from_options
+
 # === Configuration ===
-test_mode = False
-target_countries = ["USA", "IND", "MEX", "CHN", "COL"]
-input_shapefile = "./data/world-combo-new/agglomerated-world-new.shp"
 output_folder = "adm2-geojson-dataset"
+iso_column = "ISO"  # Normalized by geocache
+output_format = "geojson"  # "geojson", "flatgeobuf" (indexed, with simplified levels) or "both"
+
+
+def process_country(iso_code, output_format=output_format):
+    # === Load this country's IR geometries (cached GeoParquet partition) ===
+    country_gdf = read_ir(countries=[iso_code])
+
+    # === Save the country GeoJSON ===
+    if output_format in ("geojson", "both"):
+        output_path = os.path.join(output_folder, f"{iso_code}_ir.geojson")
+        country_gdf.to_file(output_path, driver="GeoJSON")
+        print(f"Saved {output_path} with {len(country_gdf)} IRs and columns: {list(country_gdf.columns)}")
+
+    # === Save the FlatGeobuf levels of detail ===
+    if output_format in ("flatgeobuf", "both"):
+        paths = write_flatgeobuf(country_gdf, os.path.join(output_folder, "flatgeobuf", f"{iso_code}_ir"))
+        print(f"Saved {len(paths)} FlatGeobuf levels for {iso_code} with {len(country_gdf)} IRs")
+    return len(country_gdf)
 
-# === Create output folder ===
-os.makedirs(output_folder, exist_ok=True)
 
-# === Load IR shapefile ===
-print("Loading IR shapefile...")
-gdf_ir = gpd.read_file(input_shapefile)
+def main():
+    parser = add_arguments(argparse.ArgumentParser(description="Write one IR GeoJSON per country."))
+    parser.add_argument("--format", choices=FORMATS, default=output_format,
+                        help=f"Output format (default: {output_format})")
+    options = parser.parse_args()
+    run = Instrument("05")
 
-# === Identify available ISO column ===
-iso_column_candidates = ["ISO", "iso", "GID_0", "country", "COUNTRY"]
-iso_column = next((col for col in iso_column_candidates if col in gdf_ir.columns), None)
+    # === Create output folder ===
+    os.makedirs(output_folder, exist_ok=True)
 
-if not iso_column:
-    raise ValueError("Could not find ISO country code column in IR shapefile.")
+    # === One shard per country, largest first ===
+    print("Exporting IR geometries by country...")
+    with run.step("export", hot=True) as step:
+        results, errors = run_from_options(process_country, options, layers=["ir"], args=(options.format,))
+        step.items = sum(results.values())
+    print(f"Saved {sum(results.values())} IRs for {len(results)} countries")
+    run.finish()
+    report_failures(errors)
 
-# === Filter by test_mode if needed ===
-if test_mode:
-    gdf_ir = gdf_ir[gdf_ir[iso_column].isin(target_countries)].copy()
-    print(f"Test mode is ON — processing countries: {sorted(gdf_ir[iso_column].unique())}")
-else:
-    print(f"Test mode is OFF — processing all countries: {sorted(gdf_ir[iso_column].unique())}")
 
-# === Save one GeoJSON per country ===
-for iso_code, country_gdf in gdf_ir.groupby(iso_column):
-    output_path = os.path.join(output_folder, f"{iso_code}_ir.geojson")
-    country_gdf.to_file(output_path, driver="GeoJSON")
-    print(f"Saved {output_path} with {len(country_gdf)} IRs and columns: {list(country_gdf.columns)}")
+if __name__ == "__main__":
+    main()
@@ -1,310 +1,379 @@
+import argparse
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-from shapely.ops import unary_union
 import os
 
-# === Test mode setup ===
-test_mode = False
-target_countries = ["USA", "IND", "MEX", "CHN", "COL"]
-
-# === Create output subfolder ===
-os.makedirs("adm2-geojson-dataset", exist_ok=True)
-
-# === Load IR shapefile ===
-print("Loading IR shapefile...")
-shapefile_path = "./data/world-combo-new/agglomerated-world-new.shp"
-gdf_ir = gpd.read_file(shapefile_path)
-gdf_ir["agglomid"] = gdf_ir["color"].astype(float)
-
-# === Load IR ↔ ADM2 mapping ===
-print("Loading IR-to-ADM2 mapping...")
-df_link = pd.read_csv("./outputs/ir_to_adm2_adm1.csv")
-df_link["agglomid"] = df_link["agglomid"].astype(float)
-df_link["adm2_id"] = df_link["ISO"] + "_" + df_link["ID_1"].astype(str) + "_" + df_link["ID_2"].astype(str)
-
-if test_mode:
-    df_link = df_link[df_link["ISO"].isin(target_countries)]
-    print(f"Filtered to {len(df_link)} rows for test countries.")
-
-# === Step 1: Clean problematic IRs (case 4) ===
-print("Identifying problematic IRs crossing multiple ADM1...")
-irs_multi_adm1 = (
-    df_link.groupby("agglomid")["ID_1"].nunique()
-    .reset_index(name="n_adm1")
-    .query("n_adm1 > 1")["agglomid"]
-)
-df_link_clean = df_link[~df_link["agglomid"].isin(irs_multi_adm1)].copy()
-
-# === Load GADM shapefile ===
-print("Loading GADM shapefile...")
-gdf_gadm = gpd.read_file("./data/gadm36_shp/gadm36.shp")
-# Ensure ISO column is properly set and no duplicates
-if "ISO" in gdf_gadm.columns and "GID_0" in gdf_gadm.columns:
-    gdf_gadm.drop(columns=["GID_0"], inplace=True)
-elif "ISO" not in gdf_gadm.columns and "GID_0" in gdf_gadm.columns:
-    gdf_gadm.rename(columns={"GID_0": "ISO"}, inplace=True)
-
-gdf_gadm = gdf_gadm[gdf_gadm["ID_1"].notna() & gdf_gadm["ID_2"].notna()].copy()
-gdf_gadm["ID_1"] = gdf_gadm["ID_1"].astype(int)
-gdf_gadm["ID_2"] = gdf_gadm["ID_2"].astype(int)
-gdf_gadm["adm2_id"] = (
-    gdf_gadm["ISO"] + "_" +
-    gdf_gadm["ID_1"].astype(str) + "_" +
-    gdf_gadm["ID_2"].astype(str)
-)
-
-# === Check and fix GADM column names if needed ===
-expected_cols = ["ID_1", "NAME_1", "ID_2", "NAME_2"]
-rename_map = {}
-
-if "NAME_1" not in gdf_gadm.columns and "NAME_1_EN" in gdf_gadm.columns:
-    rename_map["NAME_1_EN"] = "NAME_1"
-if "NAME_2" not in gdf_gadm.columns and "NAME_2_EN" in gdf_gadm.columns:
-    rename_map["NAME_2_EN"] = "NAME_2"
-
-if rename_map:
-    gdf_gadm.rename(columns=rename_map, inplace=True)
-
-for col in expected_cols:
-    if col not in gdf_gadm.columns:
-        raise ValueError(f"Missing column '{col}' in GADM shapefile.")
-
-# === Apply test mode filtering ===
-if test_mode:
-    print("Test mode is ON — filtering to selected countries only.")
-    gdf_gadm = gdf_gadm.reset_index(drop=True)
-    gdf_gadm = gdf_gadm[gdf_gadm["ISO"].isin(target_countries)].copy()
-    df_link_clean = df_link_clean[df_link_clean["ISO"].isin(target_countries)].copy()
-    gdf_ir = gdf_ir[gdf_ir["ISO"].isin(target_countries)].copy()
-
-    print(f"→ GADM filtered to: {gdf_gadm['ISO'].unique().tolist()}")
-    print(f"→ IRs remaining: {len(gdf_ir)}")
-    print(f"→ Link table entries: {len(df_link_clean)}")
-else:
-    print("Test mode is OFF — processing all countries.")
-
-# === Classify ADM2 cases ===
-print("Classifying cases...")
-adm2_ir_counts = df_link_clean.groupby("adm2_id")["agglomid"].nunique().reset_index(name="n_irs")
-ir_adm2_counts = df_link_clean.groupby("agglomid")["adm2_id"].nunique().reset_index(name="n_adm2")
-
-case1 = df_link_clean.merge(adm2_ir_counts, on="adm2_id")
-case1 = case1[case1["n_irs"] == 1]
-
-case2 = df_link_clean.merge(ir_adm2_counts, on="agglomid")
-case2 = case2[case2["n_adm2"] > 1]
-
-# Case 3: ADM2 has multiple IRs (but each IR only belongs to one ADM2)
-case3 = df_link_clean.merge(adm2_ir_counts, on="adm2_id")
-case3 = case3[case3["n_irs"] > 1]
-
-# Remove overlaps (avoid duplication of rows in case1 or case2)
-case3 = case3[~case3["adm2_id"].isin(case1["adm2_id"])]
-case3 = case3[~case3["agglomid"].isin(case2["agglomid"])]
-
-print(f"Case 1: {len(case1)} rows")
-print(f"Case 2: {len(case2)} rows")
-print(f"Case 3: {len(case3)} rows")
-
-# === Case 1: Use geometry from IR ===
-print("Processing Case 1 (single IR per ADM2)...")
-case1_with_geom = case1.merge(
-    gdf_ir[["agglomid", "geometry"]],
-    on="agglomid",
-    how="left"
-)
-
-# Group by ADM2 to keep schema consistent
-gdf_case1_grouped = (
-    case1_with_geom
-    .groupby("adm2_id")
-    .agg({
-        "agglomid": lambda x: list(x.unique()),
-        "geometry": "first",
-        "ID_1": "first",
-        "ID_2": "first",
-        "NAME_1": "first",
-        "NAME_2": "first"
-    })
-    .reset_index()
-)
-
-gdf_case1_grouped["geom_source"] = "IR"
-gdf_case1_grouped["case_type"] = "Case 1: IR = ADM2"
-gdf_case1 = gpd.GeoDataFrame(gdf_case1_grouped, geometry="geometry", crs=gdf_ir.crs)
-gdf_case1 = gdf_case1[[
-    "adm2_id", "agglomid", "ID_1", "NAME_1", "ID_2", "NAME_2",
-    "geometry", "geom_source", "case_type"
-]]
-
-# === Case 2: Use geometry from GADM ===
-print("Processing Case 2 (grouping by ADM2)...")
-case2_with_geom = case2.merge(
-    gdf_gadm[[
-        "adm2_id", "geometry", "ID_1", "ID_2", "NAME_1", "NAME_2"
-    ]],
-    on="adm2_id",
-    how="left"
-)
-
-# Ensure required columns are present (fallback if missing from merge)
-for col in ["ID_1", "ID_2", "NAME_1", "NAME_2"]:
-    if col not in case2_with_geom.columns:
-        case2_with_geom[col] = None  # Fill with None if not merged properly
-
-# Group by ADM2 and aggregate agglomids as lists
-gdf_case2_grouped = (
-    case2_with_geom
-    .groupby("adm2_id")
-    .agg({
-        "agglomid": lambda x: list(x.unique()),
-        "geometry": "first",  # geometry from GADM
-        "ID_1": "first",
-        "ID_2": "first",
-        "NAME_1": "first",
-        "NAME_2": "first"
-    })
-    .reset_index()
-)
-
-gdf_case2_grouped["geom_source"] = "GADM"
-gdf_case2_grouped["case_type"] = "Case 2: IR covers multiple ADM2s"
-
-# Handle missing geometries
-missing_case2 = gdf_case2_grouped[gdf_case2_grouped["geometry"].isna()].copy()
-missing_case2.to_csv("outputs/geometries/missing_case2_geometries.csv", index=False)
-print(f"Saved {len(missing_case2)} missing geometries for Case 2")
-
-gdf_case2 = gdf_case2_grouped[~gdf_case2_grouped["geometry"].isna()].copy()
-gdf_case2 = gpd.GeoDataFrame(gdf_case2, geometry="geometry", crs=gdf_gadm.crs)
-gdf_case2 = gdf_case2[[
-    "adm2_id", "agglomid", "ID_1", "NAME_1", "ID_2", "NAME_2",
-    "geometry", "geom_source", "case_type"
-]]
-# === Case 3: Union of multiple IRs assigned to the same ADM2 ===
-print("Processing Case 3 (union of IRs per ADM2)...")
-gdf_case3_parts = case3.merge(
-    gdf_ir[["agglomid", "geometry"]],
-    on="agglomid",
-    how="left"
-)
-
-gdf_case3_grouped = (
-    gdf_case3_parts
-    .groupby("adm2_id")
-    .agg({
-        "agglomid": lambda x: list(x.unique()),
-        "geometry": lambda x: unary_union([geom for geom in x if geom is not None])
-    })
-    .reset_index()
-)
-
-# Avoid duplicates before merging GADM info
-gadm_subset = (
-    gdf_gadm[["adm2_id", "ID_1", "NAME_1", "ID_2", "NAME_2"]]
-    .drop_duplicates(subset="adm2_id")
-)
-
-gdf_case3_grouped = gdf_case3_grouped.merge(
-    gadm_subset,
-    on="adm2_id",
-    how="left"
+from fgb_export import FORMATS, write_flatgeobuf
+from geocache import read_gadm, read_ir
+from geom_ops import grouped_union
+from instrument import Instrument
+from link_diff import read_changes
+from link_table import LINKS_PARQUET, adm2_ids, read_links
+from relations import (
+    CASE_ADM2_MULTI_IR, CASE_IR_MULTI_ADM2, CASE_MANY_TO_MANY, CASE_NO_IR, CASE_ONE_TO_ONE, CASE_TYPES, classify_links,
 )
+from shards import add_arguments, report_failures, run_from_options
 
-gdf_case3_grouped["geom_source"] = "IR union"
-gdf_case3_grouped["case_type"] = "Case 3: ADM2 = multiple IRs"
-gdf_case3 = gpd.GeoDataFrame(gdf_case3_grouped, geometry="geometry", crs=gdf_ir.crs)
-gdf_case3 = gdf_case3[[
-    "adm2_id", "agglomid", "ID_1", "NAME_1", "ID_2", "NAME_2",
-    "geometry", "geom_source", "case_type"
-]]
-
-# Check and export missing or empty geometries
-missing_case3 = gdf_case3[gdf_case3["geometry"].is_empty | gdf_case3["geometry"].isna()].copy()
-if not missing_case3.empty:
-    missing_case3.to_csv("outputs/geometries/missing_case3_geometries.csv", index=False)
-    print(f"Saved {len(missing_case3)} missing or empty geometries for Case 3")
-
-# Keep only valid geometries
-gdf_case3 = gdf_case3[~(gdf_case3["geometry"].is_empty | gdf_case3["geometry"].isna())].copy()
-# === Combine all cases into a single GeoDataFrame ===
-print("Merging all cases into a single GeoDataFrame...")
-gdf_all_cases = pd.concat([gdf_case1, gdf_case2, gdf_case3], ignore_index=True)
-
-# Final consistency check: ensure adm2_id is unique
-duplicates = gdf_all_cases["adm2_id"].duplicated()
-if duplicates.any():
-    print(f"Warning: {duplicates.sum()} duplicated adm2_id entries found.")
-    gdf_all_cases = gdf_all_cases[~duplicates].copy()
-
-# === Export one GeoJSON per country ===
 output_folder = "adm2-geojson-dataset"
-os.makedirs(output_folder, exist_ok=True)
-
-
-# === Identify missing countries and create fallback Case 4 ===
-existing_isos = set(gdf_all_cases["adm2_id"].str.split("_").str[0])
-all_isos = set(df_link["ISO"].unique())
-isos_missing = sorted(all_isos - existing_isos)
-
-print(f"Adding fallback Case 4 for {len(isos_missing)} countries without any ADM2 processed...")
-
-gdf_case4 = gdf_gadm[gdf_gadm["ISO"].isin(isos_missing)].copy()
+link_path = LINKS_PARQUET
+
+# Existing country GeoJSONs are regenerated unless overwrite is turned off
+overwrite = True
+
+# "geojson", "flatgeobuf" (indexed, with simplified levels, under flatgeobuf/) or "both"
+output_format = "geojson"
+
+# Worker processes for the Case 3 unions when countries are processed one at a time (--workers 1)
+n_workers = os.cpu_count()
+
+
+def process_country(iso_code, union_workers=1, output_format=output_format):
+    # IRs and ADM2s never cross country borders, so each country is classified and built on its own
+    read_countries = [iso_code]
+
+    # === Load IR geometries ===
+    gdf_ir = read_ir(columns=["ISO", "agglomid"], countries=read_countries)
+
+    # === Load IR ↔ ADM2 mapping ===
+    df_link = read_links(link_path, countries=read_countries)
+    df_link["agglomid"] = df_link["agglomid"].astype(float)  # As in the IR geometries
+    for column in ["ID_1", "ID_2"]:
+        # NumPy integers as in the GADM geometries (floats if some are missing), so the exported types are unchanged
+        df_link[column] = df_link[column].to_numpy(dtype=float if df_link[column].hasnans else int, na_value=np.nan)
+    df_link["adm2_id"] = adm2_ids(df_link)
+
+    # === Step 1: Classify the IR–ADM2 graph, leaving out problematic IRs crossing multiple ADM1 ===
+    df_link = classify_links(df_link, adm2_columns=["adm2_code"], adm1_columns=["adm1_code"],
+                             exclude_adm1_crossing=True)
+    irs_multi_adm1 = df_link.loc[df_link["crosses_adm1"], "agglomid"].drop_duplicates()
+    df_link_clean = df_link[~df_link["crosses_adm1"]].copy()
+
+    # === Load GADM geometries (ISO and name columns are normalized by geocache) ===
+    gdf_gadm = read_gadm(columns=["ISO", "ID_1", "NAME_1", "ID_2", "NAME_2"], countries=read_countries)
+
+    gdf_gadm = gdf_gadm[gdf_gadm["ID_1"].notna() & gdf_gadm["ID_2"].notna()].copy()
+    gdf_gadm["ID_1"] = gdf_gadm["ID_1"].astype(int)
+    gdf_gadm["ID_2"] = gdf_gadm["ID_2"].astype(int)
+    gdf_gadm["adm2_id"] = (
+        gdf_gadm["ISO"] + "_" +
+        gdf_gadm["ID_1"].astype(str) + "_" +
+        gdf_gadm["ID_2"].astype(str)
+    )
+
+    # === Check GADM column names ===
+    expected_cols = ["ID_1", "NAME_1", "ID_2", "NAME_2"]
+
+    for col in expected_cols:
+        if col not in gdf_gadm.columns:
+            raise ValueError(f"Missing column '{col}' in GADM shapefile.")
+
+    # === Split links by the case of their IR–ADM2 component ===
+    case1 = df_link_clean[df_link_clean["case"] == CASE_ONE_TO_ONE]
+
+    # Case 2 and many-to-many components both take their geometry from GADM
+    case2 = df_link_clean[df_link_clean["case"].isin([CASE_IR_MULTI_ADM2, CASE_MANY_TO_MANY])]
+
+    # Case 3: ADM2 has multiple IRs (but each IR only belongs to one ADM2)
+    case3 = df_link_clean[df_link_clean["case"] == CASE_ADM2_MULTI_IR]
+
+    print(
+        f"{iso_code}: Case 1: {len(case1)}, Case 2: {(case2['case'] == CASE_IR_MULTI_ADM2).sum()}, "
+        f"Case 3: {len(case3)}, Case 5: {(case2['case'] == CASE_MANY_TO_MANY).sum()} rows, "
+        f"{len(irs_multi_adm1)} IRs crossing multiple ADM1s"
+    )
+
+    # === Case 1: Use geometry from IR ===
+    case1_with_geom = case1.merge(
+        gdf_ir[["agglomid", "geometry"]],
+        on="agglomid",
+        how="left"
+    )
+
+    # Group by ADM2 to keep schema consistent
+    gdf_case1_grouped = (
+        case1_with_geom
+        .groupby("adm2_id")
+        .agg({
+            "agglomid": lambda x: list(x.unique()),
+            "geometry": "first",
+            "ID_1": "first",
+            "ID_2": "first",
+            "NAME_1": "first",
+            "NAME_2": "first"
+        })
+        .reset_index()
+    )
+
+    gdf_case1_grouped["geom_source"] = "IR"
+    gdf_case1_grouped["case_type"] = CASE_TYPES[CASE_ONE_TO_ONE]
+    gdf_case1 = gpd.GeoDataFrame(gdf_case1_grouped, geometry="geometry", crs=gdf_ir.crs)
+    gdf_case1 = gdf_case1[[
+        "adm2_id", "agglomid", "ID_1", "NAME_1", "ID_2", "NAME_2",
+        "geometry", "geom_source", "case_type"
+    ]]
 
-if not gdf_case4.empty:
-    gdf_case4["agglomid"] = None
-    gdf_case4["geom_source"] = "GADM fallback"
-    gdf_case4["case_type"] = "Case 4: ADM2 with no IR assigned"
-    gdf_case4 = gdf_case4[[
+    # === Case 2: Use geometry from GADM ===
+    case2_with_geom = case2.merge(
+        gdf_gadm[[
+            "adm2_id", "geometry", "ID_1", "ID_2", "NAME_1", "NAME_2"
+        ]],
+        on="adm2_id",
+        how="left"
+    )
+
+    # Ensure required columns are present (fallback if missing from merge)
+    for col in ["ID_1", "ID_2", "NAME_1", "NAME_2"]:
+        if col not in case2_with_geom.columns:
+            case2_with_geom[col] = None  # Fill with None if not merged properly
+
+    # Group by ADM2 and aggregate agglomids as lists
+    gdf_case2_grouped = (
+        case2_with_geom
+        .groupby("adm2_id")
+        .agg({
+            "agglomid": lambda x: list(x.unique()),
+            "case": "first",
+            "geometry": "first",  # geometry from GADM
+            "ID_1": "first",
+            "ID_2": "first",
+            "NAME_1": "first",
+            "NAME_2": "first"
+        })
+        .reset_index()
+    )
+
+    gdf_case2_grouped["geom_source"] = "GADM"
+    gdf_case2_grouped["case_type"] = gdf_case2_grouped["case"].map(CASE_TYPES)
+
+    # Handle missing geometries
+    missing_case2 = gdf_case2_grouped[gdf_case2_grouped["geometry"].isna()].copy()
+
+    gdf_case2 = gdf_case2_grouped[~gdf_case2_grouped["geometry"].isna()].copy()
+    gdf_case2 = gpd.GeoDataFrame(gdf_case2, geometry="geometry", crs=gdf_gadm.crs)
+    gdf_case2 = gdf_case2[[
         "adm2_id", "agglomid", "ID_1", "NAME_1", "ID_2", "NAME_2",
         "geometry", "geom_source", "case_type"
     ]]
-    
-    gdf_case4 = gpd.GeoDataFrame(gdf_case4, geometry="geometry", crs=gdf_gadm.crs)
-
-    # Add to all cases
-    gdf_all_cases = pd.concat([gdf_all_cases, gdf_case4], ignore_index=True)
-
-
-gdf_all_cases["ISO"] = gdf_all_cases["adm2_id"].str.split("_").str[0]
-
-for iso, group in gdf_all_cases.groupby("ISO"):
-    country_path = os.path.join(output_folder, f"{iso}_adm2.geojson")
-    if os.path.exists(country_path):
-        print(f"Skipped {iso} — GeoJSON already exists.")
-        continue
-    group.to_file(country_path, driver="GeoJSON")
-    print(f"Saved {len(group)} ADM2s for {iso} to: {country_path}")
-    
-# Check which countries do not have geojson
-log_path = os.path.join(output_folder, "export_log.txt")
-with open(log_path, "w") as log_file:
-    for iso in df_link["ISO"].unique():
+    # === Case 3: Union of multiple IRs assigned to the same ADM2 ===
+    gdf_case3_parts = case3.merge(
+        gdf_ir[["agglomid", "geometry"]],
+        on="agglomid",
+        how="left"
+    )
+
+    gdf_case3_grouped = (
+        gdf_case3_parts
+        .groupby("adm2_id")
+        .agg({"agglomid": lambda x: list(x.unique())})
+        .reset_index()
+    )
+
+    # Union the IR parts of each ADM2 (in worker processes when the country runs on its own)
+    case3_unions, case3_timings = grouped_union(
+        gdf_case3_parts["geometry"].values,
+        gdf_case3_parts["adm2_id"].values,
+        gdf_case3_parts["ISO"].values,
+        n_workers=union_workers,
+    )
+    gdf_case3_grouped["geometry"] = case3_unions.reindex(gdf_case3_grouped["adm2_id"]).values
+    for row in case3_timings.itertuples():
+        print(f"{iso_code}: {row.groups} Case 3 unions in {row.seconds:.2f}s")
+
+    # Avoid duplicates before merging GADM info
+    gadm_subset = (
+        gdf_gadm[["adm2_id", "ID_1", "NAME_1", "ID_2", "NAME_2"]]
+        .drop_duplicates(subset="adm2_id")
+    )
+
+    gdf_case3_grouped = gdf_case3_grouped.merge(
+        gadm_subset,
+        on="adm2_id",
+        how="left"
+    )
+
+    gdf_case3_grouped["geom_source"] = "IR union"
+    gdf_case3_grouped["case_type"] = CASE_TYPES[CASE_ADM2_MULTI_IR]
+    gdf_case3 = gpd.GeoDataFrame(gdf_case3_grouped, geometry="geometry", crs=gdf_ir.crs)
+    gdf_case3 = gdf_case3[[
+        "adm2_id", "agglomid", "ID_1", "NAME_1", "ID_2", "NAME_2",
+        "geometry", "geom_source", "case_type"
+    ]]
+
+    # Check and export missing or empty geometries
+    missing_case3 = pd.DataFrame(gdf_case3[gdf_case3["geometry"].is_empty | gdf_case3["geometry"].isna()])
+
+    # Keep only valid geometries
+    gdf_case3 = gdf_case3[~(gdf_case3["geometry"].is_empty | gdf_case3["geometry"].isna())].copy()
+    # === Combine all cases into a single GeoDataFrame ===
+    gdf_all_cases = pd.concat([gdf_case1, gdf_case2, gdf_case3], ignore_index=True)
+
+    # Final consistency check: ensure adm2_id is unique
+    duplicates = gdf_all_cases["adm2_id"].duplicated()
+    if duplicates.any():
+        print(f"Warning: {duplicates.sum()} duplicated adm2_id entries found.")
+        gdf_all_cases = gdf_all_cases[~duplicates].copy()
+
+    # === Fallback Case 4 when no ADM2 of a linked country was processed ===
+    gdf_case4 = gdf_gadm.copy() if gdf_all_cases.empty and not df_link.empty else gdf_gadm.iloc[:0]
+
+    if not gdf_case4.empty:
+        print(f"{iso_code}: adding fallback Case 4 for {len(gdf_case4)} ADM2s without any IR processed")
+        gdf_case4["agglomid"] = None
+        gdf_case4["geom_source"] = "GADM fallback"
+        gdf_case4["case_type"] = CASE_TYPES[CASE_NO_IR]
+        gdf_case4 = gdf_case4[[
+            "adm2_id", "agglomid", "ID_1", "NAME_1", "ID_2", "NAME_2",
+            "geometry", "geom_source", "case_type"
+        ]]
+
+        gdf_case4 = gpd.GeoDataFrame(gdf_case4, geometry="geometry", crs=gdf_gadm.crs)
+
+        # Add to all cases
+        gdf_all_cases = pd.concat([gdf_all_cases, gdf_case4], ignore_index=True)
+
+
+    gdf_all_cases["ISO"] = gdf_all_cases["adm2_id"].str.split("_").str[0]
+
+    # === Export the country GeoJSON ===
+    country_path = os.path.join(output_folder, f"{iso_code}_adm2.geojson")
+    write_geojson = output_format in ("geojson", "both")
+    if write_geojson and os.path.exists(country_path) and not overwrite:
+        print(f"Skipped {iso_code} — GeoJSON already exists.")
+    elif write_geojson and not gdf_all_cases.empty:
+        gdf_all_cases.to_file(country_path, driver="GeoJSON")
+        print(f"Saved {len(gdf_all_cases)} ADM2s for {iso_code} to: {country_path}")
+    elif write_geojson and os.path.exists(country_path):
+        os.remove(country_path)  # Left over from a previous mapping
+
+    # === Export the FlatGeobuf levels of detail ===
+    fgb_path = os.path.join(output_folder, "flatgeobuf", f"{iso_code}_adm2")
+    if output_format in ("flatgeobuf", "both") and not gdf_all_cases.empty:
+        if os.path.exists(f"{fgb_path}.lod0.fgb") and not overwrite:
+            print(f"Skipped {iso_code} — FlatGeobuf already exists.")
+        else:
+            paths = write_flatgeobuf(gdf_all_cases, fgb_path)
+            print(f"Saved {len(paths)} FlatGeobuf levels of {len(gdf_all_cases)} ADM2s for {iso_code}")
+
+    # === Export problematic IRs (those crossing multiple ADM1 units) ===
+    output_problematic = os.path.join(output_folder, "ir_problematic")
+
+    # Merge to get ISO information for each problematic agglomid
+    problematic_irs = pd.DataFrame({"agglomid": irs_multi_adm1})
+    problematic_irs = problematic_irs.merge(df_link[["agglomid", "ISO"]], on="agglomid", how="left").drop_duplicates()
+
+    # Merge with geometry
+    gdf_problematic = problematic_irs.merge(
+        gdf_ir[["agglomid", "geometry"]],
+        on="agglomid",
+        how="left"
+    )
+    gdf_problematic = gpd.GeoDataFrame(gdf_problematic, geometry="geometry", crs=gdf_ir.crs)
+
+    path = os.path.join(output_problematic, f"{iso_code}_ir_problematic.geojson")
+    if not gdf_problematic.empty:
+        gdf_problematic.to_file(path, driver="GeoJSON")
+        print(f"Saved {len(gdf_problematic)} problematic IRs for {iso_code} to: {path}")
+    elif os.path.exists(path):
+        os.remove(path)  # Left over from a previous mapping
+
+    return {
+        "n_adm2": len(gdf_all_cases),
+        "linked": not df_link.empty,
+        "missing_case2": missing_case2,
+        "missing_case3": missing_case3,
+    }
+
+
+def merge_report(path, rows, countries):
+    # Keep the rows of the countries not rebuilt in this run from the previous report
+    if os.path.exists(path):
+        previous = pd.read_csv(path)
+        if "adm2_id" in previous.columns:
+            previous = previous[~previous["adm2_id"].astype(str).str.split("_").str[0].isin(countries)]
+            rows = pd.concat([previous, rows], ignore_index=True)
+    return rows
+
+
+def merge_log(path, lines, countries):
+    # Log lines look like "[WARNING] ISO: ..."; those of countries not rebuilt in this run are kept
+    kept = []
+    if os.path.exists(path):
+        with open(path) as log_file:
+            kept = [line for line in log_file if line.split(" ")[1].rstrip(":") not in countries]
+    return kept + lines
+
+
+def main():
+    parser = add_arguments(argparse.ArgumentParser(description="Write one ADM2 GeoJSON per country."))
+    parser.add_argument("--changes", help="Changes file written by 01_link_ir_to_adm.py: rebuild only the "
+                                          "countries whose IR-ADM2 links changed")
+    parser.add_argument("--format", choices=FORMATS, default=output_format,
+                        help=f"Output format (default: {output_format})")
+    options = parser.parse_args()
+    run = Instrument("06")
+
+    # === Incremental mode: only the countries with changed links, other outputs are left in place ===
+    subset = bool(options.countries or options.test)
+    if options.changes:
+        changes = read_changes(options.changes, target_path=link_path)
+        if not changes["full"]:
+            options.countries = changes["countries"]
+            subset = True
+            print(f"Rebuilding the {len(options.countries)} countries with changed links")
+            if not options.countries:
+                print("No country to rebuild")
+                run.finish()
+                return
+
+    # === Create output subfolders ===
+    os.makedirs(output_folder, exist_ok=True)
+    os.makedirs(os.path.join(output_folder, "ir_problematic"), exist_ok=True)
+    os.makedirs("outputs/geometries", exist_ok=True)
+
+    # === One shard per country, largest first; a single worker uses the pool for the unions instead ===
+    union_workers = n_workers if options.workers == 1 else 1
+    with run.step("build", hot=True) as step:
+        results, errors = run_from_options(process_country, options, layers=["gadm36", "ir"],
+                                           args=(union_workers, options.format))
+        step.items = sum(result["n_adm2"] for result in results.values())
+
+    # === Merge the per-country reports ===
+    run.begin("write")
+    rebuilt = set(results) | set(errors)
+    missing_case2 = pd.concat([result["missing_case2"] for result in results.values()], ignore_index=True)
+    if subset:
+        missing_case2 = merge_report("outputs/geometries/missing_case2_geometries.csv", missing_case2, rebuilt)
+    missing_case2.to_csv("outputs/geometries/missing_case2_geometries.csv", index=False)
+    print(f"Saved {len(missing_case2)} missing geometries for Case 2")
+
+    missing_case3 = pd.concat([result["missing_case3"] for result in results.values()], ignore_index=True)
+    if subset:
+        missing_case3 = merge_report("outputs/geometries/missing_case3_geometries.csv", missing_case3, rebuilt)
+    if not missing_case3.empty:
+        missing_case3.to_csv("outputs/geometries/missing_case3_geometries.csv", index=False)
+        print(f"Saved {len(missing_case3)} missing or empty geometries for Case 3")
+    elif os.path.exists("outputs/geometries/missing_case3_geometries.csv"):
+        os.remove("outputs/geometries/missing_case3_geometries.csv")
+
+    # Check which linked countries do not have geojson
+    log_path = os.path.join(output_folder, "export_log.txt")
+    log_lines = []
+    for iso in sorted(iso for iso, result in results.items() if result["linked"]):
         country_path = os.path.join(output_folder, f"{iso}_adm2.geojson")
         if not os.path.exists(country_path):
-            log_file.write(f"[WARNING] {iso}: ADM2 GeoJSON was not generated.\n")
+            log_lines.append(f"[WARNING] {iso}: ADM2 GeoJSON was not generated.\n")
+    for iso in sorted(errors):
+        log_lines.append(f"[ERROR] {iso}: {errors[iso]}\n")
+    if subset:
+        log_lines = merge_log(log_path, log_lines, rebuilt)
+    with open(log_path, "w") as log_file:
+        log_file.writelines(log_lines)
 
+    print(f"Saved ADM2s for {sum(result['n_adm2'] > 0 for result in results.values())} countries")
+    run.finish()
+    report_failures(errors)
 
-# === Export problematic IRs (those crossing multiple ADM1 units) ===
-print("Exporting problematic IRs (crossing multiple ADM1s)...")
-output_problematic = os.path.join(output_folder, "ir_problematic")
-os.makedirs(output_problematic, exist_ok=True)
-
-# Merge to get ISO information for each problematic agglomid
-problematic_irs = pd.DataFrame({"agglomid": irs_multi_adm1})
-problematic_irs = problematic_irs.merge(df_link[["agglomid", "ISO"]], on="agglomid", how="left").drop_duplicates()
-
-# Merge with geometry
-gdf_problematic = problematic_irs.merge(
-    gdf_ir[["agglomid", "geometry"]],
-    on="agglomid",
-    how="left"
-)
-gdf_problematic = gpd.GeoDataFrame(gdf_problematic, geometry="geometry", crs=gdf_ir.crs)
-
-# Export one GeoJSON per country
-for iso, group in gdf_problematic.groupby("ISO"):
-    path = os.path.join(output_problematic, f"{iso}_ir_problematic.geojson")
-    group.to_file(path, driver="GeoJSON")
-    print(f"Saved {len(group)} problematic IRs for {iso} to: {path}")
 
+if __name__ == "__main__":
+    main()
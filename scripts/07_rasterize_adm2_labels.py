@@ -0,0 +1,29 @@
+# Burn GADM ADM2 polygons into an integer label raster on the LandScan grid (run once, reused for every year)
+
+import os
+
+from geocache import read_gadm
+from label_grid import adm2_label_table, rasterize_labels
+
+# Parameters
+template_year = 2015  # Any LandScan year works: all years share the same grid
+template_path = f"./data/landscan/landscan-global-{template_year}-assets/landscan-global-{template_year}.tif"
+output_folder = "./outputs/adm2_label_grid"
+label_raster_path = os.path.join(output_folder, "adm2_labels.tif")
+label_table_path = os.path.join(output_folder, "adm2_labels.csv")
+
+os.makedirs(output_folder, exist_ok=True)
+
+# Read GADM geometries (cached GeoParquet)
+print("Loading GADM geometries...")
+gdf = read_gadm(columns=["ISO", "ID_1", "NAME_1", "ID_2", "NAME_2"]).rename(columns={"ISO": "GID_0"})
+
+# One label per ADM2; every GADM geometry of that ADM2 is burned with the same value
+label_table, row_labels = adm2_label_table(gdf)
+print(f"Assigned labels to {len(label_table)} ADM2 units.")
+
+print("Rasterizing ADM2 labels on the LandScan grid...")
+rasterize_labels(gdf, row_labels, template_path, label_raster_path)
+
+label_table.to_csv(label_table_path, index=False)
+print(f"Output saved: {label_raster_path} and {label_table_path}")
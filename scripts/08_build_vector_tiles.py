@@ -0,0 +1,55 @@
+# Build vector tile archives (PMTiles) for the ADM2 case layer and the IR layer, fully offline
+#
+# The ADM2 layer is read from the per-country GeoJSONs written by 06_generate_adm2_geojson_by_country.py
+# (they carry the case classification), the IR layer from the local IR shapefile through geocache.
+
+import geopandas as gpd
+import glob
+import os
+import pandas as pd
+
+from geocache import read_ir
+from shards import TEST_COUNTRIES
+from vector_tiles import write_pmtiles
+
+# === Configuration ===
+test_mode = False
+target_countries = TEST_COUNTRIES
+geojson_folder = "adm2-geojson-dataset"
+output_folder = "./outputs/tiles"
+min_zoom = 0
+max_zoom = 8  # Map clients overzoom beyond the last level
+
+adm2_properties = ["adm2_id", "agglomid", "ISO", "NAME_1", "NAME_2", "geom_source", "case_type"]
+ir_properties = ["agglomid", "hierid", "ISO"]
+
+os.makedirs(output_folder, exist_ok=True)
+
+# === ADM2 layer ===
+print("Loading ADM2 GeoJSONs...")
+adm2_paths = sorted(glob.glob(os.path.join(geojson_folder, "*_adm2.geojson")))
+if test_mode:
+    adm2_paths = [path for path in adm2_paths if os.path.basename(path).split("_")[0] in target_countries]
+if not adm2_paths:
+    raise FileNotFoundError(f"No *_adm2.geojson files in {geojson_folder}; run 06_generate_adm2_geojson_by_country.py first.")
+gdf_adm2 = gpd.GeoDataFrame(pd.concat([gpd.read_file(path) for path in adm2_paths], ignore_index=True))
+
+adm2_output = os.path.join(output_folder, "adm2.pmtiles")
+print(f"Building ADM2 tiles for {len(gdf_adm2)} features...")
+count = write_pmtiles(
+    gdf_adm2, adm2_output, "adm2",
+    [col for col in adm2_properties if col in gdf_adm2.columns], min_zoom=min_zoom, max_zoom=max_zoom,
+)
+print(f"Saved {count} tiles to {adm2_output}")
+
+# === IR layer ===
+print("Loading IR geometries...")
+gdf_ir = read_ir(countries=target_countries if test_mode else None)
+
+ir_output = os.path.join(output_folder, "ir.pmtiles")
+print(f"Building IR tiles for {len(gdf_ir)} features...")
+count = write_pmtiles(
+    gdf_ir, ir_output, "ir",
+    [col for col in ir_properties if col in gdf_ir.columns], min_zoom=min_zoom, max_zoom=max_zoom,
+)
+print(f"Saved {count} tiles to {ir_output}")
@@ -0,0 +1,82 @@
+# Export the crosswalk of impact_regions.nc as memory-mapped binary arrays (one .npy per array + header.json)
+#
+# Consumers open it with crosswalk.BinaryCrosswalk (or Aggregator.from_binary) in milliseconds, without
+# parsing the link CSV or decoding the NetCDF; worker processes share the mapped pages.
+#
+# Usage: python scripts/09_export_binary_crosswalk.py
+
+import numpy as np
+import scipy.sparse
+from netCDF4 import Dataset
+
+from crosswalk import DEFAULT_BINARY, DEFAULT_NETCDF, read_ir_to_adm2, write_binary
+from instrument import Instrument
+
+# === Configuration ===
+netcdf_path = DEFAULT_NETCDF
+output_path = DEFAULT_BINARY
+
+run = Instrument("09")
+
+# === Load the integer-coded tables of the NetCDF ===
+run.begin("load")
+with Dataset(netcdf_path) as ncfile:
+    variables = {
+        name: np.ma.filled(ncfile[name][:]) if ncfile[name].dtype != str else np.asarray(ncfile[name][:], dtype=str)
+        for name in ncfile.variables
+    }
+    description = getattr(ncfile, "description", "")
+ir_to_adm2 = read_ir_to_adm2(netcdf_path)
+run.count(len(variables["agglomid_id"]))
+
+run.begin("encode", hot=True)
+# IR keys: agglomids as integers (float32 in the NetCDF), with a sort order for binary-search lookups
+agglomid = np.rint(variables["agglomid_id"].astype(np.float64)).astype(np.int64)
+agglomid_order = np.argsort(agglomid, kind="stable").astype(np.int32)
+
+# ADM1 keys: ISO and ID_1 of the first ADM2 of each ADM1
+adm2_to_adm1 = variables["adm2_to_adm1"].astype(np.int32)
+n_adm1 = len(variables["adm1_name"])
+adm1_first = np.zeros(n_adm1, dtype=np.int64)
+adm1_first[adm2_to_adm1[::-1]] = np.arange(len(adm2_to_adm1))[::-1]
+
+# CSR in both directions; 32-bit offsets and indices, so scipy maps them without upcasting
+adm2_to_ir = scipy.sparse.csr_matrix(ir_to_adm2.T)
+adm2_to_ir.sort_indices()
+
+arrays = {
+    "year": variables["year"].astype(np.int32),
+    "agglomid": agglomid,
+    "agglomid_sorted": agglomid[agglomid_order],
+    "agglomid_order": agglomid_order,
+    "region_key": variables["region_key"],
+    "adm2_iso": variables["iso"],
+    "adm2_id1": variables["adm2_id1"].astype(np.int32),
+    "adm2_id2": variables["adm2_id2"].astype(np.int32),
+    "adm2_name": variables["adm2_name"],
+    "adm2_to_adm1": adm2_to_adm1,
+    "adm1_iso": variables["iso"][adm1_first],
+    "adm1_id1": variables["adm2_id1"][adm1_first].astype(np.int32),
+    "adm1_name": variables["adm1_name"],
+    "ir_to_adm2_indptr": ir_to_adm2.indptr.astype(np.int32),
+    "ir_to_adm2_indices": ir_to_adm2.indices.astype(np.int32),
+    "ir_to_adm2_weight": ir_to_adm2.data.astype(np.float32),
+    "adm2_to_ir_indptr": adm2_to_ir.indptr.astype(np.int32),
+    "adm2_to_ir_indices": adm2_to_ir.indices.astype(np.int32),
+    # One contiguous row per year, so loading a year touches only its pages
+    "population": np.ascontiguousarray(variables["population"].astype(np.float32).T),
+    "ir_to_adm2_population": np.ascontiguousarray(
+        variables.get("ir_to_adm2_population", np.full((ir_to_adm2.nnz, len(variables["year"])), np.nan))
+        .astype(np.float32).T
+    ),
+    "country_iso": variables["country_iso"],
+    "country_adm2_start": variables["country_adm2_start"].astype(np.int32),
+    "country_adm2_count": variables["country_adm2_count"].astype(np.int32),
+}
+
+# === Write the arrays and the header ===
+run.begin("write", items=sum(values.nbytes for values in arrays.values()))
+write_binary(arrays, output_path, attrs={"source": netcdf_path, "description": description})
+print(f"Binary crosswalk saved: {output_path} ({len(agglomid)} IRs, {len(adm2_to_adm1)} ADM2s, {n_adm1} ADM1s, "
+      f"{ir_to_adm2.nnz} links)")
+run.finish()
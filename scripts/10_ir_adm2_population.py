@@ -0,0 +1,91 @@
+# Population of every IR × ADM2 pair, from the IR and ADM2 label grids on the LandScan grid, for one or more years
+#
+# Burns the IR polygons into a label raster aligned with the ADM2 label grid of 07_rasterize_adm2_labels.py,
+# then sums each LandScan raster per (IR label, ADM2 label) pair in one joint-histogram pass per strip.
+# 04_create_netcdf.py turns the pairs that are IR→ADM2 links into the ir_to_adm2_population weights used
+# to split ADM2s across their IRs; no polygon intersections are computed.
+#
+# Usage: python scripts/10_ir_adm2_population.py --years 2015 2018-2020
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from geocache import read_ir
+from instrument import Instrument
+from label_grid import adm2_label_table, pair_sums, rasterize_labels
+
+# Parameters
+years = [2015]  # Default when --years is not given
+raster_path_template = "./data/landscan/landscan-global-{year}-assets/landscan-global-{year}.tif"
+adm2_label_raster_path = "./outputs/adm2_label_grid/adm2_labels.tif"
+adm2_label_table_path = "./outputs/adm2_label_grid/adm2_labels.csv"
+output_folder = "./outputs/ir_label_grid"
+ir_label_raster_path = os.path.join(output_folder, "ir_labels.tif")
+ir_label_table_path = os.path.join(output_folder, "ir_labels.csv")
+output_path = "./outputs/ir_adm2_population.parquet"
+
+
+def parse_years(values):
+    # Accept single years and inclusive ranges such as "2000-2005"
+    parsed = []
+    for value in values:
+        if "-" in value:
+            start, end = (int(part) for part in value.split("-", 1))
+            parsed.extend(range(start, end + 1))
+        else:
+            parsed.append(int(value))
+    return sorted(set(parsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Population of each IR × ADM2 pair from the label grids.")
+    parser.add_argument("--years", nargs="+", default=[str(y) for y in years],
+                        help="Years or inclusive ranges (e.g. 2015 2018-2020)")
+    options = parser.parse_args()
+    run_years = parse_years(options.years)
+    raster_paths = [raster_path_template.format(year=year) for year in run_years]
+    run = Instrument("10")
+
+    # === IR label grid, on the grid of the ADM2 labels (centre-point rule, as for the ADM2s) ===
+    run.begin("rasterize", hot=True)
+    os.makedirs(output_folder, exist_ok=True)
+    gdf_ir = read_ir(columns=["agglomid"])
+    gdf_ir = gdf_ir[gdf_ir["agglomid"].notna()].reset_index(drop=True)
+    ir_table, ir_row_labels = adm2_label_table(gdf_ir, keys=["agglomid"])
+    print(f"Rasterizing {len(ir_table)} IR labels on the LandScan grid...")
+    rasterize_labels(gdf_ir, ir_row_labels, adm2_label_raster_path, ir_label_raster_path)
+    ir_table.to_csv(ir_label_table_path, index=False)
+    run.count(len(gdf_ir))
+
+    # === One joint histogram per strip: population per (IR, ADM2) pair and year ===
+    print(f"Summing population per IR × ADM2 pair for {', '.join(str(year) for year in run_years)}...")
+    run.begin("histogram", hot=True)
+    ir_labels, adm2_labels, sums = pair_sums(ir_label_raster_path, adm2_label_raster_path, raster_paths)
+    run.count(len(ir_labels))
+
+    # === Label pairs to keys, one row per pair and year ===
+    run.begin("write")
+    adm2_table = pd.read_csv(adm2_label_table_path).set_index("label")
+    ir_keys = ir_table.set_index("label")["agglomid"]
+    pairs = pd.DataFrame({
+        "agglomid": np.rint(ir_keys.reindex(ir_labels).to_numpy()).astype(np.int64),
+        "ISO": adm2_table["GID_0"].reindex(adm2_labels).to_numpy(),
+        "ID_1": adm2_table["ID_1"].reindex(adm2_labels).to_numpy().astype(np.int32),
+        "ID_2": adm2_table["ID_2"].reindex(adm2_labels).to_numpy().astype(np.int32),
+    })
+    table = pd.concat([
+        pairs.assign(year=np.int32(year), population=sums[:, j]) for j, year in enumerate(run_years)
+    ], ignore_index=True)
+    # ADM2 labels sharing ISO/ID_1/ID_2 (name variants) are one ADM2 for the crosswalk
+    table = table.groupby(["agglomid", "ISO", "ID_1", "ID_2", "year"], sort=True).sum().reset_index()
+    table.to_parquet(output_path, index=False)
+    print(f"Output saved: {output_path} ({len(pairs)} IR × ADM2 pairs, "
+          f"{table['population'].sum():,.0f} people over {len(run_years)} years)")
+    run.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# Population-weighted aggregation and disaggregation of impact data between IRs, ADM2s and ADM1s
+#
+# Usage:
+#     from aggregation import Aggregator
+#     agg = Aggregator.from_netcdf("./outputs/impact_regions.nc", year=2015)
+#     agg = Aggregator.from_binary("./outputs/crosswalk_bin", year=2015)  # Memory-mapped, fast startup
+#     adm1_values = agg.convert(ir_values, "ir", "adm1")  # ir_values: (gcm, scenario, year, ir)
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from netCDF4 import Dataset
+
+from crosswalk import (
+    DEFAULT_BINARY, DEFAULT_NETCDF, BinaryCrosswalk, read_ir_to_adm2, read_ir_to_adm2_population, year_index,
+)
+
+LEVELS = ("ir", "adm2", "adm1")
+
+
+def _normalize(matrix, axis):
+    # Scale rows (axis=1) or columns (axis=0) of a sparse matrix to sum to one; empty ones stay zero
+    sums = np.asarray(matrix.sum(axis=axis)).ravel()
+    scale = np.divide(1.0, sums, out=np.zeros_like(sums, dtype=np.float64), where=sums > 0)
+    if axis == 1:
+        return scipy.sparse.diags(scale) @ matrix, sums > 0
+    return matrix @ scipy.sparse.diags(scale), sums > 0
+
+
+class Aggregator:
+    """Sparse linear operators moving values between IR, ADM2 and ADM1 levels.
+
+    Each ADM2's population is split across its linked IRs in proportion to
+    `link_weights` (the population of each IR∩ADM2 intersection, from the label-grid
+    histograms of 10_ir_adm2_population.py) when given, and in proportion to the
+    IR→ADM2 link weights for ADM2s without any (equal shares in the binary mapping).
+    This gives a population per link (and, summed per ADM1, per IR×ADM1 pair). From it:
+
+    - how="mean" treats values as intensive (per-capita, rates): a target gets the
+      population-weighted mean of its sources, and disaggregation copies values down.
+    - how="sum" treats values as extensive (totals): source totals are split across
+      targets by population share, so totals are preserved (sources that carry no
+      population have nowhere to go and are dropped).
+
+    Values are arrays whose last axis indexes the source level, e.g.
+    (gcm, scenario, year, ir); all leading axes are processed as one batched sparse
+    product, `chunk_rows` rows at a time.
+    """
+
+    def __init__(self, ir_to_adm2, adm2_population, adm2_to_adm1, n_adm1=None, agglomid=None, link_weights=None):
+        ir_to_adm2 = scipy.sparse.csr_matrix(ir_to_adm2, dtype=np.float64)
+        adm2_population = np.nan_to_num(np.asarray(adm2_population, dtype=np.float64))
+        adm2_to_adm1 = np.asarray(adm2_to_adm1)
+        n_adm1 = n_adm1 if n_adm1 is not None else int(adm2_to_adm1.max()) + 1 if len(adm2_to_adm1) else 0
+
+        # Population carried by each IR→ADM2 link (n_ir × n_adm2)
+        link_share, _ = _normalize(ir_to_adm2, axis=0)
+        if link_weights is not None:
+            weighted_share, weighted = _normalize(scipy.sparse.csr_matrix(link_weights, dtype=np.float64), axis=0)
+            link_share = weighted_share + link_share @ scipy.sparse.diags((~weighted).astype(np.float64))
+        self.link_population = (link_share @ scipy.sparse.diags(adm2_population)).tocsr()
+        self.ir_population = np.asarray(self.link_population.sum(axis=1)).ravel()
+        self.adm2_population = adm2_population
+
+        # ADM2 → ADM1 membership, weighted by ADM2 population (n_adm2 × n_adm1)
+        membership = scipy.sparse.csr_matrix(
+            (np.ones(len(adm2_to_adm1)), (np.arange(len(adm2_to_adm1)), adm2_to_adm1)),
+            shape=(len(adm2_to_adm1), n_adm1),
+        )
+        self.adm2_adm1_population = (scipy.sparse.diags(adm2_population) @ membership).tocsr()
+        self.ir_adm1_population = (self.link_population @ membership).tocsr()
+
+        self.sizes = {"ir": ir_to_adm2.shape[0], "adm2": ir_to_adm2.shape[1], "adm1": n_adm1}
+        self.agglomid = None if agglomid is None else pd.Index(agglomid)
+        self._operators = {}
+
+    @classmethod
+    def from_netcdf(cls, path=DEFAULT_NETCDF, year=None):
+        """Load the mapping and the `population` of one year (latest by default) from `impact_regions.nc`."""
+        with Dataset(path) as ncfile:
+            years = np.asarray(ncfile["year"][:])
+            j = year_index(years, year)
+            population = np.ma.filled(ncfile["population"][:, j].astype(np.float64), np.nan)
+            adm2_to_adm1 = np.asarray(ncfile["adm2_to_adm1"][:])
+            n_adm1 = len(ncfile.dimensions["adm1"])
+            agglomid = np.asarray(ncfile["agglomid_id"][:])
+        return cls(read_ir_to_adm2(path), population, adm2_to_adm1, n_adm1=n_adm1, agglomid=agglomid,
+                   link_weights=read_ir_to_adm2_population(path, year))
+
+    @classmethod
+    def from_binary(cls, path=DEFAULT_BINARY, year=None):
+        """Same as `from_netcdf`, from the memory-mapped crosswalk of 09_export_binary_crosswalk.py."""
+        crosswalk = path if isinstance(path, BinaryCrosswalk) else BinaryCrosswalk(path)
+        return cls(crosswalk.ir_to_adm2(), crosswalk.population(year), crosswalk["adm2_to_adm1"],
+                   n_adm1=crosswalk.sizes["adm1"], agglomid=crosswalk["agglomid"],
+                   link_weights=crosswalk.link_population(year))
+
+    def ir_index(self, agglomids):
+        """Positions of `agglomids` along the IR axis (-1 for unknown IRs)."""
+        return self.agglomid.get_indexer(np.asarray(agglomids, dtype=self.agglomid.dtype))
+
+    def operator(self, source, target, how="mean"):
+        """Sparse matrix M (n_source × n_target) such that target = values @ M, plus a mask of
+        targets that receive no weight (set to NaN for how="mean")."""
+        key = (source, target, how)
+        if key not in self._operators:
+            self._operators[key] = self._build_operator(source, target, how)
+        return self._operators[key]
+
+    def _build_operator(self, source, target, how):
+        if source not in LEVELS or target not in LEVELS or source == target:
+            raise ValueError(f"Cannot convert from '{source}' to '{target}'.")
+        if how not in ("mean", "sum"):
+            raise ValueError(f"Unknown conversion '{how}', expected 'mean' or 'sum'.")
+
+        # Population weights between the two levels, oriented source × target
+        pair = {source, target}
+        if pair == {"ir", "adm2"}:
+            weights = self.link_population
+        elif pair == {"adm2", "adm1"}:
+            weights = self.adm2_adm1_population
+        else:
+            weights = self.ir_adm1_population
+        if LEVELS.index(source) > LEVELS.index(target):
+            weights = weights.T.tocsr()
+
+        # Mean: each target averages its sources; sum: each source is split over its targets
+        if how == "mean":
+            operator, covered = _normalize(weights, axis=0)
+        else:
+            operator, _ = _normalize(weights, axis=1)
+            covered = np.ones(operator.shape[1], dtype=bool)
+        return operator.tocsr(), covered
+
+    def convert(self, values, source, target, how="mean", chunk_rows=65536, out=None):
+        """Convert `values` (..., n_source) to (..., n_target).
+
+        Rows of the flattened leading axes are processed `chunk_rows` at a time; pass
+        np.memmap arrays as `values` and `out` to process inputs larger than memory
+        (`out` must be C-contiguous, with the shape of the result).
+        """
+        operator, covered = self.operator(source, target, how)
+        values = np.asarray(values)
+        if values.shape[-1] != self.sizes[source]:
+            raise ValueError(f"Expected last axis of size {self.sizes[source]} for '{source}', got {values.shape[-1]}.")
+
+        lead_shape = values.shape[:-1]
+        rows = values.reshape(-1, values.shape[-1])
+        if out is None:
+            out = np.empty(lead_shape + (self.sizes[target],), dtype=np.float64)
+        elif out.shape != lead_shape + (self.sizes[target],):
+            raise ValueError(f"Expected `out` of shape {lead_shape + (self.sizes[target],)}, got {out.shape}.")
+        elif not out.flags.c_contiguous:
+            # reshape would return a copy, and the results would never reach the caller's array
+            raise ValueError("`out` must be C-contiguous.")
+        out_rows = out.reshape(-1, self.sizes[target])
+
+        operator_t = operator.T.tocsr()
+        for start in range(0, rows.shape[0], chunk_rows):
+            block = np.asarray(rows[start:start + chunk_rows], dtype=np.float64)
+            result = (operator_t @ block.T).T
+            if how == "mean":
+                result[:, ~covered] = np.nan
+            out_rows[start:start + chunk_rows] = result
+        return out
+
+    def iter_convert(self, chunks, source, target, how="mean"):
+        """Convert an iterable of arrays (..., n_source), yielding each converted chunk."""
+        for chunk in chunks:
+            yield self.convert(chunk, source, target, how=how)
@@ -0,0 +1,169 @@
+# Bounded-memory zonal sums: walk the rasters in their native block order and accumulate per-polygon sums
+#
+# The rasters are read in chunks of whole native blocks (full-width strips when a block row fits the
+# budget, otherwise runs of blocks along a block row), so the pages are read in file order and no read
+# is larger than the budget. Within a chunk, each polygon is masked only on the part of its bounding
+# box inside the chunk, with the same pixel rules as zonal.py, so a polygon spanning many chunks adds
+# up to the same sum as a single window read. The sums are checkpointed every minute, and a run
+# restarted with the same inputs can resume after the last checkpoint.
+
+import hashlib
+import json
+import math
+import os
+import time
+from contextlib import ExitStack
+
+import numpy as np
+import rasterio
+import shapely
+from rasterio.features import rasterize
+from rasterio.windows import Window
+
+from zonal import COVERAGES, check_aligned, coverage_fractions
+
+# Bytes held per chunk pixel beyond the raster values: a polygon's mask and data mask, its coverage
+# fractions (exact) and the temporaries of the weighted sum
+WORK_BYTES_PER_PIXEL = 24
+CHECKPOINT_SECONDS = 60
+
+
+def chunk_windows(width, height, block_shape, budget_pixels):
+    """Windows of whole (block_rows, block_cols) blocks of at most `budget_pixels`, in row-major block order."""
+    block_rows, block_cols = block_shape
+    if width * block_rows <= budget_pixels:
+        rows = max(1, budget_pixels // (width * block_rows)) * block_rows
+        for row_off in range(0, height, rows):
+            yield Window(0, row_off, width, min(rows, height - row_off))
+        return
+    cols = max(1, budget_pixels // (block_rows * block_cols)) * block_cols
+    for row_off in range(0, height, block_rows):
+        for col_off in range(0, width, cols):
+            yield Window(col_off, row_off, min(cols, width - col_off), min(block_rows, height - row_off))
+
+
+def _pixel_window(bounds, transform, chunk):
+    # Pixels of `chunk` reached by `bounds` (minx, miny, maxx, maxy), as (row_slice, col_slice) of the chunk
+    inverse = ~transform
+    col0, row0 = inverse * (bounds[0], bounds[3])
+    col1, row1 = inverse * (bounds[2], bounds[1])
+    r0 = max(math.floor(min(row0, row1)) - 1, 0)
+    c0 = max(math.floor(min(col0, col1)) - 1, 0)
+    r1 = min(math.ceil(max(row0, row1)) + 1, chunk.height)
+    c1 = min(math.ceil(max(col0, col1)) + 1, chunk.width)
+    return slice(r0, max(r1, r0)), slice(c0, max(c1, c0))
+
+
+def _signature(raster_paths, geometry, chunks, coverage):
+    # Identifies a run: a checkpoint is only resumed for the same rasters, polygons, chunking and coverage
+    digest = hashlib.sha256()
+    for path in raster_paths:
+        stat = os.stat(path)
+        digest.update(json.dumps([os.path.abspath(path), stat.st_size, stat.st_mtime_ns]).encode())
+    for start in range(0, len(geometry), 10000):
+        for wkb in shapely.to_wkb(geometry[start:start + 10000]):
+            digest.update(b"" if wkb is None else wkb)
+    digest.update(json.dumps([[w.col_off, w.row_off, w.width, w.height] for w in chunks]).encode())
+    digest.update(coverage.encode())
+    return digest.hexdigest()
+
+
+def _save_checkpoint(path, signature, next_chunk, sums, seen):
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(tmp_path, signature=np.array(signature), next_chunk=np.array(next_chunk), sums=sums, seen=seen)
+    os.replace(tmp_path, path)
+
+
+def _load_checkpoint(path, signature, sums, seen):
+    # Returns the first chunk still to process (0 when there is no usable checkpoint)
+    if path is None or not os.path.exists(path):
+        return 0
+    with np.load(path) as saved:
+        if str(saved["signature"]) != signature or saved["sums"].shape != sums.shape:
+            print(f"Ignoring checkpoint {path}: it was written for other inputs")
+            return 0
+        sums[:] = saved["sums"]
+        seen[:] = saved["seen"]
+        return int(saved["next_chunk"])
+
+
+def stream_sums(gdf, raster_paths, memory_limit, coverage="center", checkpoint_path=None, resume=False,
+                checkpoint_seconds=CHECKPOINT_SECONDS):
+    """Population sum per row of `gdf` and per raster, reading at most `memory_limit` bytes of pixels at a time.
+
+    Returns the same values as zonal.zonal_sums (an array of shape (len(gdf), len(raster_paths)), or
+    the (exact, center) pair with coverage="exact"). The budget covers the raster chunks and the
+    per-polygon masks, not the polygons themselves. With `checkpoint_path`, the sums are saved every
+    `checkpoint_seconds`, and `resume` continues from that file when it matches the inputs.
+    """
+    if coverage not in COVERAGES:
+        raise ValueError(f"Unknown coverage '{coverage}', expected one of {', '.join(COVERAGES)}")
+    check_aligned(raster_paths)
+    exact = coverage == "exact"
+    geometry = gdf.geometry.to_numpy()
+    present = ~(shapely.is_missing(geometry) | shapely.is_empty(geometry))
+    tree = shapely.STRtree(np.where(present, geometry, None))
+
+    with ExitStack() as stack:
+        sources = [stack.enter_context(rasterio.open(path)) for path in raster_paths]
+        first = sources[0]
+        pixel_bytes = sum(np.dtype(src.dtypes[0]).itemsize for src in sources) + WORK_BYTES_PER_PIXEL
+        budget_pixels = max(1, int(memory_limit // pixel_bytes))
+        chunks = list(chunk_windows(first.width, first.height, first.block_shapes[0], budget_pixels))
+
+        # Last axis: (exact, center) sums, or the center sums alone; `seen` marks sums with a valid pixel
+        sums = np.zeros((len(geometry), len(sources), 2 if exact else 1))
+        seen = np.zeros(sums.shape, dtype=bool)
+        signature = _signature(raster_paths, geometry, chunks, coverage)
+        start = _load_checkpoint(checkpoint_path, signature, sums, seen) if resume else 0
+        if start:
+            print(f"Resuming from checkpoint {checkpoint_path}: {start}/{len(chunks)} chunks done")
+        print(f"Streaming {len(chunks)} chunks of up to {chunks[0].height} × {chunks[0].width} pixels "
+              f"({memory_limit / 1024 ** 2:,.1f} MB budget)")
+
+        last_save = time.monotonic()
+        for k in range(start, len(chunks)):
+            chunk = chunks[k]
+            transform = first.window_transform(chunk)
+            hits = np.sort(tree.query(shapely.box(*rasterio.windows.bounds(chunk, first.transform))))
+            if len(hits):
+                values = [src.read(1, window=chunk) for src in sources]
+                for i in hits:
+                    _accumulate(geometry[i], transform, chunk, values, sources, exact, sums[i], seen[i])
+
+            if checkpoint_path is not None and time.monotonic() - last_save >= checkpoint_seconds:
+                _save_checkpoint(checkpoint_path, signature, k + 1, sums, seen)
+                last_save = time.monotonic()
+
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)  # Complete: a later run starts over
+    sums[~seen] = np.nan
+    if exact:
+        return sums[:, :, 0], sums[:, :, 1]
+    return sums[:, :, 0]
+
+
+def _accumulate(geom, transform, chunk, values, sources, exact, sums, seen):
+    # Add the pixels of this chunk inside `geom` to its sums (shape: rasters × (exact, center) or rasters × 1)
+    rows, cols = _pixel_window(geom.bounds, transform, chunk)
+    shape = (rows.stop - rows.start, cols.stop - cols.start)
+    if shape[0] == 0 or shape[1] == 0:
+        return
+    sub_transform = transform * transform.translation(cols.start, rows.start)
+    mask = rasterize([(geom, 1)], out_shape=shape, transform=sub_transform, fill=0, dtype="uint8").astype(bool)
+    fractions = coverage_fractions(geom, shape, sub_transform, center=mask) if exact else None
+    for j, src in enumerate(sources):
+        array = values[j][rows, cols]
+        data = array != src.nodata
+        if np.issubdtype(array.dtype, np.floating):
+            data &= ~np.isnan(array)
+        valid = mask & data
+        if valid.any():
+            accum_dtype = "int64" if np.issubdtype(array.dtype, np.integer) else None
+            sums[j, -1] += float(array[valid].sum(dtype=accum_dtype))
+            seen[j, -1] = True
+        if exact:
+            covered = data & (fractions > 0)
+            if covered.any():
+                sums[j, 0] += float(np.dot(fractions[covered], array[covered].astype(np.float64)))
+                seen[j, 0] = True
@@ -0,0 +1,193 @@
+# Readers for the IR↔ADM crosswalk artifacts written by the pipeline
+
+import json
+import os
+import shutil
+
+import numpy as np
+import scipy.sparse
+import xarray as xr
+from netCDF4 import Dataset
+
+DEFAULT_NETCDF = "./outputs/impact_regions.nc"
+DEFAULT_ZARR = "./outputs/impact_regions.zarr"
+DEFAULT_BINARY = "./outputs/crosswalk_bin"
+
+BINARY_FORMAT = "impact-regions-crosswalk"
+BINARY_VERSION = 1
+
+
+def year_index(years, year=None):
+    """Position of `year` in `years` (the latest when None); ValueError when it is not there."""
+    years = np.asarray(years)
+    if year is None:
+        return len(years) - 1
+    try:
+        matches = np.flatnonzero(years == float(year))
+    except (TypeError, ValueError):
+        matches = []
+    if len(matches) == 0:
+        raise ValueError(f"No population for year {year}; available: {years.tolist()}")
+    return int(matches[0])
+
+
+def read_ir_to_adm2(path=DEFAULT_NETCDF):
+    """Rebuild the IR→ADM2 mapping of `impact_regions.nc` as a scipy.sparse CSR matrix (agglomid × adm2).
+
+    Files written before the sparse layout (dense `ir_to_adm2` variable) are converted on read.
+    """
+    with Dataset(path) as ncfile:
+        shape = (len(ncfile.dimensions["agglomid"]), len(ncfile.dimensions["adm2"]))
+        if "ir_to_adm2_indptr" not in ncfile.variables:
+            return scipy.sparse.csr_matrix(np.asarray(ncfile["ir_to_adm2"][:, :]), shape=shape)
+        indptr = np.asarray(ncfile["ir_to_adm2_indptr"][:])
+        indices = np.asarray(ncfile["ir_to_adm2_indices"][:])
+        weights = np.asarray(ncfile["ir_to_adm2_weight"][:])
+    return scipy.sparse.csr_matrix((weights, indices, indptr), shape=shape)
+
+
+def read_ir_to_adm2_population(path=DEFAULT_NETCDF, year=None):
+    """Population of each IR→ADM2 link in one year (latest by default), as a CSR matrix (agglomid × adm2).
+
+    Returns None when the file has no IR × ADM2 population for that year (see 10_ir_adm2_population.py).
+    """
+    with Dataset(path) as ncfile:
+        if "ir_to_adm2_population" not in ncfile.variables:
+            return None
+        years = np.asarray(ncfile["year"][:])
+        j = year_index(years, year)
+        population = np.ma.filled(ncfile["ir_to_adm2_population"][:, j].astype(np.float64), np.nan)
+        shape = (len(ncfile.dimensions["agglomid"]), len(ncfile.dimensions["adm2"]))
+        indptr = np.asarray(ncfile["ir_to_adm2_indptr"][:])
+        indices = np.asarray(ncfile["ir_to_adm2_indices"][:])
+    if np.isnan(population).all():
+        return None
+    return scipy.sparse.csr_matrix((np.nan_to_num(population), indices, indptr), shape=shape)
+
+
+def open_zarr(path=DEFAULT_ZARR, countries=None, years=None):
+    """Open `impact_regions.zarr` lazily (dask-backed), optionally restricted to some countries and years.
+
+    Countries are contiguous blocks along `adm2`, so a selection only touches the
+    chunks of those countries; nothing is read until values are computed.
+    """
+    ds = xr.open_zarr(path, chunks={})
+    if countries is not None:
+        blocks = ds[["country_adm2_start", "country_adm2_count"]].sel(country=list(countries)).load()
+        adm2 = np.concatenate([
+            np.arange(start, start + count)
+            for start, count in zip(blocks["country_adm2_start"].values, blocks["country_adm2_count"].values)
+        ]) if len(blocks["country"]) else np.array([], dtype=np.int64)
+        ds = ds.isel(adm2=adm2)
+    if years is not None:
+        ds = ds.sel(year=list(years))
+    return ds
+
+
+def write_binary(arrays, path=DEFAULT_BINARY, attrs=None):
+    """Write `arrays` (name -> numpy array) as one .npy file each plus a header.json, replacing `path`.
+
+    Text arrays are stored as UTF-8 fixed-width bytes so that every file can be memory-mapped.
+    """
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    header = {"format": BINARY_FORMAT, "version": BINARY_VERSION, "attrs": attrs or {}, "arrays": {}}
+    for name, values in arrays.items():
+        values = np.asarray(values)
+        text = values.dtype.kind in "OU"
+        if text:
+            values = np.char.encode(values.astype(str), "utf-8")
+        np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(values))
+        header["arrays"][name] = {"file": f"{name}.npy", "dtype": values.dtype.str, "shape": list(values.shape),
+                                  "text": text}
+    with open(os.path.join(tmp_path, "header.json"), "w") as f:
+        json.dump(header, f, indent=2)
+    # Swap in the new directory last, so readers never see a half-written artifact
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+class BinaryCrosswalk:
+    """Memory-mapped view of the binary crosswalk written by 09_export_binary_crosswalk.py.
+
+    Opening only reads header.json and maps the .npy files: nothing is parsed, and the pages are
+    shared through the OS page cache by every process that opens the same directory. Instances
+    pickle as their path, so sending one to pool workers re-maps the files instead of copying them.
+    """
+
+    def __init__(self, path=DEFAULT_BINARY):
+        self.path = path
+        with open(os.path.join(path, "header.json")) as f:
+            self.header = json.load(f)
+        if self.header.get("format") != BINARY_FORMAT or self.header.get("version") != BINARY_VERSION:
+            raise ValueError(f"{path} is not a version {BINARY_VERSION} binary crosswalk; rerun "
+                             f"09_export_binary_crosswalk.py.")
+        self.arrays = {}
+        for name, spec in self.header["arrays"].items():
+            values = np.load(os.path.join(path, spec["file"]), mmap_mode="r")
+            if values.dtype.str != spec["dtype"] or list(values.shape) != spec["shape"]:
+                raise ValueError(f"{path}/{spec['file']} does not match header.json.")
+            self.arrays[name] = values
+        self.attrs = self.header["attrs"]
+        self.years = np.asarray(self.arrays["year"])
+        self.sizes = {"ir": len(self.arrays["agglomid"]), "adm2": len(self.arrays["adm2_iso"]),
+                      "adm1": len(self.arrays["adm1_iso"])}
+
+    def __reduce__(self):
+        return type(self), (self.path,)
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def text(self, name):
+        """Decoded copy of a text array (e.g. "adm2_name")."""
+        return np.char.decode(self.arrays[name], "utf-8")
+
+    def ir_to_adm2(self):
+        """IR→ADM2 mapping as a CSR matrix (agglomid × adm2) built on the mapped arrays."""
+        return scipy.sparse.csr_matrix(
+            (self.arrays["ir_to_adm2_weight"], self.arrays["ir_to_adm2_indices"], self.arrays["ir_to_adm2_indptr"]),
+            shape=(self.sizes["ir"], self.sizes["adm2"]), copy=False,
+        )
+
+    def adm2_irs(self, adm2):
+        """IR positions linked to ADM2 position `adm2` (through the transposed CSR arrays)."""
+        indptr = self.arrays["adm2_to_ir_indptr"]
+        return self.arrays["adm2_to_ir_indices"][indptr[adm2]:indptr[adm2 + 1]]
+
+    def ir_adm2s(self, ir):
+        """ADM2 positions linked to IR position `ir`."""
+        indptr = self.arrays["ir_to_adm2_indptr"]
+        return self.arrays["ir_to_adm2_indices"][indptr[ir]:indptr[ir + 1]]
+
+    def ir_index(self, agglomids):
+        """Positions of `agglomids` along the IR axis (-1 for unknown IRs), by binary search."""
+        sorted_ids, order = self.arrays["agglomid_sorted"], self.arrays["agglomid_order"]
+        agglomids = np.asarray(agglomids, dtype=np.int64)
+        if not len(sorted_ids):
+            return np.full(agglomids.shape, -1, dtype=np.int64)
+        found = np.minimum(np.searchsorted(sorted_ids, agglomids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[found] == agglomids, order[found], -1).astype(np.int64)
+
+    def link_population(self, year=None):
+        """IR→ADM2 link population of one year as a CSR matrix, or None if the export has none for that year."""
+        if "ir_to_adm2_population" not in self.arrays:
+            return None
+        j = year_index(self.years, year)
+        population = self.arrays["ir_to_adm2_population"][j]
+        if np.isnan(population).all():
+            return None
+        return scipy.sparse.csr_matrix(
+            (np.nan_to_num(population), self.arrays["ir_to_adm2_indices"], self.arrays["ir_to_adm2_indptr"]),
+            shape=(self.sizes["ir"], self.sizes["adm2"]),
+        )
+
+    def population(self, year=None):
+        """ADM2 population of one year (latest by default), as a view of the mapped array."""
+        j = year_index(self.years, year)
+        return self.arrays["population"][j]
+
+
+def open_binary(path=DEFAULT_BINARY):
+    return BinaryCrosswalk(path)
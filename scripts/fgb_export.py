@@ -0,0 +1,60 @@
+# FlatGeobuf export of the per-country layers, with a packed Hilbert R-tree and levels of detail
+#
+# Each level is its own FlatGeobuf file next to the others (<name>.lod0.fgb is full detail), since a
+# FlatGeobuf feature holds one geometry and its properties in one buffer: readers range-read the
+# index, then only the features in their bbox, at the level that suits their zoom. Coordinates are
+# snapped to a grid per level, and levels are simplified with shared borders kept shared
+# (see geom_ops.simplify_layer). A <name>.lod.json sidecar lists the levels.
+#
+# Usage:
+#     from fgb_export import write_flatgeobuf
+#     paths = write_flatgeobuf(gdf, "adm2-geojson-dataset/flatgeobuf/USA_adm2")
+#
+#     gpd.read_file("USA_adm2.lod2.fgb", bbox=(-75, 40, -73, 41))  # Index lookup + range reads
+
+import json
+import os
+
+import geopandas as gpd
+import shapely
+
+from geom_ops import simplify_layer
+
+FORMATS = ("geojson", "flatgeobuf", "both")
+
+# (simplification tolerance, coordinate grid) per level, in CRS units (degrees for GADM and the IRs)
+LOD_LEVELS = [
+    (0.0, 1e-6),  # Full detail, ~0.1 m grid
+    (0.001, 1e-5),  # ~100 m
+    (0.01, 1e-4),  # ~1 km
+    (0.05, 1e-3),  # ~5 km
+]
+
+
+def write_flatgeobuf(gdf, base_path, levels=LOD_LEVELS):
+    """Write `base_path`.lod<i>.fgb for every level and the `base_path`.lod.json sidecar; returns the paths."""
+    os.makedirs(os.path.dirname(base_path) or ".", exist_ok=True)
+    geoms = gdf.geometry.to_numpy()
+    paths, sidecar = [], []
+    for level, (tolerance, grid_size) in enumerate(levels):
+        simplified = shapely.set_precision(simplify_layer(geoms, tolerance), grid_size)
+        # Features too small for the level keep their full-detail shape, so none disappears
+        collapsed = shapely.is_empty(simplified) & ~shapely.is_empty(geoms)
+        simplified[collapsed] = shapely.set_precision(geoms[collapsed], levels[0][1])
+        layer = gpd.GeoDataFrame(gdf.drop(columns=gdf.geometry.name), geometry=simplified, crs=gdf.crs)
+
+        path = f"{base_path}.lod{level}.fgb"
+        if os.path.exists(path):
+            os.remove(path)
+        # The FlatGeobuf driver sorts features along a Hilbert curve and packs the R-tree in front of them
+        layer.to_file(path, driver="FlatGeobuf", SPATIAL_INDEX="YES")
+        paths.append(path)
+        sidecar.append({
+            "level": level, "path": os.path.basename(path), "tolerance": tolerance, "grid_size": grid_size,
+            "vertices": int(shapely.get_num_coordinates(simplified).sum()), "bytes": os.path.getsize(path),
+        })
+
+    with open(f"{base_path}.lod.json", "w") as f:
+        json.dump({"features": len(gdf), "crs": gdf.crs.to_string() if gdf.crs else None, "levels": sidecar}, f,
+                  indent=2)
+    return paths
@@ -0,0 +1,197 @@
+# GeoParquet cache of the GADM and IR shapefiles, partitioned by country
+#
+# Each layer is converted once into ./data/cache/<layer>/<ISO>.parquet with a normalized schema,
+# and read back with column, country and bbox pruning. The cache is rebuilt automatically when the
+# source shapefile changes. Build both layers up front with: python scripts/geocache.py
+#
+# A layer is built in a temporary directory next to it and swapped into place under a file lock, with
+# its manifest written last, so a directory with a manifest is always complete. Readers hold the lock
+# shared while they read, and concurrent processes needing the same stale layer build it only once.
+
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import geopandas as gpd
+import pandas as pd
+
+CACHE_DIR = "./data/cache"
+LAYERS = {
+    "gadm36": "./data/gadm36_shp/gadm36.shp",
+    "ir": "./data/world-combo-new/agglomerated-world-new.shp",
+}
+MISSING_ISO = "__missing__"
+
+
+def normalize_gadm(gdf):
+    # Ensure ISO column is properly set and no duplicates
+    if "ISO" in gdf.columns and "GID_0" in gdf.columns:
+        gdf = gdf.drop(columns=["GID_0"])
+    elif "ISO" not in gdf.columns and "GID_0" in gdf.columns:
+        gdf = gdf.rename(columns={"GID_0": "ISO"})
+
+    # Fall back to English names when the native name columns are missing
+    rename_map = {}
+    if "NAME_1" not in gdf.columns and "NAME_1_EN" in gdf.columns:
+        rename_map["NAME_1_EN"] = "NAME_1"
+    if "NAME_2" not in gdf.columns and "NAME_2_EN" in gdf.columns:
+        rename_map["NAME_2_EN"] = "NAME_2"
+    return gdf.rename(columns=rename_map)
+
+
+def normalize_ir(gdf):
+    # Identify available ISO column
+    iso_column_candidates = ["ISO", "iso", "GID_0", "country", "COUNTRY"]
+    iso_column = next((col for col in iso_column_candidates if col in gdf.columns), None)
+    if not iso_column:
+        raise ValueError("Could not find ISO country code column in IR shapefile.")
+    if iso_column != "ISO":
+        gdf = gdf.rename(columns={iso_column: "ISO"})
+
+    # IR identifier as used in the hierarchy and the IR-to-ADM2 mapping
+    gdf["agglomid"] = gdf["color"].astype(float)
+    return gdf
+
+
+NORMALIZERS = {"gadm36": normalize_gadm, "ir": normalize_ir}
+
+
+def _source_signature(path):
+    # A shapefile is several sidecar files; any of them changing invalidates the cache
+    stem = os.path.splitext(path)[0]
+    signature = {}
+    for ext in (".shp", ".shx", ".dbf", ".prj", ".cpg"):
+        if os.path.exists(stem + ext):
+            stat = os.stat(stem + ext)
+            signature[ext] = [stat.st_size, int(stat.st_mtime)]
+    return signature
+
+
+def _manifest_path(layer):
+    return os.path.join(CACHE_DIR, layer, "manifest.json")
+
+
+@contextmanager
+def _locked(layer, shared=False):
+    # Exclusive while a layer is built and swapped in, shared while it is read
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(os.path.join(CACHE_DIR, f".{layer}.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _load_manifest(layer):
+    # The manifest of a complete, up-to-date build, or None
+    try:
+        with open(_manifest_path(layer)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("source_signature") == _source_signature(LAYERS[layer]) else None
+
+
+def is_fresh(layer):
+    return _load_manifest(layer) is not None
+
+
+def _build(layer):
+    # Write every partition and the manifest into a temporary sibling, then swap it in (lock held)
+    source_path = LAYERS[layer]
+    layer_dir = os.path.join(CACHE_DIR, layer)
+
+    print(f"Building GeoParquet cache for {source_path}...")
+    gdf = NORMALIZERS[layer](gpd.read_file(source_path))
+
+    build_dir = tempfile.mkdtemp(prefix=f".{layer}.build-", dir=CACHE_DIR)
+    try:
+        countries = {}
+        for iso, group in gdf.groupby(gdf["ISO"].fillna(MISSING_ISO)):
+            group.to_parquet(os.path.join(build_dir, f"{iso}.parquet"), index=False, write_covering_bbox=True)
+            countries[iso] = len(group)
+
+        manifest = {
+            "source": source_path,
+            "source_signature": _source_signature(source_path),
+            "columns": [col for col in gdf.columns if col != "geometry"],
+            "crs": gdf.crs.to_string() if gdf.crs else None,
+            "countries": countries,
+        }
+        with open(os.path.join(build_dir, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        # A directory cannot replace a non-empty one: move the previous build aside, then drop it
+        old_dir = None
+        if os.path.exists(layer_dir):
+            old_dir = tempfile.mkdtemp(prefix=f".{layer}.old-", dir=CACHE_DIR)
+            os.replace(layer_dir, os.path.join(old_dir, layer))
+        os.replace(build_dir, layer_dir)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    if old_dir is not None:
+        shutil.rmtree(old_dir, ignore_errors=True)
+    print(f"Cached {len(gdf)} features in {len(countries)} country partitions: {layer_dir}")
+    return manifest
+
+
+def build_cache(layer):
+    """Convert the source shapefile of `layer` into one GeoParquet file per ISO code."""
+    with _locked(layer):
+        return _build(layer)
+
+
+def read_manifest(layer):
+    """Manifest of the cached layer, building the cache first if it is missing or stale."""
+    manifest = _load_manifest(layer)
+    if manifest is not None:
+        return manifest
+    with _locked(layer):
+        # Another process may have built it while this one waited for the lock
+        return _load_manifest(layer) or _build(layer)
+
+
+def read_layer(layer, columns=None, countries=None, bbox=None):
+    """Read a cached layer, loading only the requested columns, countries and bbox (minx, miny, maxx, maxy)."""
+    read_manifest(layer)
+    with _locked(layer, shared=True):
+        manifest = _load_manifest(layer)
+        if manifest is None:
+            # The source changed again since the build above
+            return read_layer(layer, columns=columns, countries=countries, bbox=bbox)
+        return _read_partitions(layer, manifest, columns, countries, bbox)
+
+
+def _read_partitions(layer, manifest, columns, countries, bbox):
+    isos = sorted(manifest["countries"]) if countries is None else [
+        iso for iso in countries if iso in manifest["countries"]
+    ]
+    if columns is not None:
+        # Columns missing from the source are left for the caller to report
+        columns = [col for col in dict.fromkeys(columns) if col in manifest["columns"]] + ["geometry"]
+
+    parts = [
+        gpd.read_parquet(os.path.join(CACHE_DIR, layer, f"{iso}.parquet"), columns=columns, bbox=bbox)
+        for iso in isos
+    ]
+    if not parts:
+        empty = gpd.GeoDataFrame(columns=columns or manifest["columns"] + ["geometry"], geometry="geometry")
+        return empty.set_crs(manifest["crs"]) if manifest["crs"] else empty
+    return gpd.GeoDataFrame(pd.concat(parts, ignore_index=True), geometry="geometry", crs=parts[0].crs)
+
+
+def read_gadm(columns=None, countries=None, bbox=None):
+    return read_layer("gadm36", columns=columns, countries=countries, bbox=bbox)
+
+
+def read_ir(columns=None, countries=None, bbox=None):
+    return read_layer("ir", columns=columns, countries=countries, bbox=bbox)
+
+
+if __name__ == "__main__":
+    for layer in LAYERS:
+        build_cache(layer)
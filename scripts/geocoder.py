@@ -0,0 +1,267 @@
+# Batch reverse geocoder: assign the IR (agglomid) and the ADM2 (ISO, ID_1, ID_2) to point datasets
+#
+# The IR and GADM polygons are copied once from the geometry cache into ./outputs/geocoder/, and
+# an STRtree is bulk-loaded over each layer when the index is opened. Points are located in chunks
+# with vectorized Shapely queries. Only the IR layer is queried for every point. ADM1, and ADM2 for
+# IRs linked to a single ADM2, are filled in from ir_to_adm2_adm1.csv. The GADM layer is queried only
+# for the remaining points: those in IRs covering several ADM2s, or outside every IR.
+#
+# Usage:
+#     python scripts/geocoder.py stations.csv stations_geocoded.csv --lon lon --lat lat
+#     python scripts/geocoder.py facilities.parquet facilities_geocoded.parquet --chunk-size 2000000
+#     python scripts/geocoder.py --build    # (re)build the index only
+#
+#     from geocoder import GeoIndex
+#     located = GeoIndex.open().locate(lon, lat)  # DataFrame with one row per point
+
+import argparse
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyproj
+import shapely
+
+from geocache import read_gadm, read_ir, read_manifest
+
+INDEX_DIR = "./outputs/geocoder"
+LINKS_PATH = "./outputs/ir_to_adm2_adm1.csv"
+CHUNK_SIZE = 1_000_000
+
+IR_COLUMNS = ["agglomid", "region-key"]
+ADM1_COLUMNS = ["ISO", "ID_1", "NAME_1"]
+ADM2_COLUMNS = ADM1_COLUMNS + ["ID_2", "NAME_2"]
+OUTPUT_COLUMNS = IR_COLUMNS + ADM2_COLUMNS
+
+
+def _signatures():
+    # The index is stale when either cached source layer was rebuilt from a different shapefile
+    return {layer: read_manifest(layer)["source_signature"] for layer in ("ir", "gadm36")}
+
+
+def build_index(index_dir=INDEX_DIR):
+    """Copy the IR and GADM polygons with their keys into `index_dir`, sorted by key."""
+    os.makedirs(index_dir, exist_ok=True)
+    print("Building geocoder index...")
+    ir = read_ir(columns=["agglomid"])
+    ir = ir[ir["agglomid"].notna() & ir.geometry.notna() & ~ir.geometry.is_empty].sort_values("agglomid", kind="stable")
+    ir.to_parquet(os.path.join(index_dir, "ir.parquet"), index=False)
+
+    # GADM rows below ADM2 are kept as they are: a point in any part gets that part's ADM2
+    adm2 = read_gadm(columns=ADM2_COLUMNS)
+    adm2 = adm2[adm2.geometry.notna() & ~adm2.geometry.is_empty].sort_values(["ISO", "ID_1", "ID_2"], kind="stable")
+    adm2.to_parquet(os.path.join(index_dir, "adm2.parquet"), index=False)
+
+    manifest = {"signatures": _signatures(), "ir": len(ir), "adm2": len(adm2)}
+    with open(os.path.join(index_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Indexed {len(ir)} IR and {len(adm2)} GADM polygons: {index_dir}")
+    return manifest
+
+
+def is_fresh(index_dir=INDEX_DIR):
+    manifest_path = os.path.join(index_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path) as f:
+        return json.load(f)["signatures"] == _signatures()
+
+
+def _first_hits(tree, points, n):
+    # Tree index of the first polygon intersecting each point, -1 where none does. Points on a shared
+    # border touch two polygons; the lowest index (the lowest key, as layers are sorted) wins.
+    hits = np.full(n, -1, dtype=np.int64)
+    point_index, tree_index = tree.query(points, predicate="intersects")
+    order = np.lexsort((tree_index, point_index))
+    point_index, tree_index = point_index[order], tree_index[order]
+    first = np.r_[True, point_index[1:] != point_index[:-1]] if len(point_index) else np.array([], dtype=bool)
+    hits[point_index[first]] = tree_index[first]
+    return hits
+
+
+def _nearest_hits(tree, points, hits, max_distance):
+    # Snap the points outside every polygon (coastal stations, rounding) to the nearest one within max_distance
+    missing = np.flatnonzero(hits < 0)
+    if not max_distance or not len(missing):
+        return hits
+    point_index, tree_index = tree.query_nearest(points[missing], max_distance=max_distance, all_matches=False)
+    hits[missing[point_index]] = tree_index
+    return hits
+
+
+class GeoIndex:
+    """STRtrees over the IR and GADM polygons, plus the IR→ADM2/ADM1 crosswalk used to skip ADM2 queries."""
+
+    def __init__(self, ir, adm2, links):
+        self.ir_keys = ir["agglomid"].to_numpy(dtype=np.float64)
+        self.ir_tree = shapely.STRtree(ir.geometry.values)
+        self.adm2_keys = adm2[ADM2_COLUMNS].reset_index(drop=True)
+        self.adm2_tree = shapely.STRtree(adm2.geometry.values)
+        self.crs = ir.crs
+        self._ir_attributes(links)
+
+    def _ir_attributes(self, links):
+        # Per IR: its region key, its ADM2 when it is linked to exactly one, its ADM1 when all its ADM2s share one
+        links = links.dropna(subset=["agglomid"]).drop_duplicates(["agglomid", "ISO", "ID_1", "ID_2"])
+        per_ir = links.groupby("agglomid").agg(
+            n_adm2=("ID_2", "size"), n_adm1=("ID_1", "nunique"), n_iso=("ISO", "nunique"),
+        )
+        first = links.groupby("agglomid").first()
+        table = pd.DataFrame(index=pd.Index(self.ir_keys, name="agglomid").unique())
+        table["region-key"] = first["region-key"]
+        single_adm1 = (per_ir["n_adm1"] == 1) & (per_ir["n_iso"] == 1)
+        for column in ADM2_COLUMNS:
+            single = single_adm1 if column in ADM1_COLUMNS else per_ir["n_adm2"] == 1
+            table[column] = first[column].where(single)
+        self.ir_table = table
+        self.ir_resolves_adm2 = table["ID_2"].notna()
+
+    @classmethod
+    def open(cls, index_dir=INDEX_DIR, links_path=LINKS_PATH, rebuild=False):
+        """Load the persisted index (building it first if missing or stale) and the IR crosswalk."""
+        if rebuild or not is_fresh(index_dir):
+            build_index(index_dir)
+        ir = gpd.read_parquet(os.path.join(index_dir, "ir.parquet"))
+        adm2 = gpd.read_parquet(os.path.join(index_dir, "adm2.parquet"))
+        links = pd.read_csv(links_path, usecols=["agglomid", "region-key"] + ADM2_COLUMNS)
+        return cls(ir, adm2, links)
+
+    def points(self, lon, lat, crs=None):
+        points = shapely.points(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+        if crs is not None and self.crs is not None and pyproj.CRS.from_user_input(crs) != self.crs:
+            points = gpd.GeoSeries(points, crs=crs).to_crs(self.crs).values
+        return np.asarray(points)
+
+    def locate(self, lon, lat, crs=None, max_distance=None):
+        """IR and ADM2 attributes of each point (NaN where it falls outside every polygon), in input order.
+
+        `max_distance` (in index CRS units, degrees for GADM) snaps points outside every polygon to the
+        nearest one within that distance.
+        """
+        points = self.points(lon, lat, crs=crs)
+        n = len(points)
+        valid = np.flatnonzero(~shapely.is_missing(points) & ~shapely.is_empty(points)
+                               & np.isfinite(shapely.get_x(points)) & np.isfinite(shapely.get_y(points)))
+        result = pd.DataFrame({column: np.nan for column in OUTPUT_COLUMNS}, index=pd.RangeIndex(n))
+        result[OUTPUT_COLUMNS[1:]] = result[OUTPUT_COLUMNS[1:]].astype(object)
+
+        # One spatial query against the IRs for every point
+        ir_hits = _nearest_hits(self.ir_tree, points[valid], _first_hits(self.ir_tree, points[valid], len(valid)),
+                                max_distance)
+        in_ir = ir_hits >= 0
+        agglomid = self.ir_keys[ir_hits[in_ir]]
+        result.loc[valid[in_ir], "agglomid"] = agglomid
+        filled = self.ir_table.loc[agglomid, ["region-key"] + ADM2_COLUMNS]
+        result.loc[valid[in_ir], filled.columns] = filled.to_numpy()
+
+        # ADM2 query only where the IR does not determine it
+        resolved = np.zeros(len(valid), dtype=bool)
+        resolved[in_ir] = self.ir_resolves_adm2.loc[agglomid].to_numpy()
+        pending = valid[~resolved]
+        if len(pending):
+            adm2_hits = _first_hits(self.adm2_tree, points[pending], len(pending))
+            adm2_hits = _nearest_hits(self.adm2_tree, points[pending], adm2_hits, max_distance)
+            found = adm2_hits >= 0
+            result.loc[pending[found], ADM2_COLUMNS] = self.adm2_keys.iloc[adm2_hits[found]].to_numpy()
+
+        result["agglomid"] = result["agglomid"].astype(np.float64)
+        for column in ("ID_1", "ID_2"):
+            result[column] = pd.to_numeric(result[column]).astype("Int64")
+        # Fixed dtypes, so every chunk has the same Parquet schema even when nothing was located
+        for column in ("region-key", "ISO", "NAME_1", "NAME_2"):
+            result[column] = result[column].astype("string")
+        return result
+
+
+def _read_chunks(path, chunk_size, columns=None):
+    if path.endswith(".parquet"):
+        parquet = pq.ParquetFile(path)
+        for batch in parquet.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size, usecols=columns)
+
+
+class _ChunkWriter:
+    """Appends located chunks to a CSV or Parquet file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = None
+        self.first = True
+
+    def write(self, chunk):
+        if self.path.endswith(".parquet"):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self.parquet is None:
+                self.parquet = pq.ParquetWriter(self.path, table.schema)
+            self.parquet.write_table(table.cast(self.parquet.schema))
+        else:
+            chunk.to_csv(self.path, mode="w" if self.first else "a", header=self.first, index=False)
+        self.first = False
+
+    def close(self):
+        if self.parquet is not None:
+            self.parquet.close()
+
+
+def geocode_file(index, input_path, output_path, lon="lon", lat="lat", crs=None, chunk_size=CHUNK_SIZE,
+                 max_distance=None, columns=None):
+    """Stream `input_path` (CSV or Parquet) through the index, writing the located rows to `output_path`."""
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    writer = _ChunkWriter(output_path)
+    total = located = 0
+    try:
+        for chunk in _read_chunks(input_path, chunk_size, columns=columns):
+            chunk = chunk.reset_index(drop=True)
+            found = index.locate(chunk[lon].to_numpy(), chunk[lat].to_numpy(), crs=crs, max_distance=max_distance)
+            # Input columns named like an output column are replaced
+            chunk = pd.concat([chunk.drop(columns=OUTPUT_COLUMNS, errors="ignore"), found], axis=1)
+            writer.write(chunk)
+            total += len(chunk)
+            located += int(found["ISO"].notna().sum())
+            print(f"Located {located:,} of {total:,} points")
+        if writer.first:  # Empty input: still write the header
+            writer.write(pd.DataFrame(columns=OUTPUT_COLUMNS))
+    finally:
+        writer.close()
+    print(f"Output saved: {output_path}")
+    return total, located
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Assign the IR and ADM2 of each point of a CSV or Parquet file.")
+    parser.add_argument("input", nargs="?", help="CSV or Parquet file of points")
+    parser.add_argument("output", nargs="?", help="CSV or Parquet file to write (by extension)")
+    parser.add_argument("--lon", default="lon", help="Longitude (x) column")
+    parser.add_argument("--lat", default="lat", help="Latitude (y) column")
+    parser.add_argument("--crs", help="CRS of the input coordinates (default: the index CRS, EPSG:4326)")
+    parser.add_argument("--columns", nargs="+", help="Input columns to keep (default: all)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Points per chunk")
+    parser.add_argument("--snap", type=float, help="Snap points outside every polygon to the nearest one within "
+                                                   "this distance (index CRS units)")
+    parser.add_argument("--build", action="store_true", help="Only (re)build the index")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the index before geocoding")
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    parser.add_argument("--links", default=LINKS_PATH, help="IR-to-ADM2 crosswalk written by 01_link_ir_to_adm.py")
+    options = parser.parse_args()
+
+    if options.build:
+        build_index(options.index_dir)
+        return
+    if not options.input or not options.output:
+        parser.error("input and output are required unless --build is given")
+    columns = None
+    if options.columns:
+        columns = list(dict.fromkeys(options.columns + [options.lon, options.lat]))
+    index = GeoIndex.open(options.index_dir, options.links, rebuild=options.rebuild)
+    geocode_file(index, options.input, options.output, lon=options.lon, lat=options.lat, crs=options.crs,
+                 chunk_size=options.chunk_size, max_distance=options.snap, columns=columns)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# Grouped geometry operations with Shapely 2 vectorized unions and a process pool
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import GeometryCollection
+
+
+def _is_noded(geoms):
+    # True when every vertex lying on another polygon's boundary is also a vertex of that polygon, so
+    # shared edges are made of the same segments (no T-junctions, no one-sided densified edges)
+    coords, owner = shapely.get_coordinates(geoms, return_index=True)
+    point_index, geom_index = shapely.STRtree(shapely.boundary(geoms)).query(
+        shapely.points(coords), predicate="intersects"
+    )
+    other = owner[point_index] != geom_index
+    touching = pd.DataFrame({"geom": geom_index[other], "x": coords[point_index[other], 0],
+                             "y": coords[point_index[other], 1]})
+    vertices = pd.DataFrame({"geom": owner, "x": coords[:, 0], "y": coords[:, 1]}).drop_duplicates()
+    return len(touching.merge(vertices, how="inner").drop_duplicates()) == len(touching.drop_duplicates())
+
+
+def is_coverage(geoms):
+    """True when valid polygons `geoms` have no overlapping interiors and identically noded shared edges."""
+    if not shapely.is_valid(geoms).all():
+        return False
+    # coverage_is_valid only inspects edges, so also rule out interiors that overlap
+    left, right = shapely.STRtree(geoms).query(geoms)
+    pairs = left < right
+    if shapely.relate_pattern(geoms[left[pairs]], geoms[right[pairs]], "2********").any():
+        return False
+    return bool(shapely.coverage_is_valid(GeometryCollection(list(geoms)))) and _is_noded(geoms)
+
+
+def simplify_layer(geoms, tolerance):
+    """Simplify a layer of polygons, keeping shared borders shared when the layer is a coverage.
+
+    Polygons that tile without overlaps and share identically noded edges (ADM2s of a country,
+    IRs) go through GEOS coverage simplification, so neighbours never gap or overlap; other layers,
+    and coverages GEOS rejects, are simplified one geometry at a time with topology preserved
+    within each geometry.
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    if tolerance <= 0:
+        return geoms.copy()
+    present = ~(shapely.is_missing(geoms) | shapely.is_empty(geoms))
+    simplified = geoms.copy()
+    parts = geoms[present]
+    polygonal = np.isin(shapely.get_type_id(parts), [3, 6])  # Polygon, MultiPolygon
+    if len(parts) and polygonal.all() and is_coverage(parts):
+        try:
+            simplified[present] = shapely.coverage_simplify(parts, tolerance)
+            return simplified
+        except shapely.errors.GEOSException:
+            pass
+    simplified[present] = shapely.simplify(parts, tolerance, preserve_topology=True)
+    return simplified
+
+
+def union_group(geoms):
+    """Union of `geoms` (GEOS overlay union, correct whether or not the parts are noded alike)."""
+    geoms = geoms[~(shapely.is_missing(geoms) | shapely.is_empty(geoms))]
+    if len(geoms) == 0:
+        return GeometryCollection()
+    if len(geoms) == 1:
+        return geoms[0]
+    return shapely.union_all(geoms)
+
+
+def _union_chunk(country, keys, geoms):
+    # Union every group of one chunk; `keys` are sorted so groups are contiguous runs
+    start = time.perf_counter()
+    boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    starts = np.concatenate([[0], boundaries])
+    ends = np.concatenate([boundaries, [len(keys)]])
+    unions = [union_group(geoms[a:b]) for a, b in zip(starts, ends)]
+    return country, keys[starts], unions, time.perf_counter() - start
+
+
+def _chunks(keys, geoms, countries, max_groups):
+    # Split the work by country, and large countries into runs of at most `max_groups` groups
+    order = np.lexsort((keys, countries))
+    keys, geoms, countries = keys[order], geoms[order], countries[order]
+    new_group = np.concatenate([[True], keys[1:] != keys[:-1]])
+    new_country = np.concatenate([[True], countries[1:] != countries[:-1]])
+    group_number = np.cumsum(new_group) - 1
+    country_start_group = np.maximum.accumulate(np.where(new_country, group_number, 0))
+    chunk_id = np.cumsum(new_country | (new_group & ((group_number - country_start_group) % max_groups == 0))) - 1
+    bounds = np.flatnonzero(np.diff(chunk_id)) + 1
+    for a, b in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(keys)]])):
+        yield countries[a], keys[a:b], geoms[a:b]
+
+
+def grouped_union(geometry, keys, countries, n_workers=None, max_groups=200):
+    """Union `geometry` per key, spreading groups across a process pool.
+
+    Returns a Series of unioned geometries indexed by key, and a DataFrame with the
+    number of groups and the union time (seconds of worker time) per country.
+    """
+    geometry = np.array(geometry, dtype=object)
+    geometry[pd.isna(geometry)] = None  # Unmatched left-merge rows come through as NaN
+    keys = np.asarray(keys).astype(str)
+    countries = np.asarray(countries).astype(str)
+    n_workers = n_workers or os.cpu_count() or 1
+    if len(keys) == 0:
+        return pd.Series(dtype=object), pd.DataFrame(columns=["ISO", "groups", "seconds"])
+
+    # Largest chunks first so that dense countries do not finish last
+    chunks = sorted(_chunks(keys, geometry, countries, max_groups), key=lambda chunk: -len(chunk[1]))
+    if n_workers == 1:
+        results = [_union_chunk(*chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(_union_chunk, *zip(*chunks)))
+
+    unions = pd.Series(
+        [geom for result in results for geom in result[2]],
+        index=[key for result in results for key in result[1]],
+        dtype=object,
+    )
+    timings = pd.DataFrame(
+        [(country, len(group_keys), seconds) for country, group_keys, _, seconds in results],
+        columns=["ISO", "groups", "seconds"],
+    ).groupby("ISO", as_index=False).sum().sort_values("seconds", ascending=False)
+    return unions, timings
@@ -0,0 +1,259 @@
+# Lightweight instrumentation of the pipeline stages: wall time, CPU time, peak memory and
+# item counts per named step, written as a JSON report and printed as a table at the end of a run
+#
+# Usage:
+#     from instrument import Instrument
+#     run = Instrument("03")
+#     with run.step("load") as step:
+#         gdf = ...
+#         step.items = len(gdf)
+#     run.begin("write", items=n)  # Sequential form for flat scripts: lasts until the next step
+#     ...
+#     run.finish()
+#
+# Profiling is opt-in through environment variables:
+#     PIPELINE_PROFILE=cprofile|pyinstrument   profile the hot steps (step(..., hot=True))
+#     PIPELINE_PROFILE_STEPS=load,compute      profile these steps instead ("all" for every step)
+# Profiles are saved next to the report, as .prof (open with snakeviz/pstats) or .html files.
+
+import atexit
+import cProfile
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+REPORT_DIR = "./outputs/reports"
+
+
+def _proc_status_kb(field):
+    # Value of a /proc/self/status field in kB, or None where /proc is unavailable
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _peak_rss_mb():
+    # Process high-water mark so far
+    peak = _proc_status_kb("VmHWM")
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            peak /= 1024  # Bytes on macOS
+    return peak / 1024
+
+
+def _rss_mb():
+    rss = _proc_status_kb("VmRSS")
+    return None if rss is None else rss / 1024
+
+
+class _RssSampler(threading.Thread):
+    """Samples the resident set size, so a step that stays below an earlier peak still gets its own."""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = _rss_mb()
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.peak = _rss_mb()
+
+    def read(self):
+        with self.lock:
+            return self.peak
+
+    def run(self):
+        while True:
+            rss = _rss_mb()
+            with self.lock:
+                if rss is not None and (self.peak is None or rss > self.peak):
+                    self.peak = rss
+            time.sleep(self.interval)
+
+
+def _cpu_seconds():
+    # This process plus its finished child processes (e.g. the sharding and tile worker pools)
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class Step:
+    """Measurements of one named step; set `items` to the number of things it processed."""
+
+    def __init__(self, run, name, items=None, hot=False):
+        self.run = run
+        self.name = name
+        self.items = items
+        self.hot = hot
+        self.result = None
+
+    def start(self):
+        self.run.sampler.reset()
+        self.peak_before = _peak_rss_mb()
+        self.children_peak_before = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        self.profiler = self.run._start_profiler(self)
+        self.wall_start = time.perf_counter()
+        self.cpu_start = _cpu_seconds()
+        return self
+
+    def stop(self):
+        wall = time.perf_counter() - self.wall_start
+        cpu = _cpu_seconds() - self.cpu_start
+        profile_path = self.run._stop_profiler(self, self.profiler)
+        children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        # A new process high-water mark was set during the step, or else the sampled peak
+        peak = _peak_rss_mb()
+        sampled = self.run.sampler.read()
+        if peak <= self.peak_before and sampled is not None:
+            peak = max(sampled, _rss_mb())
+        self.result = {
+            "name": self.name,
+            "wall_s": round(wall, 4),
+            "cpu_s": round(cpu, 4),
+            "peak_rss_mb": round(peak, 1),
+            "children_peak_rss_mb": round(children_peak / 1024, 1) if children_peak > self.children_peak_before else None,
+            "items": self.items,
+            "items_per_s": round(self.items / wall, 2) if self.items is not None and wall > 0 else None,
+        }
+        if profile_path:
+            self.result["profile"] = profile_path
+        self.run.steps.append(self.result)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+
+class Instrument:
+    """Collects the steps of one stage run and reports them at the end."""
+
+    def __init__(self, stage, report_dir=REPORT_DIR):
+        self.stage = stage
+        self.report_dir = report_dir
+        self.steps = []
+        self.current = None
+        self.finished = False
+        self.started = datetime.now(timezone.utc)
+        self.wall_start = time.perf_counter()
+        self.cpu_start = _cpu_seconds()
+        self.profile_mode = os.environ.get("PIPELINE_PROFILE", "").lower() or None
+        steps = os.environ.get("PIPELINE_PROFILE_STEPS", "")
+        self.profile_steps = {name.strip() for name in steps.split(",") if name.strip()}
+        self.sampler = _RssSampler()
+        self.sampler.start()
+        atexit.register(self._finish_at_exit)
+
+    def step(self, name, items=None, hot=False):
+        """Context manager measuring one step; `hot` marks it for the opt-in profiler."""
+        self.end()
+        return Step(self, name, items=items, hot=hot)
+
+    def begin(self, name, items=None, hot=False):
+        """Start a step that lasts until the next begin(), end() or finish()."""
+        self.end()
+        self.current = Step(self, name, items=items, hot=hot).start()
+        return self.current
+
+    def end(self):
+        if self.current is not None:
+            self.current.stop()
+            self.current = None
+
+    def count(self, items):
+        """Set the item count of the step started with begin()."""
+        if self.current is not None:
+            self.current.items = items
+
+    def _profiled(self, step):
+        if not self.profile_mode:
+            return False
+        if self.profile_steps:
+            return "all" in self.profile_steps or step.name in self.profile_steps
+        return step.hot
+
+    def _start_profiler(self, step):
+        if not self._profiled(step):
+            return None
+        if self.profile_mode == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                print("pyinstrument is not installed; profiling with cProfile instead.")
+                self.profile_mode = "cprofile"
+            else:
+                profiler = Profiler()
+                profiler.start()
+                return profiler
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _stop_profiler(self, step, profiler):
+        if profiler is None:
+            return None
+        os.makedirs(self.report_dir, exist_ok=True)
+        base = os.path.join(self.report_dir, f"{self.stage}_{step.name}")
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            profiler.dump_stats(base + ".prof")
+            return base + ".prof"
+        profiler.stop()
+        with open(base + ".html", "w") as f:
+            f.write(profiler.output_html())
+        return base + ".html"
+
+    def report(self, status="completed"):
+        return {
+            "stage": self.stage,
+            "status": status,
+            "argv": sys.argv,
+            "started": self.started.isoformat(timespec="seconds"),
+            "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+            "total": {
+                "wall_s": round(time.perf_counter() - self.wall_start, 4),
+                "cpu_s": round(_cpu_seconds() - self.cpu_start, 4),
+                "peak_rss_mb": round(_peak_rss_mb(), 1),
+            },
+            "steps": self.steps,
+        }
+
+    def finish(self, status="completed"):
+        """Close the open step, write <report_dir>/<stage>_report.json and print the step table."""
+        self.end()
+        self.finished = True
+        report = self.report(status)
+        os.makedirs(self.report_dir, exist_ok=True)
+        path = os.path.join(self.report_dir, f"{self.stage}_report.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+        print(f"\n{'step':<16} {'wall s':>9} {'cpu s':>9} {'peak MB':>9} {'items':>10} {'items/s':>12}")
+        for row in report["steps"]:
+            items = "" if row["items"] is None else f"{row['items']:,}"
+            rate = "" if row["items_per_s"] is None else f"{row['items_per_s']:,.0f}"
+            print(f"{row['name']:<16} {row['wall_s']:>9.2f} {row['cpu_s']:>9.2f} {row['peak_rss_mb']:>9.0f} "
+                  f"{items:>10} {rate:>12}")
+        total = report["total"]
+        print(f"{'total':<16} {total['wall_s']:>9.2f} {total['cpu_s']:>9.2f} {total['peak_rss_mb']:>9.0f}")
+        print(f"Report saved: {path}")
+        return report
+
+    def _finish_at_exit(self):
+        # Scripts that stop early (an exception or sys.exit) still leave a report of the steps so far
+        if not self.finished:
+            self.finish(status="incomplete")
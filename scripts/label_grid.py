@@ -0,0 +1,161 @@
+# Integer label rasters of ADM2 units (and IRs) on the LandScan grid, per-label and per-label-pair population sums
+
+from contextlib import ExitStack
+
+import numpy as np
+import rasterio
+from rasterio.features import rasterize
+from rasterio.windows import Window
+from shapely.geometry import box
+
+ADM2_KEYS = ["GID_0", "ID_1", "NAME_1", "ID_2", "NAME_2"]
+LABEL_DTYPE = "int32"
+
+
+def adm2_label_table(gdf, keys=ADM2_KEYS):
+    """Assign a 1-based integer label to every ADM2 in `gdf`.
+
+    Returns the label table (one row per ADM2, ordered by label) and the label of
+    every row of `gdf` (0 for rows with missing keys, which are never burned).
+    """
+    codes = gdf.groupby(keys, sort=True).ngroup().to_numpy()
+    row_labels = np.where(codes >= 0, codes + 1, 0).astype(LABEL_DTYPE)
+    table = (
+        gdf[keys].assign(label=row_labels)
+        .query("label > 0")
+        .drop_duplicates("label")
+        .sort_values("label")
+        .reset_index(drop=True)
+    )
+    return table, row_labels
+
+
+def strip_windows(width, height, block_rows):
+    """Full-width windows of `block_rows` rows covering a raster from top to bottom."""
+    for row_off in range(0, height, block_rows):
+        yield Window(0, row_off, width, min(block_rows, height - row_off))
+
+
+def rasterize_labels(gdf, row_labels, template_path, output_path, block_rows=1024):
+    """Burn `row_labels` of the polygons in `gdf` into a tiled GeoTIFF aligned with `template_path`.
+
+    Pixels are assigned by centre point (as in `rasterstats`); where polygons overlap
+    the last one wins. The grid is written strip by strip, querying the spatial
+    index for the polygons that reach each strip.
+    """
+    with rasterio.open(template_path) as template:
+        profile = {
+            "driver": "GTiff", "width": template.width, "height": template.height, "count": 1,
+            "dtype": LABEL_DTYPE, "crs": template.crs, "transform": template.transform, "nodata": 0,
+            "tiled": True, "blockxsize": 512, "blockysize": 512, "compress": "deflate",
+            "predictor": 2, "BIGTIFF": "IF_SAFER",
+        }
+
+    keep = row_labels > 0
+    geometry = gdf.geometry[keep].reset_index(drop=True)
+    labels = row_labels[keep]
+    sindex = geometry.sindex
+
+    with rasterio.open(output_path, "w", **profile) as dst:
+        for window in strip_windows(dst.width, dst.height, block_rows):
+            transform = dst.window_transform(window)
+            bounds = rasterio.windows.bounds(window, dst.transform)
+            hits = np.sort(sindex.query(box(*bounds)))
+            if len(hits) == 0:
+                continue
+            burned = rasterize(
+                zip(geometry.iloc[hits], labels[hits]),
+                out_shape=(window.height, window.width),
+                transform=transform,
+                fill=0,
+                dtype=LABEL_DTYPE,
+            )
+            dst.write(burned, 1, window=window)
+
+
+def _data_mask(values, nodata):
+    # Pixels holding data: not nodata, and not NaN for float rasters (NaN != NaN, so nodata=NaN needs isnan)
+    data = np.ones(values.shape, dtype=bool) if nodata is None else values != nodata
+    if np.issubdtype(values.dtype, np.floating):
+        data &= ~np.isnan(values)
+    return data
+
+
+def label_sums(label_path, raster_paths, n_labels, block_rows=1024):
+    """Sum the pixels of each raster in `raster_paths` per label of `label_path`.
+
+    The label grid is read once per strip and shared by all rasters; each raster
+    then costs one bincount per strip. Returns an array of shape
+    (n_labels + 1, len(raster_paths)); row 0 (background) stays zero.
+    """
+    sums = np.zeros((n_labels + 1, len(raster_paths)), dtype=np.float64)
+    with ExitStack() as stack:
+        labels_src = stack.enter_context(rasterio.open(label_path))
+        sources = [stack.enter_context(rasterio.open(path)) for path in raster_paths]
+        for path, src in zip(raster_paths, sources):
+            if labels_src.shape != src.shape or not labels_src.transform.almost_equals(src.transform):
+                raise ValueError(f"Label grid {label_path} is not aligned with {path}.")
+
+        for window in strip_windows(labels_src.width, labels_src.height, block_rows):
+            labels = labels_src.read(1, window=window)
+            labelled = labels > 0
+            if not labelled.any():
+                continue
+            for j, src in enumerate(sources):
+                values = src.read(1, window=window)
+                valid = labelled & _data_mask(values, src.nodata)
+                sums[:, j] += np.bincount(labels[valid], weights=values[valid], minlength=n_labels + 1)
+    return sums
+
+
+def _reduce_pairs(keys, sums):
+    # Sum the rows of `sums` sharing a key; returns sorted unique keys and their sums
+    unique, inverse = np.unique(keys, return_inverse=True)
+    reduced = np.zeros((len(unique), sums.shape[1]), dtype=np.float64)
+    for j in range(sums.shape[1]):
+        reduced[:, j] = np.bincount(inverse, weights=sums[:, j], minlength=len(unique))
+    return unique, reduced
+
+
+def pair_sums(label_path_a, label_path_b, raster_paths, block_rows=1024, reduce_rows=1 << 22):
+    """Sum the pixels of each raster per pair of labels of two label grids (e.g. IR × ADM2).
+
+    Each strip is one joint histogram: the two labels of every pixel are packed into one int64
+    key, and the pixels are summed per distinct key with a bincount per raster. Only pairs that
+    occur are kept, so memory follows the number of overlapping pairs, not n_a × n_b. Returns
+    (labels_a, labels_b, sums) with sums of shape (n_pairs, len(raster_paths)); pixels with a
+    0 (background) label in either grid are left out.
+    """
+    key_parts, sum_parts, pending = [np.empty(0, dtype=np.int64)], [np.empty((0, len(raster_paths)))], 0
+    with ExitStack() as stack:
+        src_a = stack.enter_context(rasterio.open(label_path_a))
+        src_b = stack.enter_context(rasterio.open(label_path_b))
+        sources = [stack.enter_context(rasterio.open(path)) for path in raster_paths]
+        for path, src in [(label_path_b, src_b)] + list(zip(raster_paths, sources)):
+            if src_a.shape != src.shape or not src_a.transform.almost_equals(src.transform):
+                raise ValueError(f"{path} is not aligned with the label grid {label_path_a}.")
+
+        for window in strip_windows(src_a.width, src_a.height, block_rows):
+            labels_a = src_a.read(1, window=window)
+            labels_b = src_b.read(1, window=window)
+            both = (labels_a > 0) & (labels_b > 0)
+            if not both.any():
+                continue
+            strip_keys = (labels_a[both].astype(np.int64) << 32) | labels_b[both].astype(np.int64)
+            unique, inverse = np.unique(strip_keys, return_inverse=True)
+            strip_sums = np.zeros((len(unique), len(sources)), dtype=np.float64)
+            for j, src in enumerate(sources):
+                values = src.read(1, window=window)[both]
+                weights = np.where(_data_mask(values, src.nodata), values, 0)
+                strip_sums[:, j] = np.bincount(inverse, weights=weights, minlength=len(unique))
+            key_parts.append(unique)
+            sum_parts.append(strip_sums)
+
+            # Fold the strips together now and then, so pairs spanning many strips are stored once
+            pending += len(unique)
+            if pending >= reduce_rows:
+                keys, sums = _reduce_pairs(np.concatenate(key_parts), np.concatenate(sum_parts))
+                key_parts, sum_parts, pending = [keys], [sums], 0
+
+    keys, sums = _reduce_pairs(np.concatenate(key_parts), np.concatenate(sum_parts))
+    return (keys >> 32).astype(LABEL_DTYPE), (keys & 0xFFFFFFFF).astype(LABEL_DTYPE), sums
@@ -0,0 +1,104 @@
+# Row-level diff of the IR-to-ADM2 link table, for incremental updates of the downstream stages
+#
+# 01_link_ir_to_adm.py compares the mapping it just built with the previous ir_to_adm2_adm1.parquet and
+# records the changed rows as a changes file: the agglomid, OBJECTID, ADM2 and country sets, and
+# the per-country outputs to regenerate. 06_generate_adm2_geojson_by_country.py --changes rebuilds
+# only those countries. The pipeline passes the file on when the link table is the only changed input.
+# The file records the SHA-256 of both versions of the table, so it is only applied to the version
+# it was computed from.
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from link_table import LINK_COLUMNS
+
+CHANGES_PATH = "./outputs/ir_to_adm2_changes.json"
+GEOJSON_FOLDER = "adm2-geojson-dataset"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_text_table(path):
+    # Cell text as written, so values are compared exactly (no float or NaN conversions). Parquet
+    # link tables are cast to text the same way, with nulls as empty cells, leaving out the ADM codes
+    # (renumbered whenever an ADM2 is added, so they would mark every following row as changed)
+    if path.endswith(".parquet"):
+        table = pq.read_table(path, columns=LINK_COLUMNS)
+        table = table.cast(pa.schema([pa.field(name, pa.string()) for name in table.column_names]))
+        return table.to_pandas().fillna("")
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+
+def _sorted_ids(values):
+    # Numeric order for numeric ids ("2" before "10"), unparseable ones last
+    values = pd.Series(values, dtype=str).drop_duplicates()
+    order = pd.to_numeric(values, errors="coerce").sort_values(na_position="last", kind="stable").index
+    return values[order].tolist()
+
+
+def diff_links(old, new):
+    """Rows removed from `old` and added in `new` (tables of text cells); duplicated rows count as many times."""
+    columns = list(new.columns)
+    if list(old.columns) != columns:
+        return old, new
+    # Number repeated rows so that the outer merge pairs them one to one
+    old = old.assign(_n=old.groupby(columns, sort=False).cumcount())
+    new = new.assign(_n=new.groupby(columns, sort=False).cumcount())
+    merged = old.merge(new, on=columns + ["_n"], how="outer", indicator=True)
+    removed = merged.loc[merged["_merge"] == "left_only", columns]
+    added = merged.loc[merged["_merge"] == "right_only", columns]
+    return removed, added
+
+
+def describe_changes(old_path, new_path):
+    """The changes between two versions of the link table (`old_path` may be missing: a full change)."""
+    new = read_text_table(new_path)
+    changes = {"base": None, "target": file_sha256(new_path), "full": True}
+    if old_path is None or not os.path.exists(old_path):
+        return changes
+    old = read_text_table(old_path)
+    changes["base"] = file_sha256(old_path)
+    if list(old.columns) != list(new.columns):
+        return changes
+
+    removed, added = diff_links(old, new)
+    rows = pd.concat([removed, added], ignore_index=True)
+    adm2 = rows[["ISO", "ID_1", "ID_2"]].drop_duplicates().sort_values(["ISO", "ID_1", "ID_2"])
+    countries = sorted(iso for iso in rows["ISO"].unique() if iso)
+    changes.update({
+        "full": False,
+        "rows_removed": len(removed),
+        "rows_added": len(added),
+        "agglomid": _sorted_ids(rows["agglomid"]),
+        "objectid": _sorted_ids(rows["OBJECTID"]),
+        "adm2": adm2.values.tolist(),
+        "countries": countries,
+        "geojson": [os.path.join(GEOJSON_FOLDER, f"{iso}_adm2.geojson") for iso in countries],
+    })
+    return changes
+
+
+def write_changes(changes, path=CHANGES_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(changes, f, indent=2)
+
+
+def read_changes(path=CHANGES_PATH, target_path=None):
+    """Load a changes file, checking that it describes the current content of `target_path` if given."""
+    with open(path) as f:
+        changes = json.load(f)
+    if target_path is not None and changes["target"] != file_sha256(target_path):
+        raise ValueError(f"{path} does not describe the current {target_path}; rerun 01_link_ir_to_adm.py.")
+    return changes
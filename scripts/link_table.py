@@ -0,0 +1,91 @@
+# Typed IR-to-ADM2 link table, stored as Parquet between the stages
+#
+# 01_link_ir_to_adm.py writes ir_to_adm2_adm1.parquet with integer OBJECTID/agglomid/ID columns,
+# dictionary-encoded names, and dense integer codes of the ADM2s and ADM1s, so the later stages join
+# and group on integers instead of re-parsing the CSV and rebuilding string keys. The CSV is still
+# written next to it for people and tools outside the pipeline.
+#
+# Usage:
+#     from link_table import read_links
+#     links = read_links(columns=["agglomid", "adm2_code"], countries=["IND"])
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+LINKS_PARQUET = "./outputs/ir_to_adm2_adm1.parquet"
+LINKS_CSV = "./outputs/ir_to_adm2_adm1.csv"
+
+# Columns of the CSV, in order, then the integer codes: ADM2s and ADM1s numbered in (ISO, ID_1, ID_2)
+# order. Rows without a GADM match (a null ISO, ID_1 or ID_2) have null codes, never a real ADM's code
+LINK_COLUMNS = ["agglomid", "region-key", "OBJECTID", "ISO", "ID_1", "NAME_1", "ID_2", "NAME_2"]
+CODE_COLUMNS = ["adm2_code", "adm1_code"]
+SCHEMA = pa.schema([
+    ("agglomid", pa.int64()),
+    ("region-key", pa.string()),
+    ("OBJECTID", pa.int64()),
+    ("ISO", pa.dictionary(pa.int32(), pa.string())),
+    ("ID_1", pa.int32()),
+    ("NAME_1", pa.dictionary(pa.int32(), pa.string())),
+    ("ID_2", pa.int32()),
+    ("NAME_2", pa.dictionary(pa.int32(), pa.string())),
+    ("adm2_code", pa.int32()),  # Null when the row has no GADM match
+    ("adm1_code", pa.int32()),  # Null when the row has no GADM ADM1
+])
+
+# Nullable pandas dtypes for the integer columns, so missing matches do not turn them into floats
+PANDAS_TYPES = {pa.int64(): pd.Int64Dtype(), pa.int32(): pd.Int32Dtype()}
+
+
+def split_ids(values):
+    """Split whitespace-separated id lists (e.g. hierarchy `gadmid`): (row of each id, id as int64).
+
+    Ids that are not integers become null, so they match nothing.
+    """
+    lists = pc.utf8_split_whitespace(pa.array(values, type=pa.string()))
+    parents = pc.list_parent_indices(lists).to_numpy()
+    tokens = pc.list_flatten(lists)
+    numeric = pc.match_substring_regex(tokens, r"^[+-]?\d+$")
+    ids = pc.if_else(numeric, tokens, pa.scalar(None, pa.string())).cast(pa.int64())
+    return parents, ids.to_pandas(types_mapper=PANDAS_TYPES.get)
+
+
+def add_codes(links):
+    """Add the dense `adm2_code` and `adm1_code` columns to a link table (null where a key is missing)."""
+    links = links.copy()
+    links["adm2_code"] = links.groupby(["ISO", "ID_1", "ID_2"], sort=True).ngroup().astype("Int32")
+    links["adm1_code"] = links.groupby(["ISO", "ID_1"], sort=True).ngroup().astype("Int32")
+    return links
+
+
+def write_links(links, path=LINKS_PARQUET):
+    """Write the coded link table as Parquet (same bytes for the same table, so unchanged runs can be detected)."""
+    table = pa.Table.from_pandas(links[LINK_COLUMNS + CODE_COLUMNS], schema=SCHEMA, preserve_index=False)
+    pq.write_table(table.replace_schema_metadata(None), path, compression="zstd")
+
+
+def read_links(path=LINKS_PARQUET, columns=None, countries=None):
+    """Read the link table as pandas (names as str, nullable integer ids), optionally for some countries only.
+
+    The country filter is applied by the Parquet reader, so only the rows of those countries reach pandas.
+    """
+    filters = None if countries is None else [("ISO", "in", list(countries))]
+    table = pq.read_table(path, columns=columns, filters=filters)
+    # Names come back as plain strings, not categoricals, so they compare and concatenate as before
+    table = table.cast(pa.schema([
+        pa.field(field.name, field.type.value_type if pa.types.is_dictionary(field.type) else field.type)
+        for field in table.schema
+    ]))
+    return table.to_pandas(types_mapper=PANDAS_TYPES.get)
+
+
+def to_csv(links, path=LINKS_CSV):
+    links[LINK_COLUMNS].to_csv(path, index=False)
+
+
+def adm2_ids(links):
+    """`ISO_ID1_ID2` identifiers of the rows, formatted once per distinct ADM2 code."""
+    first = links.drop_duplicates("adm2_code").set_index("adm2_code")
+    ids = first["ISO"] + "_" + first["ID_1"].astype(str) + "_" + first["ID_2"].astype(str)
+    return pd.Series(ids.reindex(links["adm2_code"]).to_numpy(), index=links.index, dtype=object)
@@ -0,0 +1,314 @@
+# Incremental runner for the pipeline stages
+#
+# Each stage declares its script, arguments, inputs and outputs. A stage is re-run only when the
+# content hash of its inputs, its code (script plus local helper modules) or its arguments changed
+# since its last successful run, or when one of its outputs is missing. Stages whose inputs do not
+# depend on each other (e.g. 03 and 05) run concurrently. A stage declaring an incremental input is
+# run with --changes <changes file> when that input is the only thing that changed, and the changes
+# file describes exactly the version it last ran on (e.g. 06 after a small revision of the links).
+#
+# Usage: python scripts/pipeline.py [--years 2015 2016] [--only 03 04] [--jobs 2] [--force] [--dry-run]
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_PATH = "./outputs/.pipeline/state.json"
+HASH_CACHE_PATH = "./outputs/.pipeline/hashes.json"
+LOG_DIR = "./outputs/.pipeline/logs"
+
+GADM_SHAPEFILE = "./data/gadm36_shp/gadm36.*"
+IR_SHAPEFILE = "./data/world-combo-new/agglomerated-world-new.*"
+# Written last by geocache.py for a complete cache layer; the stages reading geometries depend on them,
+# so the cache is built once by its own stage instead of lazily by several stages at the same time
+GADM_CACHE = "./data/cache/gadm36/manifest.json"
+IR_CACHE = "./data/cache/ir/manifest.json"
+LANDSCAN_RASTER = "./data/landscan/landscan-global-{year}-assets/landscan-global-{year}.tif"
+GEOJSON_FOLDER = "adm2-geojson-dataset"
+LINKS = "./outputs/ir_to_adm2_adm1.parquet"  # Typed link table read by 02, 04 and 06, see link_table.py
+LINK_CHANGES = "./outputs/ir_to_adm2_changes.json"  # Written by 01, see link_diff.py
+
+
+@dataclass
+class Stage:
+    name: str
+    script: str
+    inputs: list
+    outputs: list
+    args: list = field(default_factory=list)
+    incremental: dict = field(default_factory=dict)  # Input -> changes file describing its row-level diff
+
+
+def build_stages(years, population_method):
+    # Inputs and outputs are paths or glob patterns, relative to the repository root
+    rasters = [LANDSCAN_RASTER.format(year=year) for year in years]
+    population_csvs = [f"./outputs/population_by_adm2_{year}.csv" for year in years]
+    label_grid = ["./outputs/adm2_label_grid/adm2_labels.tif", "./outputs/adm2_label_grid/adm2_labels.csv"]
+    pair_population = "./outputs/ir_adm2_population.parquet"
+
+    stages = [
+        Stage("cache", "geocache.py", [GADM_SHAPEFILE, IR_SHAPEFILE], [GADM_CACHE, IR_CACHE]),
+        Stage("01", "01_link_ir_to_adm.py", ["./data/hierarchy.csv", "./data/gadm2.csv"],
+              [LINKS, "./outputs/ir_to_adm2_adm1.csv", LINK_CHANGES]),
+        Stage("02", "02_summarize_ir_adm_relations.py", [LINKS],
+              ["./outputs/ir_adm_stats.csv"]),
+        Stage("03", "03_extract_population.py",
+              [GADM_CACHE] + rasters + (label_grid if population_method == "labels" else []),
+              population_csvs,
+              ["--years"] + [str(year) for year in years] + ["--method", population_method]),
+        Stage("07", "07_rasterize_adm2_labels.py", [GADM_CACHE, rasters[0]], label_grid),
+        Stage("10", "10_ir_adm2_population.py", [IR_CACHE] + label_grid + rasters,
+              ["./outputs/ir_label_grid/ir_labels.tif", "./outputs/ir_label_grid/ir_labels.csv", pair_population],
+              ["--years"] + [str(year) for year in years]),
+        Stage("04", "04_create_netcdf.py", population_csvs + [LINKS, pair_population],
+              ["./outputs/impact_regions.nc", "./outputs/impact_regions.zarr"]),
+        Stage("09", "09_export_binary_crosswalk.py", ["./outputs/impact_regions.nc"], ["./outputs/crosswalk_bin"]),
+        Stage("05", "05_country_ir_geojson.py", [IR_CACHE],
+              [f"{GEOJSON_FOLDER}/*_ir.geojson"]),
+        Stage("06", "06_generate_adm2_geojson_by_country.py",
+              [LINKS, GADM_CACHE, IR_CACHE],
+              [f"{GEOJSON_FOLDER}/*_adm2.geojson", f"{GEOJSON_FOLDER}/ir_problematic"],
+              incremental={LINKS: LINK_CHANGES}),
+        Stage("08", "08_build_vector_tiles.py", [f"{GEOJSON_FOLDER}/*_adm2.geojson", IR_CACHE],
+              ["./outputs/tiles/adm2.pmtiles", "./outputs/tiles/ir.pmtiles"]),
+    ]
+    return stages
+
+
+def dependencies(stages):
+    # Stage B depends on stage A when one of B's inputs is one of A's outputs
+    produced_by = {path: stage.name for stage in stages for path in stage.outputs}
+    return {
+        stage.name: {produced_by[path] for path in stage.inputs if path in produced_by} - {stage.name}
+        for stage in stages
+    }
+
+
+def expand(pattern):
+    return sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+
+
+def _files_under(path):
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                yield os.path.join(root, name)
+    elif os.path.exists(path):
+        yield path
+
+
+class Hasher:
+    """SHA-256 of file contents, memoized by (size, mtime) so unchanged multi-GB rasters are not re-read."""
+
+    def __init__(self, cache_path=HASH_CACHE_PATH):
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        self.cache = {}
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                self.cache = json.load(f)
+
+    def file(self, path):
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        with self.lock:
+            cached = self.cache.get(key)
+        if cached and cached["stamp"] == stamp:
+            return cached["sha256"]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        with self.lock:
+            self.cache[key] = {"stamp": stamp, "sha256": digest.hexdigest()}
+        return digest.hexdigest()
+
+    def paths(self, patterns):
+        digest = hashlib.sha256()
+        for pattern in patterns:
+            digest.update(pattern.encode())
+            for path in expand(pattern):
+                for file_path in _files_under(path):
+                    digest.update(file_path.encode())
+                    digest.update(self.file(file_path).encode())
+        return digest.hexdigest()
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(self.cache_path, "w") as f:
+                json.dump(self.cache, f)
+
+
+def code_files(script):
+    # The stage script plus every local module it imports, recursively
+    seen, pending = [], [script]
+    while pending:
+        name = pending.pop()
+        path = os.path.join(SCRIPTS_DIR, name)
+        if name in seen or not os.path.exists(path):
+            continue
+        seen.append(name)
+        with open(path) as f:
+            source = f.read()
+        for module in re.findall(r"^\s*(?:from|import)\s+([A-Za-z_]\w*)", source, flags=re.MULTILINE):
+            pending.append(f"{module}.py")
+    return sorted(seen)
+
+
+def fingerprint(stage, hasher):
+    digest = hashlib.sha256()
+    digest.update(json.dumps(stage.args).encode())
+    digest.update(hasher.paths([os.path.join(SCRIPTS_DIR, name) for name in code_files(stage.script)]).encode())
+    digest.update(hasher.paths(stage.inputs).encode())
+    return digest.hexdigest()
+
+
+def fingerprint_parts(stage, hasher):
+    # Separate hashes of the arguments, the code and each input; single files by content, as in the changes files
+    parts = {
+        "args": hashlib.sha256(json.dumps(stage.args).encode()).hexdigest(),
+        "code": hasher.paths([os.path.join(SCRIPTS_DIR, name) for name in code_files(stage.script)]),
+    }
+    for pattern in stage.inputs:
+        if glob.has_magic(pattern) or os.path.isdir(pattern):
+            parts[pattern] = hasher.paths([pattern])
+        else:
+            parts[pattern] = hasher.file(pattern) if os.path.exists(pattern) else None
+    return parts
+
+
+def recorded_fingerprint(recorded):
+    # State entries were plain fingerprints before the per-input hashes were recorded
+    return recorded if isinstance(recorded, str) or recorded is None else recorded["fingerprint"]
+
+
+def incremental_args(stage, recorded, parts):
+    """["--changes", path] when only an incremental input changed and its changes file covers that change."""
+    if not stage.incremental or not isinstance(recorded, dict) or not outputs_exist(stage):
+        return []
+    changed = [key for key in parts if recorded["parts"].get(key) != parts[key]]
+    if len(changed) != 1 or changed[0] not in stage.incremental:
+        return []
+    changes_path = stage.incremental[changed[0]]
+    if not os.path.exists(changes_path):
+        return []
+    with open(changes_path) as f:
+        changes = json.load(f)
+    if changes.get("base") != recorded["parts"][changed[0]] or changes.get("target") != parts[changed[0]]:
+        return []
+    return ["--changes", changes_path]
+
+
+def outputs_exist(stage):
+    return all(expand(pattern) and all(os.path.exists(path) for path in expand(pattern)) for pattern in stage.outputs)
+
+
+def run_stage(stage, args):
+    os.makedirs(LOG_DIR, exist_ok=True)
+    log_path = os.path.join(LOG_DIR, f"{stage.name}.log")
+    start = time.time()
+    with open(log_path, "w") as log:
+        result = subprocess.run(
+            [sys.executable, os.path.join(SCRIPTS_DIR, stage.script)] + args,
+            stdout=log, stderr=subprocess.STDOUT,
+        )
+    return result.returncode, time.time() - start, log_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pipeline stages whose inputs changed.")
+    parser.add_argument("--years", nargs="+", type=int, default=[2015], help="LandScan years for stage 03")
+    parser.add_argument("--population-method", choices=["zonal", "labels", "stream"], default="zonal",
+                        help="Extraction method of stage 03 ('labels' reads the label grid of stage 07)")
+    parser.add_argument("--only", nargs="+", help="Restrict the run to these stages (e.g. 03 04)")
+    parser.add_argument("--jobs", type=int, default=2, help="Maximum number of stages running at once")
+    parser.add_argument("--force", action="store_true", help="Re-run stages even if nothing changed")
+    parser.add_argument("--dry-run", action="store_true", help="Only report which stages would run")
+    options = parser.parse_args()
+
+    stages = build_stages(options.years, options.population_method)
+    if options.only:
+        stages = [stage for stage in stages if stage.name in options.only]
+    by_name = {stage.name: stage for stage in stages}
+    depends_on = dependencies(stages)
+
+    state = {}
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH) as f:
+            state = json.load(f)
+    hasher = Hasher()
+    state_lock = threading.Lock()
+
+    done, failed, running = set(), set(), {}
+    run_states, would_run = {}, set()
+    with ThreadPoolExecutor(max_workers=max(1, options.jobs)) as pool:
+        while len(done) + len(failed) < len(stages):
+            # Skip stages downstream of a failure
+            for name in by_name:
+                if name not in done | failed | set(running.values()) and depends_on[name] & failed:
+                    print(f"[{name}] skipped: upstream stage failed")
+                    failed.add(name)
+
+            # Fingerprint every stage whose upstream stages are finished, and start the stale ones
+            for name, stage in by_name.items():
+                if name in done | failed or name in running.values() or not depends_on[name] <= done:
+                    continue
+                stage_hash = fingerprint(stage, hasher)
+                upstream_changed = bool(depends_on[name] & would_run)
+                recorded = state.get(name)
+                if (not options.force and not upstream_changed and recorded_fingerprint(recorded) == stage_hash
+                        and outputs_exist(stage)):
+                    print(f"[{name}] up to date")
+                    done.add(name)
+                    continue
+                if options.dry_run:
+                    print(f"[{name}] would run: {stage.script} {' '.join(stage.args)}")
+                    would_run.add(name)
+                    done.add(name)
+                    continue
+                parts = fingerprint_parts(stage, hasher)
+                args = stage.args + ([] if options.force else incremental_args(stage, recorded, parts))
+                print(f"[{name}] running {stage.script} {' '.join(args)}")
+                running[pool.submit(run_stage, stage, args)] = name
+                run_states[name] = {"fingerprint": stage_hash, "parts": parts}
+
+            if not running:
+                continue
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                returncode, elapsed, log_path = future.result()
+                if returncode != 0:
+                    print(f"[{name}] failed after {elapsed:.1f}s (exit {returncode}), see {log_path}")
+                    failed.add(name)
+                    continue
+                print(f"[{name}] done in {elapsed:.1f}s")
+                done.add(name)
+                with state_lock:
+                    # Record the fingerprint of the inputs the stage actually ran on
+                    state[name] = run_states[name]
+                    os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+                    with open(STATE_PATH, "w") as f:
+                        json.dump(state, f, indent=2)
+                hasher.save()
+
+    hasher.save()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+# Local HTTP/JSON service for crosswalk lookups and population-weighted conversions
+#
+# impact_regions.nc is loaded once into hash indexes (IR, ADM2 and ADM1 keys -> positions) and sparse
+# arrays (IR→ADM2 links in both directions, ADM2→ADM1, population by year), so each lookup is a few
+# array slices instead of a CSV parse. Responses are kept in a bounded LRU cache, and /metrics
+# reports request latencies and the cache hit rate. Only the standard library and the pipeline's own
+# dependencies are used.
+#
+# Usage:
+#     python scripts/query_service.py --port 8765
+#
+#     GET  /ir_adm2?agglomid=12                       ADM2s linked to an IR
+#     GET  /adm2_irs?iso=USA&id_1=3&id_2=41           IRs linked to an ADM2
+#     GET  /adm1_irs?iso=USA&id_1=3                   IRs covering an ADM1
+#     GET  /adm1_adm2?iso=USA&id_1=3                  ADM2s of an ADM1
+#     GET  /population?level=adm2&iso=USA&id_1=3&id_2=41&year=2015   (level: ir, adm2 or adm1)
+#     POST /batch    {"queries": [{"type": "ir_adm2", "agglomid": 12}, ...]}
+#     POST /convert  {"source": "ir", "target": "adm1", "how": "mean", "year": 2015,
+#                     "values": [{"agglomid": 12, "value": 0.4}, ...]}
+#     GET  /metrics, GET /health
+
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+from netCDF4 import Dataset
+
+from aggregation import LEVELS, Aggregator
+from crosswalk import DEFAULT_NETCDF, read_ir_to_adm2, read_ir_to_adm2_population, year_index
+
+CACHE_SIZE = 4096  # Cached responses
+LATENCY_WINDOW = 2048  # Latencies kept per route for the percentiles
+
+
+class NotFound(ValueError):
+    """A key that is not in the crosswalk (HTTP 404)."""
+
+
+def _csr_groups(groups, n_groups):
+    # Members of each group as CSR arrays: members of g are order[indptr[g]:indptr[g + 1]]
+    order = np.argsort(groups, kind="stable")
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(groups, minlength=n_groups))])
+    return indptr, order
+
+
+class CrosswalkIndex:
+    """The content of impact_regions.nc as in-memory indexes, plus one Aggregator per year on demand."""
+
+    def __init__(self, path=DEFAULT_NETCDF):
+        with Dataset(path) as ncfile:
+            self.years = [int(year) for year in np.asarray(ncfile["year"][:])]
+            self.population = np.ma.filled(ncfile["population"][:, :].astype(np.float64), np.nan)
+            self.adm2_to_adm1 = np.asarray(ncfile["adm2_to_adm1"][:]).astype(np.int64)
+            self.n_adm1 = len(ncfile.dimensions["adm1"])
+            self.iso = [str(value) for value in ncfile["iso"][:]]
+            self.id_1 = np.asarray(ncfile["adm2_id1"][:]).astype(np.int64)
+            self.id_2 = np.asarray(ncfile["adm2_id2"][:]).astype(np.int64)
+            self.adm2_name = [str(value) for value in ncfile["adm2_name"][:]]
+            self.adm1_name = [str(value) for value in ncfile["adm1_name"][:]]
+            self.agglomid = np.asarray(ncfile["agglomid_id"][:]).astype(np.float64)
+            self.region_key = [str(value) for value in ncfile["region_key"][:]]
+        self.ir_to_adm2 = read_ir_to_adm2(path).tocsr()
+        self.path = path
+        self.adm2_to_ir = self.ir_to_adm2.T.tocsr()
+
+        # Hash indexes from keys to positions along each axis
+        self.ir_position = {float(agglomid): i for i, agglomid in enumerate(self.agglomid)}
+        self.adm2_position = {
+            (iso, int(id_1), int(id_2)): i for i, (iso, id_1, id_2) in enumerate(zip(self.iso, self.id_1, self.id_2))
+        }
+        self.adm1_indptr, self.adm1_members = _csr_groups(self.adm2_to_adm1, self.n_adm1)
+        first_adm2 = self.adm1_members[self.adm1_indptr[:-1]]
+        self.adm1_iso = [self.iso[i] for i in first_adm2]
+        self.adm1_id = self.id_1[first_adm2]
+        self.adm1_position = {(iso, int(id_1)): k for k, (iso, id_1) in enumerate(zip(self.adm1_iso, self.adm1_id))}
+
+        self._aggregators = {}
+        self._lock = threading.Lock()
+
+    # === Keys and records ===
+
+    def ir_index(self, agglomid):
+        try:
+            return self.ir_position[float(agglomid)]
+        except (KeyError, TypeError, ValueError):
+            raise NotFound(f"Unknown IR agglomid={agglomid}")
+
+    def adm2_index(self, iso, id_1, id_2):
+        try:
+            return self.adm2_position[(str(iso), int(id_1), int(id_2))]
+        except (KeyError, TypeError, ValueError):
+            raise NotFound(f"Unknown ADM2 iso={iso}, id_1={id_1}, id_2={id_2}")
+
+    def adm1_index(self, iso, id_1):
+        try:
+            return self.adm1_position[(str(iso), int(id_1))]
+        except (KeyError, TypeError, ValueError):
+            raise NotFound(f"Unknown ADM1 iso={iso}, id_1={id_1}")
+
+    def year_index(self, year=None):
+        try:
+            return year_index(self.years, year)
+        except ValueError as error:
+            raise NotFound(str(error))
+
+    def ir_record(self, i):
+        return {"agglomid": float(self.agglomid[i]), "region_key": self.region_key[i]}
+
+    def adm2_record(self, i):
+        return {"iso": self.iso[i], "id_1": int(self.id_1[i]), "id_2": int(self.id_2[i]),
+                "adm1_name": self.adm1_name[self.adm2_to_adm1[i]], "adm2_name": self.adm2_name[i]}
+
+    def adm1_record(self, k):
+        return {"iso": self.adm1_iso[k], "id_1": int(self.adm1_id[k]), "adm1_name": self.adm1_name[k]}
+
+    def index_of(self, level, query):
+        if level == "ir":
+            return self.ir_index(query.get("agglomid"))
+        if level == "adm2":
+            return self.adm2_index(query.get("iso"), query.get("id_1"), query.get("id_2"))
+        if level == "adm1":
+            return self.adm1_index(query.get("iso"), query.get("id_1"))
+        raise ValueError(f"Unknown level '{level}', expected one of {', '.join(LEVELS)}")
+
+    def record(self, level, position):
+        return {"ir": self.ir_record, "adm2": self.adm2_record, "adm1": self.adm1_record}[level](position)
+
+    # === Lookups ===
+
+    def adm1_adm2_indices(self, k):
+        return self.adm1_members[self.adm1_indptr[k]:self.adm1_indptr[k + 1]]
+
+    def ir_adm2(self, agglomid):
+        i = self.ir_index(agglomid)
+        return [self.adm2_record(j) for j in self.ir_to_adm2[i].indices]
+
+    def adm2_irs(self, iso, id_1, id_2):
+        j = self.adm2_index(iso, id_1, id_2)
+        return [self.ir_record(i) for i in self.adm2_to_ir[j].indices]
+
+    def adm1_adm2(self, iso, id_1):
+        return [self.adm2_record(j) for j in self.adm1_adm2_indices(self.adm1_index(iso, id_1))]
+
+    def adm1_irs(self, iso, id_1):
+        adm2 = self.adm1_adm2_indices(self.adm1_index(iso, id_1))
+        irs = np.unique(self.adm2_to_ir[adm2].indices)
+        return [self.ir_record(i) for i in irs]
+
+    def population_of(self, level, query, year=None):
+        j = self.year_index(year)
+        position = self.index_of(level, query)
+        if level == "adm2":
+            value = self.population[position, j]
+        elif level == "adm1":
+            values = self.population[self.adm1_adm2_indices(position), j]
+            # No data (rather than no population) when none of its ADM2s has a value
+            value = np.nansum(values) if np.isfinite(values).any() else np.nan
+        else:
+            value = self.aggregator(year).ir_population[position]
+        return {**self.record(level, position), "year": self.years[j],
+                "population": None if np.isnan(value) else float(value)}
+
+    # === Conversions ===
+
+    def aggregator(self, year=None):
+        j = self.year_index(year)
+        with self._lock:
+            if j not in self._aggregators:
+                link_weights = read_ir_to_adm2_population(self.path, self.years[j])
+                self._aggregators[j] = Aggregator(self.ir_to_adm2, self.population[:, j], self.adm2_to_adm1,
+                                                  n_adm1=self.n_adm1, agglomid=self.agglomid,
+                                                  link_weights=link_weights)
+            return self._aggregators[j]
+
+    def convert(self, source, target, values, how="mean", year=None):
+        """Convert keyed values ([{<key fields>, "value": x}, ...]) from `source` to `target` level.
+
+        Sources left out are unknown: with how="mean" a target touching one is left out, with how="sum"
+        they contribute nothing. Only targets reached by a given source are returned.
+        """
+        aggregator = self.aggregator(year)
+        dense = np.full(aggregator.sizes[source], np.nan if how == "mean" else 0.0)
+        given = np.zeros(aggregator.sizes[source], dtype=bool)
+        if not isinstance(values, list):
+            raise ValueError("'values' must be a list of objects")
+        for item in values:
+            if not isinstance(item, dict):
+                raise ValueError(f"Each value must be an object with key fields and 'value', got {item!r}")
+            position = self.index_of(source, item)
+            dense[position] = np.nan if item.get("value") is None else float(item["value"])
+            given[position] = True
+        operator, _ = aggregator.operator(source, target, how)
+        reached = np.flatnonzero(operator.T @ given.astype(np.float64) > 0)
+        result = aggregator.convert(dense, source, target, how=how)
+        return [
+            {**self.record(target, position), "value": float(result[position])}
+            for position in reached if np.isfinite(result[position])
+        ]
+
+
+class LRUCache:
+    """Thread-safe bounded mapping that evicts the least recently used entry, with hit/miss counts."""
+
+    def __init__(self, max_entries=CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "max_entries": self.max_entries, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": round(self.hits / lookups, 4) if lookups else None}
+
+
+class Metrics:
+    """Request counts, errors and recent latencies per route."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def record(self, route, seconds, status, cached):
+        with self.lock:
+            stats = self.routes.setdefault(route, {
+                "requests": 0, "errors": 0, "cached": 0, "total_s": 0.0, "latencies": deque(maxlen=LATENCY_WINDOW),
+            })
+            stats["requests"] += 1
+            stats["errors"] += status >= 400
+            stats["cached"] += cached
+            stats["total_s"] += seconds
+            stats["latencies"].append(seconds)
+
+    def report(self):
+        with self.lock:
+            routes = {}
+            for route, stats in self.routes.items():
+                latencies_us = np.asarray(stats["latencies"]) * 1e6
+                p50, p95, p99 = np.percentile(latencies_us, [50, 95, 99])
+                routes[route] = {
+                    "requests": stats["requests"], "errors": stats["errors"], "cached": stats["cached"],
+                    "mean_us": round(stats["total_s"] / stats["requests"] * 1e6, 1),
+                    "p50_us": round(p50, 1), "p95_us": round(p95, 1), "p99_us": round(p99, 1),
+                }
+            return {"uptime_s": round(time.time() - self.started, 1), "routes": routes}
+
+
+LOOKUPS = {
+    "ir_adm2": lambda index, q: index.ir_adm2(q.get("agglomid")),
+    "adm2_irs": lambda index, q: index.adm2_irs(q.get("iso"), q.get("id_1"), q.get("id_2")),
+    "adm1_irs": lambda index, q: index.adm1_irs(q.get("iso"), q.get("id_1")),
+    "adm1_adm2": lambda index, q: index.adm1_adm2(q.get("iso"), q.get("id_1")),
+    "population": lambda index, q: index.population_of(q.get("level", "adm2"), q, q.get("year")),
+}
+
+
+def lookup(index, query):
+    if not isinstance(query, dict):
+        raise ValueError(f"A query must be an object with a 'type' and key fields, got {query!r}")
+    if query.get("type") not in LOOKUPS:
+        raise ValueError(f"Unknown lookup type '{query.get('type')}', expected one of {', '.join(LOOKUPS)}")
+    return LOOKUPS[query["type"]](index, query)
+
+
+class QueryService:
+    """Answers requests from the index, through the response cache, and records metrics."""
+
+    def __init__(self, index, cache_size=CACHE_SIZE):
+        self.index = index
+        self.cache = LRUCache(cache_size)
+        self.metrics = Metrics()
+
+    def handle(self, method, path, body=b""):
+        """Returns (status, JSON bytes, cached) for one request."""
+        start = time.perf_counter()
+        url = urlsplit(path)
+        route = url.path.strip("/") or "health"
+        cacheable = route not in ("metrics", "health")
+        key = (method, path, body)
+        response = self.cache.get(key) if cacheable else None
+        cached = response is not None
+        if response is None:
+            status, payload = self._dispatch(method, route, url.query, body)
+            response = (status, json.dumps(payload).encode())
+            if cacheable and status == 200:
+                self.cache.put(key, response)
+        self.metrics.record(f"{method} /{route}", time.perf_counter() - start, response[0], cached)
+        return response[0], response[1], cached
+
+    def _dispatch(self, method, route, query_string, body):
+        try:
+            if method == "GET" and route == "health":
+                return 200, {"status": "ok", "irs": len(self.index.agglomid), "adm2": len(self.index.iso),
+                             "adm1": self.index.n_adm1, "years": self.index.years}
+            if method == "GET" and route == "metrics":
+                return 200, {**self.metrics.report(), "cache": self.cache.stats()}
+            if method == "GET" and route in LOOKUPS:
+                return 200, lookup(self.index, {"type": route, **dict(parse_qsl(query_string))})
+            if method == "POST" and route == "batch":
+                queries = _json_object(body).get("queries", [])
+                if not isinstance(queries, list):
+                    raise ValueError("'queries' must be a list")
+                results = []
+                for query in queries:
+                    try:
+                        results.append({"result": lookup(self.index, query)})
+                    except ValueError as error:  # One bad key does not fail the batch
+                        results.append({"error": str(error)})
+                return 200, {"results": results}
+            if method == "POST" and route == "convert":
+                request = _json_object(body)
+                return 200, {"values": self.index.convert(
+                    request.get("source"), request.get("target"), request.get("values", []),
+                    how=request.get("how", "mean"), year=request.get("year"),
+                )}
+            return 404, {"error": f"No route {method} /{route}"}
+        except NotFound as error:
+            return 404, {"error": str(error)}
+        except (ValueError, KeyError, TypeError) as error:
+            return 400, {"error": str(error)}
+
+
+def _json_object(body):
+    # Request bodies are JSON objects; anything else is a client error (400)
+    request = json.loads(body or b"{}")
+    if not isinstance(request, dict):
+        raise ValueError("The request body must be a JSON object")
+    return request
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, so clients reuse connections
+        disable_nagle_algorithm = True  # Headers and body are separate writes; don't wait for delayed ACKs
+
+        def _respond(self, method, body=b""):
+            status, payload, cached = service.handle(method, self.path, body)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.send_header("X-Cache", "hit" if cached else "miss")
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self._respond("GET")
+
+        def do_POST(self):
+            self._respond("POST", self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+        def log_message(self, format, *args):
+            pass  # Per-request logging would cost more than the lookups; see /metrics
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve crosswalk lookups and conversions over HTTP/JSON.")
+    parser.add_argument("--netcdf", default=DEFAULT_NETCDF, help="impact_regions.nc written by 04_create_netcdf.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE, help="Cached responses (0 disables the cache)")
+    options = parser.parse_args()
+
+    start = time.perf_counter()
+    index = CrosswalkIndex(options.netcdf)
+    print(f"Loaded {len(index.agglomid)} IRs, {len(index.iso)} ADM2s and {index.n_adm1} ADM1s "
+          f"in {time.perf_counter() - start:.2f}s")
+    server = ThreadingHTTPServer((options.host, options.port), make_handler(QueryService(index, options.cache_size)))
+    print(f"Serving on http://{options.host}:{options.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# IR ↔ ADM2 ↔ ADM1 relations as a bipartite graph, classified in one vectorized pass
+#
+# Every IR and ADM2 is integer coded, the links become a sparse IR × ADM2 adjacency matrix, and
+# each connected component of the graph is labelled with its case:
+#   1: one IR = one ADM2
+#   2: one IR covers several ADM2s
+#   3: one ADM2 is split into several IRs
+#   5: many-to-many, several IRs and several ADM2s linked together
+# (Case 4 is reserved for ADM2s with no IR at all, which have no links to classify.)
+# Links with a missing key (an IR without a GADM match) are not nodes of the graph: they get code -1,
+# no component and case 0, so they never join unrelated IRs together.
+#
+# Usage:
+#     from link_table import read_links
+#     from relations import classify_links
+#     links = classify_links(read_links(), adm2_columns=["adm2_code"], adm1_columns=["adm1_code"])
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from scipy.sparse.csgraph import connected_components
+
+ADM2_COLUMNS = ["ISO", "ID_1", "ID_2"]
+ADM1_COLUMNS = ["ISO", "ID_1"]
+
+CASE_ONE_TO_ONE = 1
+CASE_IR_MULTI_ADM2 = 2
+CASE_ADM2_MULTI_IR = 3
+CASE_NO_IR = 4
+CASE_MANY_TO_MANY = 5
+
+CASE_TYPES = {
+    CASE_ONE_TO_ONE: "Case 1: IR = ADM2",
+    CASE_IR_MULTI_ADM2: "Case 2: IR covers multiple ADM2s",
+    CASE_ADM2_MULTI_IR: "Case 3: ADM2 = multiple IRs",
+    CASE_NO_IR: "Case 4: ADM2 with no IR assigned",
+    CASE_MANY_TO_MANY: "Case 5: many-to-many IRs and ADM2s",
+}
+
+
+def _codes(links, columns):
+    # Dense 0-based codes of the distinct values of `columns`; -1 where any of them is missing
+    codes = links.groupby(columns, sort=True, dropna=True).ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    return codes, int(codes.max()) + 1 if len(codes) else 0
+
+
+def _take(values, codes, missing=0):
+    # values[codes], with `missing` where the code is -1
+    return np.where(codes >= 0, values[np.maximum(codes, 0)] if len(values) else missing, missing)
+
+
+def _adjacency(rows, cols, shape):
+    # Boolean sparse matrix with one entry per distinct (row, col) pair
+    matrix = scipy.sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=shape)
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix
+
+
+def classify_links(links, ir_column="agglomid", adm2_columns=ADM2_COLUMNS, adm1_columns=ADM1_COLUMNS,
+                   exclude_adm1_crossing=False):
+    """Return a copy of the IR-to-ADM2 link table with graph codes, degrees and cases.
+
+    Added columns:
+      ir_code, adm2_code, adm1_code  dense integer codes of the IR, ADM2 and ADM1 (-1 if a key is missing)
+      ir_n_adm2, adm2_n_irs          number of distinct ADM2s of the IR / IRs of the ADM2
+      ir_n_adm1, crosses_adm1        number of distinct ADM1s of the IR, and whether it is > 1
+      component                      connected component of the IR–ADM2 graph (-1 if excluded or unmatched)
+      case                           case of the component (see CASE_TYPES; 0 if excluded or unmatched)
+
+    With exclude_adm1_crossing=True, the links of IRs crossing ADM1 borders are left out
+    of the graph, so they do not merge the components of the ADM2s they touch.
+    """
+    links = links.copy()
+    ir, n_ir = _codes(links, [ir_column])
+    adm2, n_adm2 = _codes(links, list(adm2_columns))
+    adm1, n_adm1 = _codes(links, list(adm1_columns))
+
+    has_adm1 = (ir >= 0) & (adm1 >= 0)
+    ir_n_adm1 = np.diff(_adjacency(ir[has_adm1], adm1[has_adm1], (n_ir, n_adm1)).indptr)
+    crosses_adm1 = _take(ir_n_adm1, ir) > 1
+    active = (ir >= 0) & (adm2 >= 0)
+    if exclude_adm1_crossing:
+        active &= ~crosses_adm1
+
+    adjacency = _adjacency(ir[active], adm2[active], (n_ir, n_adm2))
+    ir_n_adm2 = np.diff(adjacency.indptr)
+    adm2_n_irs = np.diff(adjacency.tocsc().indptr)
+
+    # Components of the bipartite graph: nodes 0..n_ir-1 are IRs, the following ones ADM2s
+    graph = scipy.sparse.bmat([[None, adjacency], [adjacency.T, None]], format="csr")
+    n_components, labels = connected_components(graph, directed=False)
+    component_irs = np.bincount(labels[:n_ir], weights=ir_n_adm2 > 0, minlength=n_components)
+    component_adm2s = np.bincount(labels[n_ir:], weights=adm2_n_irs > 0, minlength=n_components)
+    component_case = np.select(
+        [component_irs == 0, (component_irs == 1) & (component_adm2s == 1), component_irs == 1, component_adm2s == 1],
+        [0, CASE_ONE_TO_ONE, CASE_IR_MULTI_ADM2, CASE_ADM2_MULTI_IR],
+        default=CASE_MANY_TO_MANY,
+    )
+
+    links["ir_code"] = ir
+    links["adm2_code"] = adm2
+    links["adm1_code"] = adm1
+    links["ir_n_adm2"] = _take(ir_n_adm2, ir)
+    links["adm2_n_irs"] = _take(adm2_n_irs, adm2)
+    links["ir_n_adm1"] = _take(ir_n_adm1, ir)
+    links["crosses_adm1"] = crosses_adm1
+    links["component"] = np.where(active, _take(labels, ir, -1), -1)
+    links["case"] = np.where(active, _take(component_case, _take(labels, ir, -1)), 0)
+    return links
+
+
+def component_table(classified):
+    """One row per component: its case, number of IRs, ADM2s and links, and countries."""
+    linked = classified[classified["component"] >= 0]
+    return (
+        linked.groupby("component")
+        .agg(
+            case=("case", "first"),
+            n_irs=("ir_code", "nunique"),
+            n_adm2s=("adm2_code", "nunique"),
+            n_links=("case", "size"),
+            countries=("ISO", lambda x: ",".join(sorted(x.dropna().astype(str).unique()))),
+        )
+        .reset_index()
+    )
@@ -0,0 +1,209 @@
+# Per-country sharding of the pipeline work
+#
+# Work is partitioned by ISO code. Shards are sized from the GeoParquet partitions of the geometry
+# cache and run largest-first in a process pool. Each shard gets a fresh worker process, so peak
+# memory is set by the largest country instead of the whole world. New shards only start while
+# the estimated memory of the running ones stays under a budget, and a failed country is retried
+# on its own.
+#
+# Scripts 03, 05 and 06 take the shared options added by add_arguments:
+#     python scripts/06_generate_adm2_geojson_by_country.py --countries IND MEX --workers 4
+#     python scripts/05_country_ir_geojson.py --test
+# and the shard plan of a layer can be listed with: python scripts/shards.py --layers gadm36 ir
+
+import argparse
+import os
+import resource
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from geocache import CACHE_DIR, MISSING_ISO, read_manifest
+
+TEST_COUNTRIES = ["USA", "IND", "MEX", "CHN", "COL"]
+
+# In-memory size of a country's geometries relative to its compressed GeoParquet partition
+MEMORY_FACTOR = 20
+MEMORY_FRACTION = 0.75  # Default budget, as a fraction of physical memory
+
+
+def shard_sizes(layers=("gadm36",)):
+    """Bytes of cached GeoParquet per ISO code, summed over `layers`."""
+    sizes = {}
+    for layer in layers:
+        for iso in read_manifest(layer)["countries"]:
+            if iso == MISSING_ISO:
+                continue
+            sizes[iso] = sizes.get(iso, 0) + os.path.getsize(os.path.join(CACHE_DIR, layer, f"{iso}.parquet"))
+    return sizes
+
+
+def physical_memory():
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def add_arguments(parser):
+    """Add the shared --countries/--test/--workers/--memory-limit/--retries options."""
+    parser.add_argument("--countries", nargs="+", help="ISO codes to process (default: all countries)")
+    parser.add_argument("--test", action="store_true", help=f"Process only {', '.join(TEST_COUNTRIES)}")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Countries processed at once (default: %(default)s)")
+    parser.add_argument("--memory-limit", type=float,
+                        help=f"Memory budget in GB (default: {MEMORY_FRACTION:.0%} of physical memory)")
+    parser.add_argument("--retries", type=int, default=1, help="Retries per failed country (default: %(default)s)")
+    return parser
+
+
+def select_countries(options, layers=("gadm36",)):
+    """Countries chosen by the shared options, largest first, and their shard sizes."""
+    sizes = shard_sizes(layers)
+    if options.countries:
+        countries = options.countries
+    elif options.test:
+        countries = TEST_COUNTRIES
+    else:
+        countries = list(sizes)
+    unknown = sorted(set(countries) - set(sizes))
+    if unknown:
+        print(f"Skipping countries not found in the geometry cache: {', '.join(unknown)}")
+    countries = [iso for iso in dict.fromkeys(countries) if iso in sizes]
+    return sorted(countries, key=lambda iso: -sizes[iso]), sizes
+
+
+def _run_one(func, iso, args):
+    # Runs in the worker: the result plus the wall time and peak memory of this shard's process
+    start = time.perf_counter()
+    result = func(iso, *args)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result, time.perf_counter() - start, peak_mb
+
+
+def run_shards(func, countries, sizes=None, workers=None, memory_limit=None, retries=1, args=()):
+    """Run func(iso, *args) for every country and return ({iso: result}, {iso: error}).
+
+    `func` must be importable by worker processes (a module-level function of a script
+    guarded by `if __name__ == "__main__"`). Countries are started largest first while
+    the estimated memory of the running shards (MEMORY_FACTOR × partition size) stays
+    under `memory_limit` bytes; a shard that does not fit waits for others to finish,
+    and always runs once nothing else is running. A failed country is retried up to
+    `retries` times, without rerunning the others. When a worker dies with several
+    countries in flight, the pool cannot tell which one it was: they are requeued
+    without using a retry and then run one at a time, so only the culprit is charged.
+    """
+    sizes = sizes or {}
+    workers = max(1, workers or os.cpu_count() or 1)
+    memory_limit = memory_limit or MEMORY_FRACTION * physical_memory()
+    queue = sorted(countries, key=lambda iso: -sizes.get(iso, 0))
+    attempts = {iso: 0 for iso in queue}
+    results, errors = {}, {}
+    suspects = set()  # In flight when a pool broke; run alone so a crash can be attributed
+
+    def estimate(iso):
+        return MEMORY_FACTOR * sizes.get(iso, 0)
+
+    def failed(iso, error):
+        attempts[iso] += 1
+        if attempts[iso] <= retries:
+            print(f"[{iso}] failed ({error}), retrying ({attempts[iso]}/{retries})")
+            queue.append(iso)
+            queue.sort(key=lambda other: -sizes.get(other, 0))
+        else:
+            print(f"[{iso}] failed ({error})")
+            errors[iso] = error
+
+    def finished(iso, seconds, peak_mb):
+        print(f"[{iso}] done in {seconds:.1f}s, peak memory {peak_mb:.0f} MB "
+              f"({len(results)}/{len(attempts)} countries)")
+
+    if workers == 1:
+        while queue:
+            iso = queue.pop(0)
+            try:
+                results[iso], seconds, peak_mb = _run_one(func, iso, args)
+            except Exception as error:
+                traceback.print_exc()
+                failed(iso, repr(error))
+                continue
+            finished(iso, seconds, peak_mb)
+        return results, errors
+
+    # One task per worker process, so each country's memory is returned to the system when it ends
+    pool = ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1)
+    running = {}
+    try:
+        while queue or running:
+            # Start the largest waiting shards that fit in the memory budget
+            used = sum(estimate(iso) for iso in running.values())
+            while queue and len(running) < workers and not suspects.intersection(running.values()):
+                candidates = [iso for iso in queue if iso not in suspects or not running]
+                iso = next((iso for iso in candidates if used + estimate(iso) <= memory_limit), None)
+                if iso is None:
+                    if running or not candidates:
+                        break
+                    iso = candidates[0]
+                queue.remove(iso)
+                running[pool.submit(_run_one, func, iso, args)] = iso
+                used += estimate(iso)
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            in_flight = list(running.values())
+            broken = []
+            for future in done:
+                iso = running.pop(future)
+                try:
+                    results[iso], seconds, peak_mb = future.result()
+                except BrokenProcessPool:
+                    # A worker died (e.g. killed when out of memory); the whole pool must be replaced
+                    broken.append(iso)
+                    continue
+                except Exception as error:
+                    failed(iso, repr(error))
+                    continue
+                suspects.discard(iso)
+                finished(iso, seconds, peak_mb)
+            if broken:
+                # Every future of a broken pool fails, so the dead worker is only known when it ran alone
+                stopped = [iso for iso in in_flight if iso in broken or iso in running.values()]
+                if len(stopped) == 1:
+                    suspects.discard(stopped[0])
+                    failed(stopped[0], "worker process terminated abruptly")
+                else:
+                    print(f"A worker process terminated abruptly with {len(stopped)} countries in flight; "
+                          f"requeuing {', '.join(stopped)} to run one at a time")
+                    suspects.update(stopped)
+                    queue.extend(stopped)
+                    queue.sort(key=lambda other: -sizes.get(other, 0))
+                running.clear()
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return results, errors
+
+
+def run_from_options(func, options, layers=("gadm36",), args=(), countries=None):
+    """Run `func` over the countries selected by the shared options (or over `countries`)."""
+    selected, sizes = select_countries(options, layers)
+    countries = selected if countries is None else countries
+    memory_limit = options.memory_limit * 1024 ** 3 if options.memory_limit else None
+    print(f"Processing {len(countries)} countries with {options.workers} workers, largest first")
+    return run_shards(func, countries, sizes=sizes, workers=options.workers, memory_limit=memory_limit,
+                      retries=options.retries, args=args)
+
+
+def report_failures(errors):
+    # Print how to re-run only the failed countries, and exit with an error
+    if errors:
+        print(f"{len(errors)} countries failed: {', '.join(sorted(errors))}")
+        print(f"Re-run them with: --countries {' '.join(sorted(errors))}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List the per-country shards, largest first.")
+    parser.add_argument("--layers", nargs="+", default=["gadm36"], help="Geometry cache layers to size shards by")
+    options = parser.parse_args()
+    sizes = shard_sizes(options.layers)
+    for iso in sorted(sizes, key=lambda iso: -sizes[iso]):
+        print(f"{iso}\t{sizes[iso] / 1024 ** 2:.1f} MB\t~{MEMORY_FACTOR * sizes[iso] / 1024 ** 2:.0f} MB in memory")
@@ -0,0 +1,135 @@
+# Zoom-pyramided Mapbox Vector Tiles written into a single PMTiles archive per layer
+
+import gzip
+
+import mapbox_vector_tile
+import numpy as np
+import pandas as pd
+import shapely
+from pmtiles.tile import Compression, TileType, zxy_to_tileid
+from pmtiles.writer import Writer
+
+WEB_MERCATOR_HALF = 20037508.342789244  # Half the width of the EPSG:3857 world square, in metres
+EXTENT = 4096  # Tile coordinate resolution
+MAX_LATITUDE = 85.05112878
+BUFFER = 64  # Tile buffer, in tile coordinates, so polygon edges do not show at tile seams
+
+
+def tile_bounds(z, x, y, buffer=0.0):
+    # EPSG:3857 bounds of tile (z, x, y), optionally grown by `buffer` tile units
+    size = 2 * WEB_MERCATOR_HALF / 2 ** z
+    pad = size * buffer / EXTENT
+    minx = -WEB_MERCATOR_HALF + x * size
+    maxy = WEB_MERCATOR_HALF - y * size
+    return minx - pad, maxy - size - pad, minx + size + pad, maxy + pad
+
+
+def _tile_ranges(bounds, z):
+    # Inclusive tile index ranges covered by each (minx, miny, maxx, maxy) row of `bounds`
+    n = 2 ** z
+    size = 2 * WEB_MERCATOR_HALF / n
+    x0 = np.clip(np.floor((bounds[:, 0] + WEB_MERCATOR_HALF) / size), 0, n - 1).astype(np.int64)
+    x1 = np.clip(np.floor((bounds[:, 2] + WEB_MERCATOR_HALF) / size), 0, n - 1).astype(np.int64)
+    y0 = np.clip(np.floor((WEB_MERCATOR_HALF - bounds[:, 3]) / size), 0, n - 1).astype(np.int64)
+    y1 = np.clip(np.floor((WEB_MERCATOR_HALF - bounds[:, 1]) / size), 0, n - 1).astype(np.int64)
+    return x0, x1, y0, y1
+
+
+def feature_tiles(geometry, z):
+    """One row (feature position, tile x, tile y) per tile at zoom `z` touched by each feature's bbox."""
+    valid = ~(shapely.is_missing(geometry) | shapely.is_empty(geometry))
+    positions = np.flatnonzero(valid)
+    x0, x1, y0, y1 = _tile_ranges(shapely.bounds(geometry[positions]), z)
+    features, tile_x, tile_y = [], [], []
+    for position, a, b, c, d in zip(positions, x0, x1, y0, y1):
+        xs, ys = np.meshgrid(np.arange(a, b + 1), np.arange(c, d + 1))
+        features.append(np.full(xs.size, position))
+        tile_x.append(xs.ravel())
+        tile_y.append(ys.ravel())
+    if not features:
+        return pd.DataFrame({"feature": [], "x": [], "y": []}, dtype=np.int64)
+    return pd.DataFrame({
+        "feature": np.concatenate(features),
+        "x": np.concatenate(tile_x),
+        "y": np.concatenate(tile_y),
+    })
+
+
+def encode_tile(layer_name, geometry, properties, z, x, y):
+    # Clip to the buffered tile, drop what vanished, and encode as gzipped MVT
+    clipped = shapely.clip_by_rect(geometry, *tile_bounds(z, x, y, buffer=BUFFER))
+    keep = ~shapely.is_empty(clipped)
+    if not keep.any():
+        return None
+    features = [
+        {"geometry": geom, "properties": props}
+        for geom, props, kept in zip(clipped, properties, keep) if kept
+    ]
+    data = mapbox_vector_tile.encode(
+        [{"name": layer_name, "features": features}],
+        default_options={"quantize_bounds": tile_bounds(z, x, y), "extents": EXTENT},
+    )
+    return gzip.compress(data)
+
+
+def write_pmtiles(gdf, output_path, layer_name, properties, min_zoom=0, max_zoom=8):
+    """Write `gdf` as a PMTiles archive of MVT tiles for zooms min_zoom..max_zoom.
+
+    Geometries are simplified per zoom to one tile pixel (topology preserving), below
+    the tile's coordinate resolution, so low zooms stay small; only the `properties`
+    columns are kept.
+    """
+    if gdf.empty:
+        raise ValueError(f"No features to write for layer '{layer_name}'.")
+    # Web Mercator is undefined at the poles: clip to its latitude range before projecting
+    gdf = gdf.to_crs(4326)
+    gdf = gdf.set_geometry(gdf.geometry.clip_by_rect(-180, -MAX_LATITUDE, 180, MAX_LATITUDE)).to_crs(3857)
+    geometry = gdf.geometry.to_numpy()
+    records = gdf[properties].astype(object).where(gdf[properties].notna(), None)
+    records = [{key: value for key, value in row.items() if value is not None} for row in records.to_dict("records")]
+
+    tile_count = 0
+    with open(output_path, "wb") as f:
+        writer = Writer(f)
+        for z in range(min_zoom, max_zoom + 1):
+            pixel = 2 * WEB_MERCATOR_HALF / 2 ** z / EXTENT
+            simplified = shapely.simplify(geometry, tolerance=pixel, preserve_topology=True)
+            pairs = feature_tiles(simplified, z)
+            pairs["tile_id"] = [zxy_to_tileid(z, x, y) for x, y in zip(pairs["x"], pairs["y"])]
+
+            # PMTiles directories are most compact when tiles are written in tile id order
+            for tile_id, group in pairs.sort_values("tile_id").groupby("tile_id", sort=False):
+                positions = group["feature"].to_numpy()
+                data = encode_tile(
+                    layer_name, simplified[positions], [records[i] for i in positions],
+                    z, int(group["x"].iloc[0]), int(group["y"].iloc[0]),
+                )
+                if data is not None:
+                    writer.write_tile(tile_id, data)
+                    tile_count += 1
+            print(f"  zoom {z}: {pairs['tile_id'].nunique()} tiles")
+
+        min_lon, min_lat, max_lon, max_lat = gdf.to_crs(4326).total_bounds
+        header = {
+            "tile_type": TileType.MVT,
+            "tile_compression": Compression.GZIP,
+            "min_lon_e7": int(min_lon * 1e7),
+            "min_lat_e7": int(min_lat * 1e7),
+            "max_lon_e7": int(max_lon * 1e7),
+            "max_lat_e7": int(max_lat * 1e7),
+            "center_zoom": min_zoom,
+            "center_lon_e7": int((min_lon + max_lon) / 2 * 1e7),
+            "center_lat_e7": int((min_lat + max_lat) / 2 * 1e7),
+        }
+        metadata = {
+            "name": layer_name,
+            "format": "pbf",
+            "vector_layers": [{
+                "id": layer_name,
+                "fields": {key: "String" for key in properties},
+                "minzoom": min_zoom,
+                "maxzoom": max_zoom,
+            }],
+        }
+        writer.finalize(header, metadata)
+    return tile_count
@@ -0,0 +1,83 @@
+import os
+import subprocess
+import sys
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import rasterio
+import shapely
+from rasterio.transform import from_origin
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import fixtures  # noqa: E402
+
+# Synthetic grid for the zonal tests: 60 × 80 pixels of 0.1°, in 16 × 16 blocks, some of them nodata
+GRID_SHAPE = (60, 80)
+GRID_TRANSFORM = from_origin(0.0, 6.0, 0.1, 0.1)
+NODATA = -1
+
+
+def _write_raster(path, values, nodata):
+    profile = dict(driver="GTiff", height=values.shape[0], width=values.shape[1], count=1, dtype=values.dtype,
+                   crs="EPSG:4326", transform=GRID_TRANSFORM, nodata=nodata, tiled=True, blockxsize=16,
+                   blockysize=16)
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(values, 1)
+    return str(path)
+
+
+def _layer(polygons):
+    # Edges never fall on pixel centers, so the center-point rule assigns every pixel to one polygon
+    return gpd.GeoDataFrame({"GID_0": "AAA", "ID_2": np.arange(1, len(polygons) + 1)}, geometry=polygons,
+                            crs="EPSG:4326")
+
+
+@pytest.fixture(scope="session")
+def grid(tmp_path_factory):
+    """Int and float (NaN nodata) rasters of the same values, and two layers of polygons tiling the grid."""
+    folder = tmp_path_factory.mktemp("grid")
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 100, size=GRID_SHAPE, dtype=np.int32)
+    missing = rng.random(GRID_SHAPE) < 0.05
+    values[missing] = NODATA
+    floats = np.where(missing, np.nan, values).astype(np.float32)
+
+    # Layer a: 4 × 2 boxes; layer b: 2 × 3 boxes, the lower left one split along its diagonal
+    a = [shapely.box(x0, y0, x1, y1) for x0, x1 in zip([0, 2.03, 4.07, 6.01], [2.03, 4.07, 6.01, 8])
+         for y0, y1 in [(0, 2.98), (2.98, 6)]]
+    b = [shapely.box(x0, y0, x1, y1) for x0, x1 in [(0, 3.02), (3.02, 8)]
+         for y0, y1 in [(0, 1.49), (1.49, 4.51), (4.51, 6)]]
+    b[:1] = [shapely.Polygon([(0, 0), (3.02, 0), (3.02, 1.49)]), shapely.Polygon([(0, 0), (3.02, 1.49), (0, 1.49)])]
+    return {
+        "int": _write_raster(folder / "int.tif", values, NODATA),
+        "float": _write_raster(folder / "float.tif", floats, np.nan),
+        "values": np.where(missing, 0, values),
+        "a": _layer(a),
+        "b": _layer(b),
+        "folder": folder,
+    }
+
+
+@pytest.fixture(scope="session")
+def pipeline_root(tmp_path_factory):
+    """A small synthetic tree (benchmarks/fixtures.py) run through the stages up to the crosswalk exports."""
+    root = tmp_path_factory.mktemp("pipeline")
+    fixtures.generate(str(root), countries=1, adm1=3, adm2=4, cell=0.5, resolution=1 / 40, vertices=8,
+                      years=[2015, 2016])
+    stages = [
+        ["geocache.py"],
+        ["01_link_ir_to_adm.py"],
+        ["03_extract_population.py", "--years", "2015", "2016"],
+        ["07_rasterize_adm2_labels.py"],
+        ["10_ir_adm2_population.py", "--years", "2015", "2016"],
+        ["04_create_netcdf.py"],
+        ["09_export_binary_crosswalk.py"],
+    ]
+    for script, *args in stages:
+        subprocess.run([sys.executable, os.path.join(ROOT, "scripts", script), *args], cwd=root, check=True,
+                       capture_output=True)
+    return root
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+import scipy.sparse
+
+from aggregation import Aggregator
+
+# IR 0 = ADM2 0; IR 1 covers ADM2s 1 and 2; ADM2 3 is split into IRs 2 and 3. ADM1 0 = ADM2s 0-1, ADM1 1 = ADM2s 2-3
+IR_TO_ADM2 = np.array([
+    [1, 0, 0, 0],
+    [0, 1, 1, 0],
+    [0, 0, 0, 1],
+    [0, 0, 0, 1],
+])
+POPULATION = np.array([10.0, 20.0, 30.0, 40.0])
+ADM2_TO_ADM1 = np.array([0, 0, 1, 1])
+LEVELS = ["ir", "adm2", "adm1"]
+
+
+@pytest.fixture
+def aggregator():
+    return Aggregator(IR_TO_ADM2, POPULATION, ADM2_TO_ADM1)
+
+
+def test_population_is_split_equally_without_link_weights(aggregator):
+    assert aggregator.sizes == {"ir": 4, "adm2": 4, "adm1": 2}
+    assert np.array_equal(aggregator.ir_population, [10, 50, 20, 20])
+    assert aggregator.link_population.sum() == POPULATION.sum()
+
+
+def test_link_weights_split_the_population(aggregator):
+    weights = scipy.sparse.csr_matrix(IR_TO_ADM2 * np.array([[1.0], [1.0], [3.0], [1.0]]))
+    weighted = Aggregator(IR_TO_ADM2, POPULATION, ADM2_TO_ADM1, link_weights=weights)
+    assert np.array_equal(weighted.ir_population, [10, 50, 30, 10])
+
+
+def test_adm2s_without_link_weights_fall_back_to_the_mapping(aggregator):
+    # ADM2 3 has only zero weights, ADM2s 1 and 2 none: they keep the shares of the binary mapping
+    weights = scipy.sparse.csr_matrix(([5.0, 0.0, 0.0], ([0, 2, 3], [0, 3, 3])), shape=(4, 4))
+    weighted = Aggregator(IR_TO_ADM2, POPULATION, ADM2_TO_ADM1, link_weights=weights)
+    assert np.array_equal(weighted.ir_population, aggregator.ir_population)
+    assert np.array_equal(weighted.link_population.toarray(), aggregator.link_population.toarray())
+
+
+@pytest.mark.parametrize("source", LEVELS)
+@pytest.mark.parametrize("target", LEVELS)
+def test_mean_keeps_constants(aggregator, source, target):
+    if source == target:
+        return
+    values = np.full((3, aggregator.sizes[source]), 2.5)
+    assert np.allclose(aggregator.convert(values, source, target), 2.5)
+
+
+@pytest.mark.parametrize("source", LEVELS)
+@pytest.mark.parametrize("target", LEVELS)
+def test_sum_conserves_totals(aggregator, source, target):
+    if source == target:
+        return
+    values = np.random.default_rng(0).random((2, 3, aggregator.sizes[source]))
+    converted = aggregator.convert(values, source, target, how="sum", chunk_rows=4)
+    assert converted.shape == (2, 3, aggregator.sizes[target])
+    assert np.allclose(converted.sum(axis=-1), values.sum(axis=-1))
+
+
+def test_mean_and_sum_round_trips(aggregator):
+    # Down then up restores the ADM2 means of IRs within one ADM2 and the ADM1 totals; up then down
+    # restores the IRs that are whole ADM2 unions
+    adm2 = np.array([1.0, 2.0, 3.0, 4.0])
+    assert np.allclose(aggregator.convert(aggregator.convert(adm2, "adm2", "ir"), "ir", "adm2")[[0, 3]], adm2[[0, 3]])
+    adm1 = np.array([7.0, 11.0])
+    adm2 = aggregator.convert(adm1, "adm1", "adm2", how="sum")
+    assert np.allclose(adm2, [7 / 3, 14 / 3, 11 * 3 / 7, 11 * 4 / 7])
+    assert np.allclose(aggregator.convert(adm2, "adm2", "adm1", how="sum"), adm1)
+    ir = np.array([1.0, 2.0, 3.0, 4.0])
+    assert np.allclose(aggregator.convert(aggregator.convert(ir, "ir", "adm2"), "adm2", "ir")[:2], ir[:2])
+    assert np.allclose(aggregator.convert(ir, "ir", "adm1"), [(10 * 1 + 20 * 2) / 30, (30 * 2 + 20 * 3 + 20 * 4) / 70])
+
+
+def test_targets_without_population_are_nan_for_means():
+    aggregator = Aggregator(IR_TO_ADM2, [10.0, np.nan, 0.0, 40.0], ADM2_TO_ADM1)
+    means = aggregator.convert(np.ones(4), "ir", "adm2")
+    assert np.isnan(means[[1, 2]]).all() and np.allclose(means[[0, 3]], 1)
+    # IR 1 carries no population: its total has nowhere to go
+    assert np.allclose(aggregator.convert(np.ones(4), "ir", "adm2", how="sum"), [1, 0, 0, 2])
+
+
+def test_convert_writes_into_out(aggregator):
+    values = np.ones((5, 4))
+    out = np.zeros((5, 2))
+    assert aggregator.convert(values, "adm2", "adm1", how="sum", chunk_rows=2, out=out) is out
+    assert np.allclose(out, 2)
+
+
+def test_convert_rejects_bad_arguments(aggregator):
+    with pytest.raises(ValueError, match="last axis"):
+        aggregator.convert(np.ones(3), "ir", "adm2")
+    with pytest.raises(ValueError, match="shape"):
+        aggregator.convert(np.ones((2, 4)), "ir", "adm2", out=np.zeros((4, 2)))
+    with pytest.raises(ValueError, match="C-contiguous"):
+        aggregator.convert(np.ones((2, 4)), "ir", "adm2", out=np.zeros((4, 2)).T)
+    with pytest.raises(ValueError, match="Cannot convert"):
+        aggregator.convert(np.ones(4), "ir", "ir")
+    with pytest.raises(ValueError, match="Unknown conversion"):
+        aggregator.convert(np.ones(4), "ir", "adm2", how="median")
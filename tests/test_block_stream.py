@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+
+import block_stream
+from block_stream import chunk_windows, stream_sums
+from zonal import zonal_sums
+
+# Bytes per pixel of the two test rasters (int32 + float32) plus the per-pixel working memory
+PIXEL_BYTES = 8 + block_stream.WORK_BYTES_PER_PIXEL
+
+
+def test_chunk_windows_cover_the_raster_once():
+    for budget in [1, 300, 16 * 80, 5000, 10 ** 6]:
+        covered = np.zeros((60, 80), dtype=int)
+        for window in chunk_windows(80, 60, (16, 16), budget):
+            covered[window.row_off:window.row_off + window.height, window.col_off:window.col_off + window.width] += 1
+            assert window.width * window.height <= max(budget, 16 * 16)
+        assert (covered == 1).all()
+
+
+@pytest.mark.parametrize("coverage", ["center", "exact"])
+@pytest.mark.parametrize("memory_limit", [1, 300 * PIXEL_BYTES, 3000 * PIXEL_BYTES, 1 << 30])
+def test_stream_sums_do_not_depend_on_chunking(grid, coverage, memory_limit):
+    rasters = [grid["int"], grid["float"]]
+    expected = zonal_sums(grid["a"], rasters, n_workers=1, coverage=coverage)
+    sums = stream_sums(grid["a"], rasters, memory_limit, coverage=coverage)
+    if coverage == "center":
+        assert np.array_equal(sums, expected)
+    else:
+        assert np.allclose(sums[0], expected[0]) and np.array_equal(sums[1], expected[1])
+
+
+def test_stream_sums_resume_after_an_interruption(grid, tmp_path, monkeypatch):
+    rasters = [grid["int"], grid["float"]]
+    checkpoint = str(tmp_path / "sums.npz")
+    expected = stream_sums(grid["b"], rasters, 1)
+
+    accumulate, calls = block_stream._accumulate, []
+
+    def interrupted(*args):
+        calls.append(1)
+        if len(calls) > 20:
+            raise KeyboardInterrupt
+        accumulate(*args)
+
+    monkeypatch.setattr(block_stream, "_accumulate", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        stream_sums(grid["b"], rasters, 1, checkpoint_path=checkpoint, checkpoint_seconds=0)
+    assert os.path.exists(checkpoint)
+
+    monkeypatch.setattr(block_stream, "_accumulate", accumulate)
+    assert np.array_equal(stream_sums(grid["b"], rasters, 1, checkpoint_path=checkpoint, resume=True), expected)
+    assert not os.path.exists(checkpoint)
+
+
+def test_stream_sums_ignore_a_checkpoint_of_other_inputs(grid, tmp_path):
+    rasters = [grid["int"]]
+    checkpoint = str(tmp_path / "sums.npz")
+    block_stream._save_checkpoint(checkpoint, "other", 3, np.ones((len(grid["a"]), 1, 1)),
+                                  np.ones((len(grid["a"]), 1, 1), dtype=bool))
+    sums = stream_sums(grid["a"], rasters, 1, checkpoint_path=checkpoint, resume=True)
+    assert np.array_equal(sums, zonal_sums(grid["a"], rasters, n_workers=1))
@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+
+from aggregation import Aggregator
+from crosswalk import BinaryCrosswalk, read_ir_to_adm2, year_index
+
+LEVELS = ["ir", "adm2", "adm1"]
+
+
+@pytest.fixture(scope="module")
+def paths(pipeline_root):
+    return os.path.join(pipeline_root, "outputs/impact_regions.nc"), os.path.join(pipeline_root, "outputs/crosswalk_bin")
+
+
+def test_year_index():
+    years = np.array([2015, 2016, 2020])
+    assert year_index(years) == 2
+    assert year_index(years, 2016) == 1
+    assert year_index(years, "2015") == 0
+    for year in [2017, "abc", 2016.5]:
+        with pytest.raises(ValueError, match="No population for year"):
+            year_index(years, year)
+
+
+def test_binary_crosswalk_matches_the_netcdf(paths):
+    netcdf_path, binary_path = paths
+    crosswalk = BinaryCrosswalk(binary_path)
+    with Dataset(netcdf_path) as ncfile:
+        population = np.ma.filled(ncfile["population"][:].astype(np.float64), np.nan)
+        assert np.array_equal(crosswalk["agglomid"], ncfile["agglomid_id"][:])
+        assert np.array_equal(crosswalk["adm2_to_adm1"], ncfile["adm2_to_adm1"][:])
+        assert np.array_equal(crosswalk.years, ncfile["year"][:])
+    assert np.array_equal(crosswalk.ir_to_adm2().toarray(), read_ir_to_adm2(netcdf_path).toarray())
+    for j, year in enumerate(crosswalk.years):
+        assert np.array_equal(crosswalk.population(year), population[:, j], equal_nan=True)
+    assert np.array_equal(crosswalk.ir_index(crosswalk["agglomid"]), np.arange(crosswalk.sizes["ir"]))
+    assert (crosswalk.ir_index([-5]) == -1).all()
+
+
+@pytest.mark.parametrize("year", [2015, 2016, None])
+def test_binary_aggregator_equals_the_netcdf_one(paths, year):
+    netcdf_path, binary_path = paths
+    from_netcdf = Aggregator.from_netcdf(netcdf_path, year)
+    from_binary = Aggregator.from_binary(binary_path, year)
+    assert from_binary.sizes == from_netcdf.sizes
+    assert np.allclose(from_binary.ir_population, from_netcdf.ir_population)
+    values = np.random.default_rng(0).random((3, from_netcdf.sizes["ir"]))
+    for source in LEVELS:
+        for target in LEVELS:
+            if source == target:
+                continue
+            for how in ["mean", "sum"]:
+                netcdf_op, netcdf_covered = from_netcdf.operator(source, target, how)
+                binary_op, binary_covered = from_binary.operator(source, target, how)
+                assert np.allclose(binary_op.toarray(), netcdf_op.toarray())
+                assert np.array_equal(binary_covered, netcdf_covered)
+    assert np.allclose(from_binary.convert(values, "ir", "adm1"), from_netcdf.convert(values, "ir", "adm1"),
+                       equal_nan=True)
+
+
+def test_the_fixture_population_is_conserved(paths):
+    netcdf_path, _ = paths
+    aggregator = Aggregator.from_netcdf(netcdf_path, 2016)
+    assert aggregator.ir_population.sum() == pytest.approx(np.nansum(aggregator.adm2_population))
+    adm1 = aggregator.convert(aggregator.adm2_population, "adm2", "adm1", how="sum")
+    assert adm1.sum() == pytest.approx(aggregator.adm2_population.sum())
+
+
+def test_missing_years_are_rejected(paths):
+    netcdf_path, binary_path = paths
+    with pytest.raises(ValueError, match="No population for year 1990"):
+        Aggregator.from_netcdf(netcdf_path, 1990)
+    with pytest.raises(ValueError, match="No population for year 1990"):
+        Aggregator.from_binary(binary_path, 1990)
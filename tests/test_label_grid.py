@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import rasterio
+
+from label_grid import adm2_label_table, label_sums, pair_sums, rasterize_labels
+from zonal import zonal_sums
+
+KEYS = ["GID_0", "ID_2"]
+
+
+def _label_grid(grid, layer):
+    table, row_labels = adm2_label_table(grid[layer], keys=KEYS)
+    path = str(grid["folder"] / f"labels_{layer}.tif")
+    rasterize_labels(grid[layer], row_labels, grid["int"], path, block_rows=7)
+    return table, row_labels, path
+
+
+def test_label_table_numbers_adm2s_in_key_order(grid):
+    gdf = grid["a"].assign(ID_2=[5, 3, 3, 1, 2, 8, 7, 6])
+    table, row_labels = adm2_label_table(gdf, keys=KEYS)
+    assert table["ID_2"].tolist() == [1, 2, 3, 5, 6, 7, 8]
+    assert table["label"].tolist() == list(range(1, 8))
+    assert row_labels.tolist() == [4, 3, 3, 1, 2, 7, 6, 5]
+
+
+@pytest.mark.parametrize("block_rows", [5, 1024])
+def test_label_sums_match_zonal_sums(grid, block_rows):
+    table, row_labels, path = _label_grid(grid, "a")
+    rasters = [grid["int"], grid["float"]]
+    sums = label_sums(path, rasters, len(table), block_rows=block_rows)
+    assert sums.shape == (len(table) + 1, 2)
+    assert np.array_equal(sums[0], [0, 0])
+    assert np.array_equal(sums[row_labels], zonal_sums(grid["a"], rasters, n_workers=1))
+
+
+@pytest.mark.parametrize("block_rows, reduce_rows", [(5, 1), (1024, 1 << 22)])
+def test_pair_sums_match_the_joint_histogram(grid, block_rows, reduce_rows):
+    _, _, path_a = _label_grid(grid, "a")
+    _, _, path_b = _label_grid(grid, "b")
+    labels_a, labels_b, sums = pair_sums(path_a, path_b, [grid["int"], grid["float"]], block_rows=block_rows,
+                                         reduce_rows=reduce_rows)
+    with rasterio.open(path_a) as src_a, rasterio.open(path_b) as src_b:
+        grid_a, grid_b = src_a.read(1), src_b.read(1)
+
+    pairs = sorted({(int(a), int(b)) for a, b in zip(grid_a.ravel(), grid_b.ravel())})
+    assert list(zip(labels_a.tolist(), labels_b.tolist())) == pairs
+    for (a, b), row in zip(pairs, sums):
+        expected = grid["values"][(grid_a == a) & (grid_b == b)].sum()
+        assert np.array_equal(row, [expected, expected])
+
+
+def test_pair_sums_add_up_to_label_sums(grid):
+    table, row_labels, path_a = _label_grid(grid, "a")
+    _, _, path_b = _label_grid(grid, "b")
+    labels_a, _, sums = pair_sums(path_a, path_b, [grid["float"]], block_rows=9)
+    per_a = np.bincount(labels_a, weights=sums[:, 0], minlength=len(table) + 1)
+    assert np.array_equal(per_a, label_sums(path_a, [grid["float"]], len(table))[:, 0])
+
+
+def test_label_sums_reject_a_misaligned_raster(grid, tmp_path):
+    table, _, path = _label_grid(grid, "a")
+    with rasterio.open(grid["int"]) as src:
+        profile = dict(src.profile, transform=src.transform * src.transform.translation(1, 0))
+        values = src.read(1)
+    shifted = str(tmp_path / "shifted.tif")
+    with rasterio.open(shifted, "w", **profile) as dst:
+        dst.write(values, 1)
+    with pytest.raises(ValueError, match="not aligned"):
+        label_sums(path, [shifted], len(table))
@@ -0,0 +1,75 @@
+import pandas as pd
+import pytest
+
+from link_diff import describe_changes, diff_links, read_changes, read_text_table, write_changes
+from link_table import add_codes, write_links
+
+
+def _links(rows):
+    return pd.DataFrame(rows, columns=["agglomid", "region-key", "OBJECTID", "ISO", "ID_1", "NAME_1", "ID_2",
+                                       "NAME_2"])
+
+
+LINKS = _links([
+    (2, "USA.2", 20, "USA", 1, "a", 1, "x"),
+    (10, "USA.10", 100, "USA", 1, "a", 2, "y"),
+    (11, "USA.11", 110, "USA", 1, "a", 2, "y"),
+    (12, "MEX.12", 120, "MEX", 3, "b", 4, "z"),
+])
+
+
+def _write(path, links):
+    write_links(add_codes(links.astype({"ID_1": "Int32", "ID_2": "Int32"})), str(path))
+    return str(path)
+
+
+def test_diff_links_counts_duplicated_rows():
+    old = pd.DataFrame({"a": ["1", "1", "2"], "b": ["x", "x", "y"]})
+    new = pd.DataFrame({"a": ["1", "2", "2", "3"], "b": ["x", "y", "y", "z"]})
+    removed, added = diff_links(old, new)
+    assert removed.values.tolist() == [["1", "x"]]
+    assert sorted(added.values.tolist()) == [["2", "y"], ["3", "z"]]
+    assert [len(part) for part in diff_links(new, new)] == [0, 0]
+
+
+def test_text_tables_keep_cells_as_written(tmp_path):
+    path = _write(tmp_path / "links.parquet", pd.concat([LINKS, _links([(13, "XXX.13", 130, None, None, "", None, "")])]))
+    table = read_text_table(path)
+    assert table.iloc[0].tolist() == ["2", "USA.2", "20", "USA", "1", "a", "1", "x"]
+    assert table.iloc[-1].tolist() == ["13", "XXX.13", "130", "", "", "", "", ""]
+
+
+def test_describe_changes(tmp_path):
+    old = _write(tmp_path / "old.parquet", LINKS)
+    # IR 10 moves to ADM2 USA 1 1; a Mexican IR is added
+    new_links = pd.concat([LINKS, _links([(3, "MEX.3", 30, "MEX", 3, "b", 4, "z")])], ignore_index=True)
+    new_links.loc[1, ["ID_2", "NAME_2"]] = [1, "x"]
+    new = _write(tmp_path / "new.parquet", new_links)
+
+    changes = describe_changes(old, new)
+    assert not changes["full"]
+    assert (changes["rows_removed"], changes["rows_added"]) == (1, 2)
+    assert changes["agglomid"] == ["3", "10"]
+    assert changes["objectid"] == ["30", "100"]
+    assert changes["adm2"] == [["MEX", "3", "4"], ["USA", "1", "1"], ["USA", "1", "2"]]
+    assert changes["countries"] == ["MEX", "USA"]
+    assert changes["geojson"] == ["adm2-geojson-dataset/MEX_adm2.geojson", "adm2-geojson-dataset/USA_adm2.geojson"]
+
+    unchanged = describe_changes(new, new)
+    assert unchanged["agglomid"] == [] and unchanged["countries"] == []
+
+
+def test_describe_changes_without_a_previous_table(tmp_path):
+    new = _write(tmp_path / "new.parquet", LINKS)
+    changes = describe_changes(str(tmp_path / "missing.parquet"), new)
+    assert changes["full"] and changes["base"] is None
+
+
+def test_read_changes_checks_the_target(tmp_path):
+    old = _write(tmp_path / "old.parquet", LINKS)
+    new = _write(tmp_path / "new.parquet", LINKS.iloc[1:])
+    path = str(tmp_path / "changes.json")
+    write_changes(describe_changes(old, new), path)
+    assert read_changes(path, new)["rows_removed"] == 1
+    with pytest.raises(ValueError, match="does not describe"):
+        read_changes(path, old)
@@ -0,0 +1,111 @@
+import json
+import os
+
+import pytest
+
+from query_service import CrosswalkIndex, QueryService
+
+
+@pytest.fixture(scope="module")
+def index(pipeline_root):
+    return CrosswalkIndex(os.path.join(pipeline_root, "outputs/impact_regions.nc"))
+
+
+@pytest.fixture
+def service(index):
+    return QueryService(index)
+
+
+def _get(service, path):
+    status, body, cached = service.handle("GET", path)
+    return status, json.loads(body), cached
+
+
+def _post(service, path, body):
+    status, body, _ = service.handle("POST", path, body if isinstance(body, bytes) else json.dumps(body).encode())
+    return status, json.loads(body)
+
+
+def _adm2(index, j=0):
+    return {"iso": index.iso[j], "id_1": int(index.id_1[j]), "id_2": int(index.id_2[j])}
+
+
+def test_lookups_and_cache(service, index):
+    agglomid = float(index.agglomid[0])
+    status, result, cached = _get(service, f"/ir_adm2?agglomid={agglomid}")
+    assert status == 200 and not cached and len(result) >= 1
+    assert _get(service, f"/ir_adm2?agglomid={agglomid}") == (200, result, True)
+
+    # The reverse lookup finds the IR again
+    adm2 = result[0]
+    status, result, _ = _get(service, "/adm2_irs?iso={iso}&id_1={id_1}&id_2={id_2}".format(**adm2))
+    assert status == 200 and agglomid in [ir["agglomid"] for ir in result]
+    status, result, _ = _get(service, "/population?iso={iso}&id_1={id_1}&id_2={id_2}&year=2015".format(**adm2))
+    assert status == 200 and result["year"] == 2015 and result["population"] > 0
+
+
+@pytest.mark.parametrize("path", [
+    "/ir_adm2?agglomid=999999",
+    "/ir_adm2?agglomid=abc",
+    "/adm2_irs?iso=XXX&id_1=1&id_2=1",
+    "/adm1_irs?iso=XXX&id_1=1",
+    "/nothing",
+])
+def test_unknown_keys_and_routes_are_404(service, path):
+    status, result, cached = _get(service, path)
+    assert status == 404 and "error" in result
+    assert _get(service, path)[2] is False  # Errors are never cached
+
+
+@pytest.mark.parametrize("year", ["1990", "abc"])
+def test_missing_years_are_404(service, index, year):
+    query = "iso={iso}&id_1={id_1}&id_2={id_2}".format(**_adm2(index))
+    status, result, _ = _get(service, f"/population?{query}&year={year}")
+    assert status == 404 and result["error"].startswith(f"No population for year {year}")
+
+
+@pytest.mark.parametrize("route, body", [
+    ("/batch", b"{not json"),
+    ("/batch", b"[1, 2]"),
+    ("/batch", {"queries": {"type": "ir_adm2"}}),
+    ("/convert", b'"values"'),
+    ("/convert", {"source": "ir", "target": "adm1", "values": {"agglomid": 1}}),
+    ("/convert", {"source": "ir", "target": "adm1", "values": [1, 2]}),
+    ("/convert", {"source": "ir", "target": "country", "values": []}),
+    ("/convert", {"source": "ir", "target": "adm1", "values": [], "how": "median"}),
+])
+def test_malformed_bodies_are_400(service, route, body):
+    status, result = _post(service, route, body)
+    assert status == 400 and "error" in result
+
+
+def test_batch_reports_errors_per_query(service, index):
+    agglomid = float(index.agglomid[0])
+    status, result = _post(service, "/batch", {"queries": [
+        1, {"type": "ir_adm2", "agglomid": 999999}, {"type": "nothing"}, {"type": "ir_adm2", "agglomid": agglomid},
+    ]})
+    assert status == 200
+    assert ["error" in item for item in result["results"]] == [True, True, True, False]
+    assert result["results"][3]["result"] == json.loads(service.handle("GET", f"/ir_adm2?agglomid={agglomid}")[1])
+
+
+def test_convert_keyed_values(service, index):
+    values = [{**_adm2(index, j), "value": 2.0} for j in range(len(index.iso))]
+    status, result = _post(service, "/convert", {"source": "adm2", "target": "adm1", "values": values})
+    assert status == 200 and len(result["values"]) == index.n_adm1
+    assert all(item["value"] == pytest.approx(2.0) for item in result["values"])
+
+    # With one ADM2 given, its ADM1 mean is unknown (left out) and its ADM1 total is the ADM2 value
+    request = {"source": "adm2", "target": "adm1", "values": values[:1]}
+    assert _post(service, "/convert", request) == (200, {"values": []})
+    status, result = _post(service, "/convert", {**request, "how": "sum"})
+    assert status == 200 and [(item["id_1"], item["value"]) for item in result["values"]] == [(values[0]["id_1"], 2.0)]
+
+
+def test_metrics_count_requests(service):
+    _get(service, "/health")
+    _get(service, "/nothing")
+    status, report, _ = _get(service, "/metrics")
+    assert status == 200
+    assert report["routes"]["GET /health"]["requests"] == 1
+    assert report["routes"]["GET /nothing"]["errors"] == 1
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from relations import CASE_ADM2_MULTI_IR, CASE_ONE_TO_ONE, classify_links, component_table
+
+
+def test_unmatched_links_are_left_out_of_the_graph():
+    links = pd.DataFrame({
+        "agglomid": [1, 2, 3, 4, 5],
+        "ISO": ["USA", "USA", "USA", None, None],
+        "ID_1": [1, 1, 1, None, None],
+        "ID_2": [10, 20, 20, None, None],
+    })
+    classified = classify_links(links)
+
+    unmatched = classified[classified["ISO"].isna()]
+    assert (unmatched["adm2_code"] == -1).all()
+    assert (unmatched["component"] == -1).all()
+    assert (unmatched["case"] == 0).all()
+    assert (unmatched["ir_n_adm2"] == 0).all()
+
+    matched = classified[classified["ISO"].notna()].set_index("agglomid")
+    assert matched.loc[1, "case"] == CASE_ONE_TO_ONE
+    assert matched.loc[[2, 3], "case"].tolist() == [CASE_ADM2_MULTI_IR] * 2
+    assert matched.loc[[2, 3], "adm2_n_irs"].tolist() == [2, 2]
+
+    components = component_table(classified)
+    assert len(components) == 2
+    assert components["n_adm2s"].sum() == 2
+
+
+def test_unmatched_codes_from_the_link_table():
+    # 02 and 06 classify on the codes of link_table.add_codes, null for unmatched rows
+    links = pd.DataFrame({
+        "agglomid": [1, 2, 3],
+        "ISO": ["USA", None, None],
+        "adm2_code": pd.array([0, None, None], dtype="Int32"),
+        "adm1_code": pd.array([0, None, None], dtype="Int32"),
+    })
+    classified = classify_links(links, adm2_columns=["adm2_code"], adm1_columns=["adm1_code"])
+    assert classified["case"].tolist() == [CASE_ONE_TO_ONE, 0, 0]
+    assert classified["component"].tolist()[1:] == [-1, -1]
+    assert not classified["crosses_adm1"].any()
+    assert np.array_equal(classified["adm2_code"].to_numpy(), [0, -1, -1])
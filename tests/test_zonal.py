@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+import shapely
+
+from zonal import coverage_fractions, zonal_sums
+
+from conftest import GRID_SHAPE, GRID_TRANSFORM
+
+PIXEL_AREA = GRID_TRANSFORM.a * -GRID_TRANSFORM.e
+
+
+@pytest.mark.parametrize("geom", [
+    shapely.Point(4.02, 3.01).buffer(1.3),
+    shapely.Polygon([(1.01, 1.02), (6.93, 0.57), (3.48, 5.11)]),
+    shapely.box(0.51, 0.53, 7.46, 5.42).difference(shapely.Point(3.97, 2.96).buffer(0.85)),
+])
+def test_coverage_fractions_sum_to_the_polygon_area(geom):
+    fractions = coverage_fractions(geom, GRID_SHAPE, GRID_TRANSFORM)
+    assert fractions.min() >= 0 and fractions.max() <= 1
+    assert fractions.sum() * PIXEL_AREA == pytest.approx(geom.area, rel=1e-6)
+
+
+def test_coverage_fractions_of_a_tiling_sum_to_one(grid):
+    total = sum(coverage_fractions(geom, GRID_SHAPE, GRID_TRANSFORM) for geom in grid["b"].geometry)
+    assert np.allclose(total, 1.0)
+
+
+@pytest.mark.parametrize("raster", ["int", "float"])
+def test_zonal_sums_of_a_tiling_add_up_to_the_raster_total(grid, raster):
+    exact, center = zonal_sums(grid["b"], [grid[raster]], n_workers=1, coverage="exact")
+    assert center.shape == exact.shape == (len(grid["b"]), 1)
+    assert center.sum() == grid["values"].sum()
+    assert exact.sum() == pytest.approx(grid["values"].sum())
+    assert np.array_equal(zonal_sums(grid["b"], [grid[raster]], n_workers=1), center)
+
+
+def test_zonal_sums_center_pixels(grid):
+    # Center-point rule: a polygon gets exactly the pixels whose center it contains
+    cols, rows = np.meshgrid(np.arange(GRID_SHAPE[1]), np.arange(GRID_SHAPE[0]))
+    x, y = GRID_TRANSFORM * (cols + 0.5, rows + 0.5)
+    sums = zonal_sums(grid["a"], [grid["int"], grid["float"]], n_workers=1)
+    for i, geom in enumerate(grid["a"].geometry):
+        inside = shapely.contains_xy(geom, x, y)
+        assert np.array_equal(sums[i], [grid["values"][inside].sum()] * 2)
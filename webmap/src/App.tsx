@@ -23,6 +23,7 @@ const App: React.FC = () => {
     'Case 3: ADM2 = multiple IRs': true,
     'Case 3b: ADM2 ⊃ IR (multi ADM1)': true,
     'Case 4: ADM2 with no IR assigned': true,
+    'Case 5: many-to-many IRs and ADM2s': true,
   });
 
   const [geojsonError, setGeojsonError] = useState<string>('');
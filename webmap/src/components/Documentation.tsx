@@ -116,6 +116,7 @@ const Documentation: React.FC = () => {
           <li><span style={{ color: "yellow" }}>Yellow</span>: <strong>Case 3a</strong> – ADM2 ⊃ IR (1 ADM1)</li>
           <li><span style={{ color: "red" }}>Red</span>: <strong>Case 3b</strong> – ADM2 ⊃ IR (multi ADM1)</li>
           <li><span style={{ color: "grey" }}>Grey</span>: <strong>Case 4</strong> – ADM2 with no IR assigned</li>
+          <li><span style={{ color: "purple" }}>Purple</span>: <strong>Case 5</strong> – many-to-many: several IRs and several ADM2s linked together</li>
         </ul>
         <p>
           <strong>Impact Regions (IR)</strong> are shown in <span style={{ color: "lime" }}>lime green</span>.
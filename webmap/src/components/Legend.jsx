@@ -10,6 +10,7 @@ const CASE_TYPE_GROUPS = {
   'Case 3a: ADM2 ⊃ IR (1 ADM1)': ['Case 3a: ADM2 ⊃ IR (1 ADM1)', 'Case 3: ADM2 = multiple IRs'],
   'Case 3b: ADM2 ⊃ IR (multi ADM1)': ['Case 3b: ADM2 ⊃ IR (multi ADM1)'],
   'Case 4: ADM2 with no IR assigned': ['Case 4: ADM2 with no IR assigned'],
+  'Case 5: many-to-many IRs and ADM2s': ['Case 5: many-to-many IRs and ADM2s'],
 };
 
 const Legend = ({
@@ -50,6 +51,7 @@ const Legend = ({
               canonicalLabel.includes('Case 3a') ? colors.case3a :
               canonicalLabel.includes('Case 3b') ? colors.case3b :
               canonicalLabel.includes('Case 4') ? colors.case4 :
+              canonicalLabel.includes('Case 5') ? colors.case5 :
               colors.defaultCase;
 
             return (
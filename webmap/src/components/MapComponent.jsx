@@ -48,6 +48,8 @@ const MapComponent = ({
         return colors.case3b;
       case caseType === 'Case 4: ADM2 with no IR assigned':
         return colors.case4;
+      case caseType === 'Case 5: many-to-many IRs and ADM2s':
+        return colors.case5;
       default:
         return colors.defaultCase;
     }
@@ -68,6 +70,7 @@ const MapComponent = ({
       'Case 3: ADM2 = multiple IRs', colors.case3a,
       'Case 3b: ADM2 ⊃ IR (multi ADM1)', colors.case3b,
       'Case 4: ADM2 with no IR assigned', colors.case4,
+      'Case 5: many-to-many IRs and ADM2s', colors.case5,
       colors.defaultCase,
     ];
   };
@@ -7,6 +7,7 @@ const colors = {
     case3a: '#ffe74c',
     case3b: '#df2935',
     case4: '#aaaaaa',
+    case5: '#8e44ad',
     defaultCase: '#CCCCCC',
 
     // ADM2 layers